@@ -6,10 +6,44 @@ import sys
 import psycopg2
 from psycopg2 import sql
 from pathlib import Path
+from datetime import date
 
 # Adicionar o diretório pai ao PATH para importar o logger
 sys.path.append(str(Path(__file__).parent.parent))
 from logger import info, error
+from particoes import TABELAS_PARTICIONADAS, criar_default, criar_particao, criar_particoes, inicio_mes, proximo_mes
+
+# Meses à frente com partição já criada (a carga cria as que faltarem)
+MESES_PRE_CRIADOS = 3
+
+# Colunas copiadas ao converter uma tabela antiga (sem partição) para a
+# particionada
+COLUNAS_PARTICIONADAS = {
+    'streams': ['id', 'user_id', 'game_id', 'title', 'viewer_count', 'started_at', 'language', 'thumbnail_url', 'tags'],
+    'videos': ['id', 'stream_id', 'user_id', 'title', 'created_at', 'url', 'view_count', 'language', 'duration'],
+    'clips': ['id', 'url', 'user_id', 'video_id', 'game_id', 'language', 'title', 'view_count', 'created_at', 'duration'],
+}
+
+# Colunas em que o builder permite o LIKE (ROTULOS_CAMPOS em reports/catalogo.py,
+# com o operador pelo tipo do campo no model).
+# O operador LIKE do builder vira icontains, que no Postgres é
+# UPPER(coluna::text) LIKE UPPER('%valor%'): os índices de trigrama usam
+# exatamente essa expressão para que o planner consiga usá-los.
+COLUNAS_TRIGRAMA = [
+    ('users', 'id'),
+    ('users', 'display_name'),
+    ('users', 'broadcaster_type'),
+    ('users', 'description'),
+    ('streams', 'title'),
+    ('streams', 'language'),
+    ('games', 'name'),
+    ('videos', 'title'),
+    ('videos', 'url'),
+    ('videos', 'duration'),
+    ('videos', 'language'),
+    ('clips', 'title'),
+    ('clips', 'url'),
+]
 
 def create_database():
     """
@@ -53,6 +87,71 @@ def create_database():
         error("Erro ao criar banco de dados: {}", str(e))
         return False
 
+def guardar_tabela_antiga(cursor, tabela):
+    """
+    Bancos criados antes do particionamento: copia as linhas para uma tabela
+    temporária e remove a tabela comum, para recriá-la particionada. O
+    CASCADE leva as FKs que apontavam para ela e as views materializadas,
+    recriadas mais adiante.
+    """
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (tabela,))
+    linha = cursor.fetchone()
+    if linha is None or linha[0] != 'r':
+        return False
+
+    colunas = sql.SQL(', ').join(map(sql.Identifier, COLUNAS_PARTICIONADAS[tabela]))
+    cursor.execute(sql.SQL("CREATE TEMP TABLE {} AS SELECT {} FROM {}").format(
+        sql.Identifier(f"{tabela}_antiga"), colunas, sql.Identifier(tabela),
+    ))
+    cursor.execute(sql.SQL("DROP TABLE {} CASCADE").format(sql.Identifier(tabela)))
+    info("Tabela '{}' será convertida para particionada", tabela)
+    return True
+
+def particionar(cursor, tabela, antiga):
+    """
+    Cria a partição DEFAULT e as mensais (do mês atual até MESES_PRE_CRIADOS
+    à frente) e, na conversão, as dos meses das linhas antigas, que voltam
+    para a tabela. Linhas sem data não cabem (a data faz parte da chave) e
+    são guardadas na tabela <tabela>_sem_data, fora das partições.
+    """
+    coluna = TABELAS_PARTICIONADAS[tabela]
+    criar_default(cursor, tabela)
+
+    mes = inicio_mes(date.today())
+    for _ in range(MESES_PRE_CRIADOS + 1):
+        criar_particao(cursor, tabela, mes)
+        mes = proximo_mes(mes)
+
+    if not antiga:
+        return
+
+    copia = sql.Identifier(f"{tabela}_antiga")
+    # A cópia é temporária e a tabela antiga já foi removida: as linhas sem
+    # data vão para uma tabela comum antes de a cópia sumir
+    cursor.execute(sql.SQL("SELECT COUNT(*) FROM {} WHERE {} IS NULL").format(copia, sql.Identifier(coluna)))
+    sem_data = cursor.fetchone()[0]
+    if sem_data:
+        quarentena = sql.Identifier(f"{tabela}_sem_data")
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (f"{tabela}_sem_data",))
+        if cursor.fetchone()[0]:
+            consulta = "INSERT INTO {} SELECT * FROM {} WHERE {} IS NULL"
+        else:
+            consulta = "CREATE TABLE {} AS SELECT * FROM {} WHERE {} IS NULL"
+        cursor.execute(sql.SQL(consulta).format(quarentena, copia, sql.Identifier(coluna)))
+        info("⚠️  {} linhas de '{}' sem {} guardadas em '{}_sem_data'", sem_data, tabela, coluna, tabela)
+
+    cursor.execute(sql.SQL("SELECT DISTINCT date_trunc('month', {})::date FROM {} WHERE {} IS NOT NULL").format(
+        sql.Identifier(coluna), copia, sql.Identifier(coluna),
+    ))
+    criar_particoes(cursor, tabela, [linha[0] for linha in cursor.fetchall()])
+
+    colunas = sql.SQL(', ').join(map(sql.Identifier, COLUNAS_PARTICIONADAS[tabela]))
+    cursor.execute(sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {} WHERE {} IS NOT NULL").format(
+        sql.Identifier(tabela), colunas, colunas, copia, sql.Identifier(coluna),
+    ))
+    info("{} linhas de '{}' copiadas para as partições", cursor.rowcount, tabela)
+    cursor.execute(sql.SQL("DROP TABLE {}").format(copia))
+
 def create_tables():
     """
     Cria todas as tabelas necessárias
@@ -94,45 +193,113 @@ def create_tables():
                 """)
                 info("Tabela 'games' criada")
                 
+                # Tabelas particionadas por mês (RANGE na data): relatórios com
+                # período leem só as partições do intervalo e meses antigos
+                # saem com DROP da partição (particoes.py). A chave primária
+                # precisa incluir a data, então "id" sozinho deixa de ser
+                # único no banco e as FKs que apontavam para streams e videos
+                # (game_stream.stream_id, clips.video_id) não existem mais
+                antigas = {tabela: guardar_tabela_antiga(cursor, tabela) for tabela in TABELAS_PARTICIONADAS}
+                
                 # Tabela STREAMS
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS streams (
-                        id VARCHAR(25) PRIMARY KEY,
+                        id VARCHAR(25) NOT NULL,
                         user_id VARCHAR(25) NOT NULL,
                         game_id VARCHAR(25),
                         title VARCHAR(256),
                         viewer_count INTEGER,
-                        started_at TIMESTAMP,
+                        started_at TIMESTAMP NOT NULL,
                         language VARCHAR(8),
                         thumbnail_url VARCHAR(150),
                         tags VARCHAR(30)[],
+                        PRIMARY KEY (id, started_at),
                         FOREIGN KEY (user_id) REFERENCES users(id),
                         FOREIGN KEY (game_id) REFERENCES games(id)
-                    )
+                    ) PARTITION BY RANGE (started_at)
                 """)
+                particionar(cursor, 'streams', antigas['streams'])
                 info("Tabela 'streams' criada")
                 
+                # Busca textual (busca_global do builder): tsvector com nome do
+                # streamer (peso A), nome do jogo (B), título (C) e idioma (D),
+                # mantido por trigger e servido por um índice GIN. Trigger e
+                # índice criados na tabela particionada valem para todas as
+                # partições (trigger BEFORE em tabela particionada: PG 13+)
+                cursor.execute("ALTER TABLE streams ADD COLUMN IF NOT EXISTS busca tsvector")
+                cursor.execute("""
+                    CREATE OR REPLACE FUNCTION streams_busca_atualizar() RETURNS trigger AS $$
+                    BEGIN
+                        NEW.busca :=
+                            setweight(to_tsvector('simple', coalesce((SELECT display_name FROM users WHERE id = NEW.user_id), '')), 'A') ||
+                            setweight(to_tsvector('simple', coalesce((SELECT name FROM games WHERE id = NEW.game_id), '')), 'B') ||
+                            setweight(to_tsvector('simple', coalesce(NEW.title, '')), 'C') ||
+                            setweight(to_tsvector('simple', coalesce(NEW.language, '')), 'D');
+                        RETURN NEW;
+                    END
+                    $$ LANGUAGE plpgsql
+                """)
+                cursor.execute("DROP TRIGGER IF EXISTS streams_busca ON streams")
+                cursor.execute("""
+                    CREATE TRIGGER streams_busca
+                    BEFORE INSERT OR UPDATE OF user_id, game_id, title, language ON streams
+                    FOR EACH ROW EXECUTE FUNCTION streams_busca_atualizar()
+                """)
+                # Streamer ou jogo renomeado: refaz o tsvector das transmissões
+                # dele (o UPDATE OF title dispara o trigger acima). Os índices
+                # em user_id/game_id evitam varrer todas as partições
+                cursor.execute("CREATE INDEX IF NOT EXISTS streams_user_id ON streams (user_id)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS streams_game_id ON streams (game_id)")
+                cursor.execute("""
+                    CREATE OR REPLACE FUNCTION streams_busca_renomear() RETURNS trigger AS $$
+                    BEGIN
+                        IF TG_TABLE_NAME = 'users' THEN
+                            UPDATE streams SET title = title WHERE user_id = NEW.id;
+                        ELSE
+                            UPDATE streams SET title = title WHERE game_id = NEW.id;
+                        END IF;
+                        RETURN NULL;
+                    END
+                    $$ LANGUAGE plpgsql
+                """)
+                for tabela, coluna in (('users', 'display_name'), ('games', 'name')):
+                    gatilho = sql.Identifier(f"{tabela}_busca_streams")
+                    cursor.execute(sql.SQL("DROP TRIGGER IF EXISTS {} ON {}").format(gatilho, sql.Identifier(tabela)))
+                    cursor.execute(sql.SQL("""
+                        CREATE TRIGGER {gatilho}
+                        AFTER UPDATE OF {coluna} ON {tabela}
+                        FOR EACH ROW WHEN (OLD.{coluna} IS DISTINCT FROM NEW.{coluna})
+                        EXECUTE FUNCTION streams_busca_renomear()
+                    """).format(gatilho=gatilho, coluna=sql.Identifier(coluna), tabela=sql.Identifier(tabela)))
+                # Preenche as linhas carregadas antes da coluna existir (o
+                # UPDATE dispara o trigger)
+                cursor.execute("UPDATE streams SET title = title WHERE busca IS NULL")
+                cursor.execute("CREATE INDEX IF NOT EXISTS streams_busca_gin ON streams USING GIN (busca)")
+                info("Busca textual de 'streams' criada")
+                
                 # Tabela VIDEOS
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS videos (
-                        id VARCHAR(25) PRIMARY KEY,
+                        id VARCHAR(25) NOT NULL,
                         stream_id VARCHAR(25),
                         user_id VARCHAR(25) NOT NULL,
                         title VARCHAR(256),
-                        created_at DATE,
+                        created_at DATE NOT NULL,
                         url VARCHAR(130),
                         view_count INTEGER,
                         language VARCHAR(6),
                         duration VARCHAR(15),
+                        PRIMARY KEY (id, created_at),
                         FOREIGN KEY (user_id) REFERENCES users(id)
-                    )
+                    ) PARTITION BY RANGE (created_at)
                 """)
+                particionar(cursor, 'videos', antigas['videos'])
                 info("Tabela 'videos' criada")
                 
                 # Tabela CLIPS
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS clips (
-                        id VARCHAR(60) PRIMARY KEY,
+                        id VARCHAR(60) NOT NULL,
                         url VARCHAR(100) NOT NULL,
                         user_id VARCHAR(30) NOT NULL,
                         video_id VARCHAR(60),
@@ -140,13 +307,14 @@ def create_tables():
                         language VARCHAR(6),
                         title VARCHAR(256),
                         view_count INTEGER,
-                        created_at DATE,
+                        created_at DATE NOT NULL,
                         duration VARCHAR(15),
+                        PRIMARY KEY (id, created_at),
                         FOREIGN KEY (user_id) REFERENCES users(id),
-                        FOREIGN KEY (video_id) REFERENCES videos(id),
                         FOREIGN KEY (game_id) REFERENCES games(id)
-                    )
+                    ) PARTITION BY RANGE (created_at)
                 """)
+                particionar(cursor, 'clips', antigas['clips'])
                 info("Tabela 'clips' criada")
                 
                 # Tabela GAME_STREAM
@@ -155,12 +323,99 @@ def create_tables():
                         game_id VARCHAR(25) NOT NULL,
                         stream_id VARCHAR(25) NOT NULL,
                         PRIMARY KEY (game_id, stream_id),
-                        FOREIGN KEY (game_id) REFERENCES games(id),
-                        FOREIGN KEY (stream_id) REFERENCES streams(id)
+                        FOREIGN KEY (game_id) REFERENCES games(id)
                     )
                 """)
                 info("Tabela 'game_stream' criada")
                 
+                # Índices de trigrama para os filtros "Contém" (LIKE)
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                for tabela, coluna in COLUNAS_TRIGRAMA:
+                    cursor.execute(sql.SQL(
+                        "CREATE INDEX IF NOT EXISTS {} ON {} USING GIN (upper({}::text) gin_trgm_ops)"
+                    ).format(
+                        sql.Identifier(f"{tabela}_{coluna}_trgm"),
+                        sql.Identifier(tabela),
+                        sql.Identifier(coluna),
+                    ))
+                # clips.duration é FloatField no catálogo, sem LIKE: o índice
+                # de bancos antigos nunca seria usado
+                cursor.execute("DROP INDEX IF EXISTS clips_duration_trgm")
+                info("Índices de trigrama criados")
+                
+                # Tabela ETL_VERSAO (versão dos dados, usada nos caches do Django)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS etl_versao (
+                        id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                        versao BIGINT NOT NULL DEFAULT 0,
+                        atualizado_em TIMESTAMP NOT NULL DEFAULT now()
+                    )
+                """)
+                cursor.execute("""
+                    INSERT INTO etl_versao (id, versao) VALUES (1, 0)
+                    ON CONFLICT (id) DO NOTHING
+                """)
+                info("Tabela 'etl_versao' criada")
+                
+                # Views materializadas dos filtros rápidos do builder.
+                # "posicao" é a ordem por total de visualizações; os relatórios
+                # leem só as primeiras posições. O índice único em "id" é
+                # exigido pelo REFRESH ... CONCURRENTLY do fim da carga.
+                cursor.execute("""
+                    CREATE MATERIALIZED VIEW IF NOT EXISTS mv_top_streamers AS
+                    SELECT
+                        row_number() OVER (ORDER BY t.total_views DESC NULLS FIRST, t.id DESC) AS posicao,
+                        t.*
+                    FROM (
+                        SELECT u.id, u.display_name, u.broadcaster_type,
+                               SUM(s.viewer_count) AS total_views
+                        FROM streams s
+                        JOIN users u ON u.id = s.user_id
+                        GROUP BY u.id, u.display_name, u.broadcaster_type
+                    ) t
+                """)
+                cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS mv_top_streamers_id ON mv_top_streamers (id)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS mv_top_streamers_posicao ON mv_top_streamers (posicao)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS mv_top_streamers_total_views ON mv_top_streamers (total_views DESC)")
+                info("View materializada 'mv_top_streamers' criada")
+                
+                cursor.execute("""
+                    CREATE MATERIALIZED VIEW IF NOT EXISTS mv_jogos_populares AS
+                    SELECT
+                        row_number() OVER (ORDER BY t.total_views DESC NULLS FIRST, t.id DESC) AS posicao,
+                        t.*
+                    FROM (
+                        SELECT g.id, g.name, SUM(s.viewer_count) AS total_views
+                        FROM streams s
+                        JOIN games g ON g.id = s.game_id
+                        GROUP BY g.id, g.name
+                    ) t
+                """)
+                cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS mv_jogos_populares_id ON mv_jogos_populares (id)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS mv_jogos_populares_posicao ON mv_jogos_populares (posicao)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS mv_jogos_populares_total_views ON mv_jogos_populares (total_views DESC)")
+                info("View materializada 'mv_jogos_populares' criada")
+                
+                cursor.execute("""
+                    CREATE MATERIALIZED VIEW IF NOT EXISTS mv_brpt AS
+                    SELECT
+                        row_number() OVER (ORDER BY t.total_views DESC NULLS FIRST, t.user_id DESC, t.language DESC) AS posicao,
+                        t.*
+                    FROM (
+                        SELECT u.id || ':' || s.language AS id,
+                               u.id AS user_id, u.display_name, u.broadcaster_type, s.language,
+                               SUM(s.viewer_count) AS total_views
+                        FROM streams s
+                        JOIN users u ON u.id = s.user_id
+                        WHERE s.language IN ('pt', 'pt-br', 'br')
+                        GROUP BY u.id, u.display_name, u.broadcaster_type, s.language
+                    ) t
+                """)
+                cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS mv_brpt_id ON mv_brpt (id)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS mv_brpt_posicao ON mv_brpt (posicao)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS mv_brpt_total_views ON mv_brpt (total_views DESC)")
+                info("View materializada 'mv_brpt' criada")
+                
                 conn.commit()
                 info("Todas as tabelas foram criadas!")
                 
@@ -6,6 +6,7 @@ import os
 import sys
 import json
 import psycopg2
+from psycopg2 import sql
 from psycopg2.extras import execute_values
 from pathlib import Path
 from datetime import datetime
@@ -14,6 +15,10 @@ from typing import List, Dict, Any
 # Adicionar o diretório pai ao PATH para importar o logger
 sys.path.append(str(Path(__file__).parent.parent))
 from logger import info, error
+from particoes import TABELAS_PARTICIONADAS, criar_particoes
+
+# Views materializadas dos filtros rápidos (criadas em create_tables.py)
+VIEWS_MATERIALIZADAS = ['mv_top_streamers', 'mv_jogos_populares', 'mv_brpt']
 
 class DataLoader:
     """
@@ -95,6 +100,50 @@ class DataLoader:
         except Exception:
             return None
     
+    def com_data(self, values, indice, tabela):
+        """
+        Descarta as linhas sem a data da partição (ela faz parte da chave
+        primária das tabelas particionadas)
+        """
+        validos = [v for v in values if v[indice] is not None]
+        if len(validos) < len(values):
+            info("⚠️  {} registros de '{}' sem data ignorados", len(values) - len(validos), tabela)
+        return validos
+    
+    def com_id_unico(self, cursor, values, indice, tabela):
+        """
+        A chave primária das tabelas particionadas é (id, data), então o
+        banco aceita o mesmo id em duas datas. A carga mantém o id único (os
+        models do Django e o desempate da paginação contam com isso): id
+        repetido no lote fica com a última linha, e o id já gravado com outra
+        data tem a linha antiga removida antes do INSERT, já que é o mesmo
+        registro com a data corrigida.
+        """
+        coluna = TABELAS_PARTICIONADAS[tabela]
+        values = list({v[0]: v for v in values}.values())
+        if not values:
+            return values
+        
+        cursor.execute(
+            "SELECT format_type(atttypid, atttypmod) FROM pg_attribute WHERE attrelid = to_regclass(%s) AND attname = %s",
+            (tabela, coluna)
+        )
+        tipo = cursor.fetchone()[0]
+        execute_values(
+            cursor,
+            sql.SQL("""
+                DELETE FROM {tabela} t
+                USING (VALUES %s) AS n (id, data)
+                WHERE t.id = n.id AND t.{coluna} <> CAST(n.data AS {tipo})
+            """).format(tabela=sql.Identifier(tabela), coluna=sql.Identifier(coluna), tipo=sql.SQL(tipo)),
+            [(v[0], v[indice]) for v in values],
+            # Um comando só: o rowcount cobre o lote inteiro
+            page_size=len(values)
+        )
+        if cursor.rowcount > 0:
+            info("⚠️  {} registros de '{}' mudaram de data e foram substituídos", cursor.rowcount, tabela)
+        return values
+    
     def load_users(self, conn, data: Dict[str, Any]) -> bool:
         """
         Carrega dados dos usuários
@@ -223,18 +272,20 @@ class DataLoader:
                             stream.get('id')
                         ))
                 
-                # Inserir streams
+                # Inserir streams (partições dos meses da carga antes)
+                values = self.com_data(values, 5, 'streams')
+                values = self.com_id_unico(cursor, values, 5, 'streams')
+                criar_particoes(cursor, 'streams', [v[5] for v in values])
                 execute_values(
                     cursor,
                     """
                     INSERT INTO streams (id, user_id, game_id, title, viewer_count, started_at, language, thumbnail_url, tags)
                     VALUES %s
-                    ON CONFLICT (id) DO UPDATE SET
+                    ON CONFLICT (id, started_at) DO UPDATE SET
                         user_id = EXCLUDED.user_id,
                         game_id = EXCLUDED.game_id,
                         title = EXCLUDED.title,
                         viewer_count = EXCLUDED.viewer_count,
-                        started_at = EXCLUDED.started_at,
                         language = EXCLUDED.language,
                         thumbnail_url = EXCLUDED.thumbnail_url,
                         tags = EXCLUDED.tags
@@ -291,17 +342,19 @@ class DataLoader:
                         video.get('duration')
                     ))
                 
-                # Inserção em lote
+                # Inserção em lote (partições dos meses da carga antes)
+                values = self.com_data(values, 4, 'videos')
+                values = self.com_id_unico(cursor, values, 4, 'videos')
+                criar_particoes(cursor, 'videos', [v[4] for v in values])
                 execute_values(
                     cursor,
                     """
                     INSERT INTO videos (id, stream_id, user_id, title, created_at, url, view_count, language, duration)
                     VALUES %s
-                    ON CONFLICT (id) DO UPDATE SET
+                    ON CONFLICT (id, created_at) DO UPDATE SET
                         stream_id = EXCLUDED.stream_id,
                         user_id = EXCLUDED.user_id,
                         title = EXCLUDED.title,
-                        created_at = EXCLUDED.created_at,
                         url = EXCLUDED.url,
                         view_count = EXCLUDED.view_count,
                         language = EXCLUDED.language,
@@ -347,13 +400,16 @@ class DataLoader:
                         clip.get('duration')
                     ))
                 
-                # Inserção em lote
+                # Inserção em lote (partições dos meses da carga antes)
+                values = self.com_data(values, 8, 'clips')
+                values = self.com_id_unico(cursor, values, 8, 'clips')
+                criar_particoes(cursor, 'clips', [v[8] for v in values])
                 execute_values(
                     cursor,
                     """
                     INSERT INTO clips (id, url, user_id, video_id, game_id, language, title, view_count, created_at, duration)
                     VALUES %s
-                    ON CONFLICT (id) DO UPDATE SET
+                    ON CONFLICT (id, created_at) DO UPDATE SET
                         url = EXCLUDED.url,
                         user_id = EXCLUDED.user_id,
                         video_id = EXCLUDED.video_id,
@@ -361,7 +417,6 @@ class DataLoader:
                         language = EXCLUDED.language,
                         title = EXCLUDED.title,
                         view_count = EXCLUDED.view_count,
-                        created_at = EXCLUDED.created_at,
                         duration = EXCLUDED.duration
                     """,
                     values
@@ -377,6 +432,53 @@ class DataLoader:
             conn.rollback()
             return False
 
+    def atualizar_views_materializadas(self, conn) -> bool:
+        """
+        Recalcula as views materializadas dos filtros rápidos. CONCURRENTLY
+        não bloqueia as leituras do builder durante o refresh.
+        """
+        try:
+            with conn.cursor() as cursor:
+                for view in VIEWS_MATERIALIZADAS:
+                    cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}")
+                    conn.commit()
+                    info("🔄 View materializada '{}' atualizada", view)
+                    
+            return True
+            
+        except Exception as e:
+            error("❌ Erro ao atualizar views materializadas: {}", str(e))
+            conn.rollback()
+            return False
+    
+    def registrar_versao_dados(self, conn) -> bool:
+        """
+        Incrementa a versão dos dados ao final da carga, invalidando os
+        caches do app de relatórios (métricas, resultados, gráficos)
+        """
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    INSERT INTO etl_versao (id, versao, atualizado_em)
+                    VALUES (1, 1, now())
+                    ON CONFLICT (id) DO UPDATE SET
+                        versao = etl_versao.versao + 1,
+                        atualizado_em = now()
+                    RETURNING versao
+                    """
+                )
+                versao = cursor.fetchone()[0]
+                conn.commit()
+                info("🔖 Versão dos dados atualizada para {}", versao)
+                
+            return True
+            
+        except Exception as e:
+            error("❌ Erro ao registrar versão dos dados: {}", str(e))
+            conn.rollback()
+            return False
+
 def main():
     """
     Função principal para executar o carregamento
@@ -421,6 +523,11 @@ def main():
                 error("❌ Falha ao carregar tabela '{}'", table_name)
         
         if success_count > 0:
+            # Só depois da carga terminar: atualiza os filtros rápidos e
+            # invalida os caches do Django
+            loader.atualizar_views_materializadas(conn)
+            loader.registrar_versao_dados(conn)
+            
             info("")
             info("🎉 CARREGAMENTO CONCLUÍDO! {} tabelas carregadas", success_count)
             return True
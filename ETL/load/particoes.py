@@ -0,0 +1,182 @@
+"""
+Partições mensais das tabelas particionadas por data (streams, videos, clips).
+Usado pelo create_tables.py e pelo load_data.py; executado direto, remove as
+partições mais antigas que o período mantido.
+"""
+
+import re
+import sys
+import argparse
+from psycopg2 import sql
+from pathlib import Path
+from datetime import date, datetime
+
+# Adicionar o diretório pai ao PATH para importar o logger
+sys.path.append(str(Path(__file__).parent.parent))
+from logger import info, error
+
+# Tabela -> coluna da chave de partição (RANGE, uma partição por mês)
+TABELAS_PARTICIONADAS = {
+    'streams': 'started_at',
+    'videos': 'created_at',
+    'clips': 'created_at',
+}
+
+def inicio_mes(valor):
+    """
+    Primeiro dia do mês de uma data/datetime
+    """
+    if isinstance(valor, datetime):
+        valor = valor.date()
+    return valor.replace(day=1)
+
+def proximo_mes(mes):
+    """
+    Primeiro dia do mês seguinte
+    """
+    if mes.month == 12:
+        return date(mes.year + 1, 1, 1)
+    return date(mes.year, mes.month + 1, 1)
+
+def nome_particao(tabela, mes):
+    return f"{tabela}_p{mes.year:04d}_{mes.month:02d}"
+
+def nome_default(tabela):
+    return f"{tabela}_default"
+
+def criar_default(cursor, tabela):
+    """
+    Partição DEFAULT: recebe linhas de meses sem partição própria
+    """
+    cursor.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} DEFAULT").format(
+        sql.Identifier(nome_default(tabela)),
+        sql.Identifier(tabela),
+    ))
+
+def criar_particao(cursor, tabela, mes):
+    """
+    Cria a partição do mês, se ainda não existe. Linhas do mês que já caíram
+    na DEFAULT são movidas para ela (senão o Postgres recusa a partição).
+    """
+    particao = nome_particao(tabela, mes)
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (particao,))
+    if cursor.fetchone()[0]:
+        return False
+
+    coluna = TABELAS_PARTICIONADAS[tabela]
+    limites = (mes, proximo_mes(mes))
+    valores = sql.SQL("FOR VALUES FROM ({}) TO ({})").format(sql.Literal(limites[0]), sql.Literal(limites[1]))
+    intervalo = sql.SQL("{} >= %s AND {} < %s").format(sql.Identifier(coluna), sql.Identifier(coluna))
+
+    cursor.execute(
+        sql.SQL("SELECT EXISTS (SELECT 1 FROM {} WHERE {})").format(sql.Identifier(nome_default(tabela)), intervalo),
+        limites,
+    )
+    if cursor.fetchone()[0]:
+        cursor.execute(sql.SQL("CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS)").format(
+            sql.Identifier(particao), sql.Identifier(tabela),
+        ))
+        cursor.execute(
+            sql.SQL("WITH movidas AS (DELETE FROM {} WHERE {} RETURNING *) INSERT INTO {} SELECT * FROM movidas").format(
+                sql.Identifier(nome_default(tabela)), intervalo, sql.Identifier(particao),
+            ),
+            limites,
+        )
+        cursor.execute(sql.SQL("ALTER TABLE {} ATTACH PARTITION {} {}").format(
+            sql.Identifier(tabela), sql.Identifier(particao), valores,
+        ))
+    else:
+        cursor.execute(sql.SQL("CREATE TABLE {} PARTITION OF {} {}").format(
+            sql.Identifier(particao), sql.Identifier(tabela), valores,
+        ))
+    info("🗂️  Partição '{}' criada", particao)
+    return True
+
+def criar_particoes(cursor, tabela, datas):
+    """
+    Garante as partições dos meses das datas informadas (None é ignorado)
+    """
+    meses = sorted({inicio_mes(d) for d in datas if d is not None})
+    for mes in meses:
+        criar_particao(cursor, tabela, mes)
+    return meses
+
+def listar_particoes(cursor, tabela):
+    """
+    [(mês, nome)] das partições mensais existentes da tabela
+    """
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+    """, (tabela,))
+    padrao = re.compile(rf"^{re.escape(tabela)}_p(\d{{4}})_(\d{{2}})$")
+    particoes = []
+    for (nome,) in cursor.fetchall():
+        encontrado = padrao.match(nome)
+        if encontrado:
+            particoes.append((date(int(encontrado.group(1)), int(encontrado.group(2)), 1), nome))
+    return sorted(particoes)
+
+def remover_particoes_antigas(cursor, tabela, manter_meses):
+    """
+    Remove as partições anteriores aos últimos `manter_meses` meses. Um DROP
+    da partição é instantâneo, no lugar de um DELETE das linhas antigas.
+    """
+    limite = inicio_mes(date.today())
+    for _ in range(manter_meses - 1):
+        limite = date(limite.year - 1, 12, 1) if limite.month == 1 else date(limite.year, limite.month - 1, 1)
+
+    removidas = []
+    for mes, nome in listar_particoes(cursor, tabela):
+        if mes < limite:
+            cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(nome)))
+            removidas.append(nome)
+            info("🗑️  Partição '{}' removida", nome)
+    return removidas
+
+def main():
+    """
+    Remove as partições antigas de todas as tabelas particionadas e atualiza
+    as views materializadas e a versão dos dados (caches do Django)
+    """
+    parser = argparse.ArgumentParser(description="Remove partições mensais antigas")
+    parser.add_argument('--manter-meses', type=int, required=True,
+                        help="Quantidade de meses mantidos (incluindo o atual)")
+    args = parser.parse_args()
+    if args.manter_meses < 1:
+        error("❌ --manter-meses precisa ser ao menos 1")
+        return False
+
+    from load_data import DataLoader
+
+    loader = DataLoader()
+    conn = loader.connect_database()
+    if not conn:
+        return False
+
+    try:
+        removidas = []
+        with conn.cursor() as cursor:
+            for tabela in TABELAS_PARTICIONADAS:
+                removidas += remover_particoes_antigas(cursor, tabela, args.manter_meses)
+        conn.commit()
+        info("✅ {} partições removidas", len(removidas))
+
+        if removidas:
+            loader.atualizar_views_materializadas(conn)
+            loader.registrar_versao_dados(conn)
+        return True
+
+    except Exception as e:
+        error("❌ Erro ao remover partições: {}", str(e))
+        conn.rollback()
+        return False
+
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -3,6 +3,11 @@ ASGI config for ad_hoc_django project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve with an ASGI server (e.g. ``uvicorn ad_hoc_django.asgi:application
+--workers 4``) so the async views (``/reports/builder/async/``) don't pin a
+worker while waiting on Postgres. Under WSGI they still run their queries
+concurrently, but each request holds its worker until the page is done.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
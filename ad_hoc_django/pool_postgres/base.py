@@ -0,0 +1,29 @@
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgresDatabaseWrapper
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+from .pool import obter_pool
+
+
+class DatabaseWrapper(PostgresDatabaseWrapper):
+    """
+    Backend do Postgres com pool de conexões (DATABASES[...]["POOL"]). O
+    Django "fecha" a conexão no fim de cada request (CONN_MAX_AGE = 0); aqui
+    isso a devolve ao pool, e o request seguinte a retira sem pagar conexão
+    e autenticação.
+    """
+
+    def get_new_connection(self, conn_params):
+        # Pool pelos parâmetros da conexão: com o NAME/HOST trocado (banco de
+        # teste, fallback do _nodb_cursor) não sai conexão do banco anterior
+        self.pool = obter_pool(self.alias, self.settings_dict.get("POOL", {}), conn_params)
+        conexao = self.pool.obter(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        # Na conexão nova o Django já define; na reaproveitada, o wrapper
+        # desta thread ainda não tem o nível de isolamento
+        nivel = self.settings_dict["OPTIONS"].get("isolation_level")
+        self.isolation_level = IsolationLevel(nivel) if nivel is not None else IsolationLevel.READ_COMMITTED
+        return conexao
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.devolver(self.connection)
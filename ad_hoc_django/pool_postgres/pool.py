@@ -0,0 +1,221 @@
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+
+class PoolConexoes:
+    """
+    Pool limitado de conexões psycopg2, compartilhado pelas threads de um
+    processo. Sem conexão ociosa e com o pool cheio, obter() espera até
+    `timeout` segundos por uma devolução antes de falhar. Na retirada, uma
+    conexão ociosa há mais de `verificar_apos` segundos passa por um SELECT 1.
+    """
+
+    def __init__(self, tamanho_max=10, timeout=10.0, verificar_apos=10.0, vida_max=1800.0):
+        self.tamanho_max = tamanho_max
+        self.timeout = timeout
+        self.verificar_apos = verificar_apos
+        self.vida_max = vida_max
+        self._cond = threading.Condition()
+        # (conexão, devolvida em); retirada do fim (a mais recente, mais quente)
+        self._ociosas = deque()
+        self._criadas_em = {}
+        self._abertas = 0
+        self._pid = os.getpid()
+        # Substituído por um pool de outros parâmetros: nada volta a ficar ocioso
+        self._encerrado = False
+
+        self.retiradas = 0
+        self.esperas = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self.timeouts = 0
+        self.criadas = 0
+        self.descartadas = 0
+
+    # ======================
+    # RETIRADA / DEVOLUÇÃO
+    # ======================
+    def obter(self, conectar):
+        inicio = time.monotonic()
+        while True:
+            conexao, devolvida = self._reservar(inicio)
+            if conexao is None:
+                return self._nova(conectar)
+            if self._saudavel(conexao, devolvida):
+                return conexao
+            # Quebrada ou velha: descarta e tenta de novo no tempo restante
+            self._descartar(conexao)
+
+    def devolver(self, conexao):
+        reutilizar = not conexao.closed
+        if reutilizar and conexao.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            # Transação aberta (ou abortada) não volta para o próximo request
+            try:
+                conexao.rollback()
+            except psycopg2.Error:
+                reutilizar = False
+        if reutilizar and (self._encerrado or self._velha(conexao)):
+            reutilizar = False
+
+        if not reutilizar:
+            self._descartar(conexao)
+            return
+        with self._cond:
+            self._ociosas.append((conexao, time.monotonic()))
+            self._cond.notify()
+
+    def _reservar(self, inicio):
+        with self._cond:
+            esperou = False
+            while True:
+                if self._ociosas:
+                    conexao, devolvida = self._ociosas.pop()
+                    break
+                if self._abertas < self.tamanho_max:
+                    # Vaga para uma conexão nova, aberta fora do lock
+                    self._abertas += 1
+                    conexao, devolvida = None, None
+                    break
+                restante = self.timeout - (time.monotonic() - inicio)
+                if restante <= 0:
+                    self.timeouts += 1
+                    raise psycopg2.OperationalError(
+                        f"Pool de conexões esgotado: {self.tamanho_max} em uso há mais de {self.timeout}s"
+                    )
+                esperou = True
+                self._cond.wait(restante)
+
+            espera = time.monotonic() - inicio
+            self.retiradas += 1
+            if esperou:
+                self.esperas += 1
+            self.espera_total += espera
+            self.espera_max = max(self.espera_max, espera)
+            return conexao, devolvida
+
+    def _nova(self, conectar):
+        try:
+            conexao = conectar()
+        except Exception:
+            with self._cond:
+                self._abertas -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._criadas_em[id(conexao)] = time.monotonic()
+            self.criadas += 1
+        return conexao
+
+    def _descartar(self, conexao):
+        try:
+            conexao.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._criadas_em.pop(id(conexao), None)
+            self._abertas -= 1
+            self.descartadas += 1
+            self._cond.notify()
+
+    # ======================
+    # HEALTH CHECK
+    # ======================
+    def _velha(self, conexao):
+        criada = self._criadas_em.get(id(conexao), time.monotonic())
+        return bool(self.vida_max) and time.monotonic() - criada > self.vida_max
+
+    def _saudavel(self, conexao, devolvida):
+        if conexao.closed or self._velha(conexao):
+            return False
+        if time.monotonic() - devolvida < self.verificar_apos:
+            return True
+        try:
+            with conexao.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            if conexao.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                # Sem autocommit o SELECT abre uma transação
+                conexao.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    # ======================
+    # MÉTRICAS
+    # ======================
+    def metricas(self):
+        with self._cond:
+            ociosas = len(self._ociosas)
+            return {
+                "tamanho_max": self.tamanho_max,
+                "abertas": self._abertas,
+                "em_uso": self._abertas - ociosas,
+                "ociosas": ociosas,
+                "retiradas": self.retiradas,
+                "esperas": self.esperas,
+                "espera_media_ms": round(self.espera_total / self.retiradas * 1000, 3) if self.retiradas else 0.0,
+                "espera_max_ms": round(self.espera_max * 1000, 3),
+                "timeouts": self.timeouts,
+                "criadas": self.criadas,
+                "descartadas": self.descartadas,
+            }
+
+    def fechar_ociosas(self):
+        with self._cond:
+            ociosas, self._ociosas = list(self._ociosas), deque()
+        for conexao, _ in ociosas:
+            self._descartar(conexao)
+
+    def encerrar(self):
+        # As ociosas fecham agora; as em uso, quando forem devolvidas
+        with self._cond:
+            self._encerrado = True
+        self.fechar_ociosas()
+
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def _chave_parametros(parametros):
+    return tuple(sorted((nome, repr(valor)) for nome, valor in parametros.items()))
+
+
+def obter_pool(alias, configuracao, parametros=None):
+    """
+    Pool do alias e dos parâmetros de conexão no processo atual. Parâmetros
+    diferentes (ex.: o test runner trocando NAME por test_<nome>) são outro
+    banco: o pool anterior do alias é encerrado, e nenhuma conexão aberta
+    para um banco é entregue para outro. Depois de um fork (workers do
+    gunicorn) o processo filho cria o seu: conexões não atravessam processos.
+    """
+    chave = _chave_parametros(parametros or {})
+    substituido = None
+    with _lock:
+        atual = _pools.get(alias)
+        if atual is not None and atual[0] == chave and atual[1]._pid == os.getpid():
+            return atual[1]
+        pool = PoolConexoes(
+            tamanho_max=configuracao.get("MAX_SIZE", 10),
+            timeout=configuracao.get("TIMEOUT", 10.0),
+            verificar_apos=configuracao.get("CHECK_IDLE", 10.0),
+            vida_max=configuracao.get("MAX_LIFETIME", 1800.0),
+        )
+        # O pool herdado do processo pai só é esquecido: fechar as conexões
+        # dele aqui derrubaria as do pai, que usam os mesmos sockets
+        if atual is not None and atual[1]._pid == os.getpid():
+            substituido = atual[1]
+        _pools[alias] = (chave, pool)
+    if substituido is not None:
+        substituido.encerrar()
+    return pool
+
+
+def metricas_pools():
+    with _lock:
+        pools = dict(_pools)
+    return {alias: pool.metricas() for alias, (_, pool) in pools.items() if pool._pid == os.getpid()}
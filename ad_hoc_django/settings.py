@@ -54,6 +54,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.humanize',
+    'django.contrib.postgres',
 
     # seu app de relatórios ad-hoc
     'reports',
@@ -85,17 +86,53 @@ WSGI_APPLICATION = 'ad_hoc_django.wsgi.application'
 # --------------------------------------------------
 # DATABASES
 # --------------------------------------------------
+# Pool de conexões por processo (ad_hoc_django/pool_postgres): no fim do
+# request a conexão volta ao pool em vez de fechar. O total no Postgres é
+# processos x DB_POOL_MAX_SIZE, que precisa caber no max_connections; no pico,
+# o request espera até DB_POOL_TIMEOUT segundos por uma conexão livre.
+# CONN_MAX_AGE fica 0: quem reaproveita as conexões é o pool
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'ad_hoc_django.pool_postgres' if config('DB_POOL', cast=bool, default=True) else 'django.db.backends.postgresql',
         'HOST':   config('DB_HOST', default='localhost'),
         'PORT':   config('DB_PORT', default='5432'),
         'NAME':   config('DB_NAME', default='twitch_2'),
         'USER':   config('DB_USER', default='postgres'),
         'PASSWORD': config('DB_PASSWORD', default='postgres'),
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'MAX_SIZE': config('DB_POOL_MAX_SIZE', cast=int, default=10),
+            'TIMEOUT': config('DB_POOL_TIMEOUT', cast=float, default=10.0),
+            # Ociosa há mais que isso (s): SELECT 1 antes de entregar
+            'CHECK_IDLE': config('DB_POOL_CHECK_IDLE', cast=float, default=10.0),
+            # Conexões são recicladas depois desse tempo (s)
+            'MAX_LIFETIME': config('DB_POOL_MAX_LIFETIME', cast=float, default=1800.0),
+        },
     }
 }
 
+# Réplica de leitura opcional (DB_REPLICA_HOST): relatórios, exportações e
+# métricas leem dela pelo reports.replica.RoteadorReplica, com volta ao
+# primário se ela cair, atrasar mais que REPORTS_REPLICA_MAX_LAG segundos ou
+# ainda não tiver a última carga do ETL
+if config('DB_REPLICA_HOST', default=''):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': config('DB_REPLICA_HOST'),
+        'PORT': config('DB_REPLICA_PORT', default=DATABASES['default']['PORT']),
+        'NAME': config('DB_REPLICA_NAME', default=DATABASES['default']['NAME']),
+        'USER': config('DB_REPLICA_USER', default=DATABASES['default']['USER']),
+        'PASSWORD': config('DB_REPLICA_PASSWORD', default=DATABASES['default']['PASSWORD']),
+        # Réplica fora do ar não pode segurar o request até o timeout do TCP
+        'OPTIONS': {'connect_timeout': config('DB_REPLICA_CONNECT_TIMEOUT', cast=int, default=2)},
+        'POOL': dict(DATABASES['default']['POOL']),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['reports.replica.RoteadorReplica']
+
+REPORTS_REPLICA_MAX_LAG = config('REPORTS_REPLICA_MAX_LAG', cast=float, default=30.0)
+REPORTS_REPLICA_CHECK_INTERVAL = config('REPORTS_REPLICA_CHECK_INTERVAL', cast=float, default=5.0)
+
 
 # --------------------------------------------------
 # AUTH PASSWORD VALIDATION
@@ -129,6 +166,56 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# --------------------------------------------------
+# RELATÓRIOS (caches)
+# --------------------------------------------------
+# Segundos entre leituras da versão dos dados do ETL (tabela etl_versao)
+REPORTS_DATA_VERSION_TTL = config('REPORTS_DATA_VERSION_TTL', cast=int, default=5)
+
+# Cache em memória dos resultados do builder: TTL (s), linhas no total e
+# tamanho máximo de um relatório para ser guardado inteiro
+REPORTS_RESULT_CACHE_TTL = config('REPORTS_RESULT_CACHE_TTL', cast=int, default=600)
+REPORTS_RESULT_CACHE_MAX_ROWS = config('REPORTS_RESULT_CACHE_MAX_ROWS', cast=int, default=200000)
+REPORTS_RESULT_CACHE_MAX_ROWS_REPORT = config('REPORTS_RESULT_CACHE_MAX_ROWS_REPORT', cast=int, default=5000)
+
+# Contagens estimadas (reltuples / EXPLAIN) na paginação e no painel; abaixo
+# do limite a contagem exata é barata e é usada
+REPORTS_ESTIMATED_COUNT = config('REPORTS_ESTIMATED_COUNT', cast=bool, default=True)
+REPORTS_EXACT_COUNT_THRESHOLD = config('REPORTS_EXACT_COUNT_THRESHOLD', cast=int, default=100000)
+
+# Linhas lidas das views materializadas pelos filtros rápidos (top N)
+REPORTS_QUICK_FILTER_LIMIT = config('REPORTS_QUICK_FILTER_LIMIT', cast=int, default=100)
+
+# Log (JSONL) dos relatórios gerados no builder, lido pelo comando
+# sugerir_indices. Vazio desliga o registro. Rotacionado por tamanho,
+# guardando REPORTS_WORKLOAD_LOG_BACKUPS arquivos anteriores
+REPORTS_WORKLOAD_LOG = config('REPORTS_WORKLOAD_LOG', default=str(BASE_DIR / 'cache' / 'carga_trabalho.jsonl'))
+REPORTS_WORKLOAD_LOG_MAX_BYTES = config('REPORTS_WORKLOAD_LOG_MAX_BYTES', cast=int, default=50 * 1024 * 1024)
+REPORTS_WORKLOAD_LOG_BACKUPS = config('REPORTS_WORKLOAD_LOG_BACKUPS', cast=int, default=3)
+
+# Quantas medições recentes de relatórios ficam em memória para o endpoint
+# de depuração (/reports/debug/relatorios-lentos/, só com DEBUG)
+REPORTS_INSTRUMENTATION_BUFFER = config('REPORTS_INSTRUMENTATION_BUFFER', cast=int, default=200)
+
+# Cache em disco dos PNGs dos gráficos
+REPORTS_CHART_CACHE_DIR = config('REPORTS_CHART_CACHE_DIR', default=str(BASE_DIR / 'cache' / 'graficos'))
+REPORTS_CHART_CACHE_MAX_BYTES = config('REPORTS_CHART_CACHE_MAX_BYTES', cast=int, default=50 * 1024 * 1024)
+REPORTS_CHART_MAX_AGE = config('REPORTS_CHART_MAX_AGE', cast=int, default=300)
+
+# Pool de processos que renderiza os gráficos (0 = min(4, núcleos))
+REPORTS_CHART_WORKERS = config('REPORTS_CHART_WORKERS', cast=int, default=0)
+REPORTS_CHART_QUEUE = config('REPORTS_CHART_QUEUE', cast=int, default=0)
+REPORTS_CHART_TIMEOUT = config('REPORTS_CHART_TIMEOUT', cast=int, default=10)
+
+# Exportações em segundo plano: threads por processo, fila de tarefas
+# pendentes (0 = workers * 4), diretório dos arquivos e por quanto tempo (s)
+# um arquivo pronto fica disponível para download
+REPORTS_EXPORT_JOB_WORKERS = config('REPORTS_EXPORT_JOB_WORKERS', cast=int, default=2)
+REPORTS_EXPORT_JOB_QUEUE = config('REPORTS_EXPORT_JOB_QUEUE', cast=int, default=0)
+REPORTS_EXPORT_JOBS_DIR = config('REPORTS_EXPORT_JOBS_DIR', default=str(BASE_DIR / 'cache' / 'exportacoes'))
+REPORTS_EXPORT_JOB_TTL = config('REPORTS_EXPORT_JOB_TTL', cast=int, default=6 * 3600)
+
+
 # --------------------------------------------------
 # CREDENCIAIS DA TWITCH (opcionalmente disponíveis via settings)
 # --------------------------------------------------
@@ -136,3 +223,40 @@ TWITCH_CLIENT_ID     = config('TWITCH_CLIENT_ID', default='')
 TWITCH_CLIENT_SECRET = config('TWITCH_CLIENT_SECRET', default='')
 TWITCH_REDIRECT_URI  = config('TWITCH_REDIRECT_URI', default='')
 TWITCH_TOKEN         = config('TWITCH_TOKEN', default='')
+
+
+# --------------------------------------------------
+# LOGGING
+# --------------------------------------------------
+# Uma linha JSON por relatório (SQL, tempo de banco, linhas, tempo de Python
+# e de renderização), no logger reports.instrumentacao
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'mensagem': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'mensagem',
+        },
+    },
+    'loggers': {
+        'reports.instrumentacao': {
+            'handlers': ['console'],
+            'level': config('REPORTS_INSTRUMENTATION_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+        'reports.tarefas_exportacao': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'reports.replica': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ReportsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'reports'
+
+    def ready(self):
+        # Esquema do builder montado uma vez, não a cada request
+        from . import catalogo
+        catalogo.carregar()
+        # Registra o sinal que vigia as conexões da réplica
+        from . import replica  # noqa: F401
@@ -0,0 +1,25 @@
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from reports.instrumentacao import medindo_conexao
+
+
+def _na_thread(funcao, args, kwargs):
+    # Cada thread do pool tem a sua conexão (as conexões do Django são por
+    # thread); fechada ao fim conforme o CONN_MAX_AGE, como num request
+    close_old_connections()
+    try:
+        with medindo_conexao():
+            return funcao(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def em_paralelo(funcao, *args, **kwargs):
+    """
+    Awaitable que roda uma função síncrona (ORM/SQL) numa thread própria,
+    fora da thread única do sync_to_async padrão: várias chamadas num
+    asyncio.gather consultam o banco ao mesmo tempo, em conexões separadas.
+    As consultas entram na medição do request (instrumentacao.medicao_atual).
+    """
+    return sync_to_async(_na_thread, thread_sensitive=False)(funcao, args, kwargs)
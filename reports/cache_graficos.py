@@ -0,0 +1,63 @@
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from django.conf import settings
+
+
+class CacheGraficos:
+    """
+    Cache em disco de PNGs endereçado pelo conteúdo: o nome do arquivo é o
+    hash da definição do gráfico + versão dos dados. Despejo LRU pelo mtime
+    (atualizado a cada acerto) até caber no limite de bytes.
+    """
+
+    def __init__(self, diretorio, max_bytes):
+        self.diretorio = Path(diretorio)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _caminho(self, chave):
+        return self.diretorio / f"{chave}.png"
+
+    def obter(self, chave):
+        caminho = self._caminho(chave)
+        try:
+            conteudo = caminho.read_bytes()
+            os.utime(caminho)
+        except FileNotFoundError:
+            return None
+        return conteudo
+
+    def guardar(self, chave, conteudo):
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        # Escrita atômica: outro processo nunca lê um PNG pela metade
+        fd, temporario = tempfile.mkstemp(dir=self.diretorio, suffix=".tmp")
+        with os.fdopen(fd, "wb") as arquivo:
+            arquivo.write(conteudo)
+        os.replace(temporario, self._caminho(chave))
+        self._despejar()
+
+    def _despejar(self):
+        with self._lock:
+            arquivos = []
+            total = 0
+            for caminho in self.diretorio.glob("*.png"):
+                try:
+                    info = caminho.stat()
+                except FileNotFoundError:
+                    continue
+                arquivos.append((info.st_mtime, info.st_size, caminho))
+                total += info.st_size
+            arquivos.sort()
+            while total > self.max_bytes and arquivos:
+                _, tamanho, caminho = arquivos.pop(0)
+                caminho.unlink(missing_ok=True)
+                total -= tamanho
+
+
+cache_graficos = CacheGraficos(
+    getattr(settings, "REPORTS_CHART_CACHE_DIR", Path(tempfile.gettempdir()) / "reports_graficos"),
+    getattr(settings, "REPORTS_CHART_CACHE_MAX_BYTES", 50 * 1024 * 1024),
+)
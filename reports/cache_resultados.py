@@ -0,0 +1,170 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from reports.query_builder import montar_queryset
+from reports.resultados import ResultadoRelatorio
+from reports.spec import hash_spec, normalizar_dados
+from reports.versao_dados import versao_dados
+
+# Parâmetros que mudam só a apresentação, não as linhas do relatório
+PARAMETROS_APRESENTACAO = {"paginacao"}
+
+
+class CacheLRU:
+    """
+    Cache LRU em memória com TTL, limitado pelo "peso" total das entradas
+    (número de linhas guardadas), e não só pela quantidade de chaves.
+    """
+
+    def __init__(self, max_peso, ttl):
+        self.max_peso = max_peso
+        self.ttl = ttl
+        self._dados = OrderedDict()
+        self._peso = 0
+        self._lock = threading.Lock()
+
+    def obter(self, chave):
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is None:
+                return None
+            valor, peso, expira = item
+            if expira < time.monotonic():
+                self._remover(chave)
+                return None
+            self._dados.move_to_end(chave)
+            return valor
+
+    def guardar(self, chave, valor, peso=1):
+        if peso > self.max_peso:
+            return
+        with self._lock:
+            if chave in self._dados:
+                self._remover(chave)
+            self._dados[chave] = (valor, peso, time.monotonic() + self.ttl)
+            self._peso += peso
+            while self._peso > self.max_peso:
+                self._remover(next(iter(self._dados)))
+
+    def _remover(self, chave):
+        _, peso, _ = self._dados.pop(chave)
+        self._peso -= peso
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+            self._peso = 0
+
+
+cache_resultados = CacheLRU(
+    getattr(settings, "REPORTS_RESULT_CACHE_MAX_ROWS", 200_000),
+    getattr(settings, "REPORTS_RESULT_CACHE_TTL", 600),
+)
+
+
+class ResultadoCacheado:
+    """
+    Fachada de um ResultadoRelatorio que responde contagem, páginas e
+    cursores a partir do cache. Relatórios pequenos são guardados inteiros
+    na primeira página pedida; nos grandes, cada página fica guardada.
+    """
+
+    def __init__(self, resultado, chave):
+        self.resultado = resultado
+        self.chave = chave
+        self.colunas = resultado.colunas
+
+    @property
+    def ordered(self):
+        return self.resultado.ordered
+
+    def _linhas_completas(self):
+        linhas = cache_resultados.obter((self.chave, "linhas"))
+        if linhas is None and self.count() <= getattr(settings, "REPORTS_RESULT_CACHE_MAX_ROWS_REPORT", 5000):
+            linhas = list(self.resultado.iterar())
+            cache_resultados.guardar((self.chave, "linhas"), linhas, peso=max(len(linhas), 1))
+        return linhas
+
+    def _contagem(self):
+        contagem = cache_resultados.obter((self.chave, "count"))
+        if contagem is None:
+            contagem = (self.resultado.count(), self.resultado.contagem_exata)
+            cache_resultados.guardar((self.chave, "count"), contagem)
+        return contagem
+
+    def count(self):
+        return self._contagem()[0]
+
+    @property
+    def contagem_exata(self):
+        return self._contagem()[1]
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        linhas = self._linhas_completas()
+        if linhas is not None:
+            return linhas[item]
+        if not isinstance(item, slice):
+            return self.resultado[item]
+        chave = (self.chave, "fatia", item.start, item.stop)
+        fatia = cache_resultados.obter(chave)
+        if fatia is None:
+            fatia = self.resultado[item]
+            cache_resultados.guardar(chave, fatia, peso=max(len(fatia), 1))
+        return fatia
+
+    def __iter__(self):
+        linhas = cache_resultados.obter((self.chave, "linhas"))
+        if linhas is not None:
+            return iter(linhas)
+        # Exportações grandes seguem direto do cursor, sem passar pelo cache
+        return iter(self.resultado)
+
+    def iterar(self, tamanho_lote=2000):
+        linhas = cache_resultados.obter((self.chave, "linhas"))
+        if linhas is not None:
+            return iter(linhas)
+        return self.resultado.iterar(tamanho_lote)
+
+    def pagina_keyset(self, apos=None, antes=None, tamanho=10):
+        chave = (self.chave, "keyset", apos, antes, tamanho)
+        pagina = cache_resultados.obter(chave)
+        if pagina is None:
+            pagina = self.resultado.pagina_keyset(apos=apos, antes=antes, tamanho=tamanho)
+            cache_resultados.guardar(chave, pagina, peso=max(len(pagina), 1))
+        return pagina
+
+    def agrupar(self, *args, **kwargs):
+        return self.resultado.agrupar(*args, **kwargs)
+
+
+def chave_relatorio(dados):
+    spec = {
+        chave: valor
+        for chave, valor in normalizar_dados(dados).items()
+        if chave not in PARAMETROS_APRESENTACAO
+    }
+    return hash_spec(spec, versao_dados())
+
+
+def montar_queryset_cacheado(dados):
+    """
+    montar_queryset com cache de resultado, pela chave canônica do relatório
+    (tabelas, campos, filtros, ordenação, agregação, busca) + versão dos dados.
+    """
+    chave = chave_relatorio(dados)
+    # Agregações simples já vêm calculadas como lista
+    linhas = cache_resultados.obter((chave, "lista"))
+    if linhas is not None:
+        return linhas
+
+    resultado = montar_queryset(dados)
+    if isinstance(resultado, ResultadoRelatorio):
+        return ResultadoCacheado(resultado, chave)
+    cache_resultados.guardar((chave, "lista"), resultado, peso=max(len(resultado), 1))
+    return resultado
@@ -0,0 +1,202 @@
+import atexit
+import fcntl
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+
+from django.conf import settings
+
+from reports.catalogo import catalogo
+from reports.query_builder import compilar, forma_relatorio, periodo_relatorio
+from reports.spec import normalizar_dados
+
+# O log sai pelo logging: o request só enfileira a linha e uma thread do
+# QueueListener escreve no arquivo, com rotação por tamanho
+logger = logging.getLogger("reports.carga_trabalho")
+logger.propagate = False
+
+# Linhas esperando a escrita; com o disco lento o excedente é descartado
+TAMANHO_FILA = 10_000
+
+_lock = threading.Lock()
+_ouvinte = None
+
+
+class _FilaSemBloqueio(QueueHandler):
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # O log é só para análise: perde a linha, não segura o request
+            pass
+
+
+class _ArquivoRotativoCompartilhado(RotatingFileHandler):
+    """
+    RotatingFileHandler para vários processos (workers do gunicorn) no mesmo
+    arquivo: escrita e rotação acontecem sob um flock em <log>.lock, e quem
+    encontra o arquivo já rotacionado por outro processo reabre o novo antes
+    de escrever, em vez de seguir no arquivo renomeado e rotacioná-lo de novo.
+    """
+
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, **kwargs)
+        self._trava = open(f"{self.baseFilename}.lock", "a")
+
+    def _rotacionado_por_outro(self):
+        try:
+            atual = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            return True
+        aberto = os.fstat(self.stream.fileno())
+        return (atual.st_dev, atual.st_ino) != (aberto.st_dev, aberto.st_ino)
+
+    def emit(self, record):
+        fcntl.flock(self._trava, fcntl.LOCK_EX)
+        try:
+            if self.stream is not None:
+                if self._rotacionado_por_outro():
+                    self.stream.close()
+                    self.stream = None
+                else:
+                    # O tamanho inclui o que os outros processos escreveram
+                    self.stream.seek(0, os.SEEK_END)
+            super().emit(record)
+        finally:
+            fcntl.flock(self._trava, fcntl.LOCK_UN)
+
+    def close(self):
+        super().close()
+        self._trava.close()
+
+
+def _configurar_log(caminho):
+    global _ouvinte
+    with _lock:
+        if _ouvinte is not None:
+            return
+        caminho.parent.mkdir(parents=True, exist_ok=True)
+        arquivo = _ArquivoRotativoCompartilhado(
+            caminho,
+            maxBytes=getattr(settings, "REPORTS_WORKLOAD_LOG_MAX_BYTES", 50 * 1024 * 1024),
+            backupCount=getattr(settings, "REPORTS_WORKLOAD_LOG_BACKUPS", 3),
+            encoding="utf-8",
+            delay=True,
+        )
+        arquivo.setFormatter(logging.Formatter("%(message)s"))
+        fila = queue.Queue(TAMANHO_FILA)
+        logger.addHandler(_FilaSemBloqueio(fila))
+        logger.setLevel(logging.INFO)
+        _ouvinte = QueueListener(fila, arquivo)
+        _ouvinte.start()
+        atexit.register(_ouvinte.stop)
+
+
+def caminho_log():
+    caminho = getattr(settings, "REPORTS_WORKLOAD_LOG", "")
+    return Path(caminho) if caminho else None
+
+
+def uso_relatorio(dados):
+    """
+    Campos usados pelo relatório, por papel: filtros (com o operador),
+    ordenação e agrupamento, além da tabela base escolhida pelo engine.
+    Filtros rápidos leem views materializadas e não entram na análise.
+    """
+    forma = forma_relatorio(dados)
+    if forma[0] == "rapido":
+        return None
+    _, tabelas, campos, filtros, _, order_field, _, agregacao, modo_busca = forma
+    plano = compilar(forma)
+    if plano is None:
+        return None
+
+    base = plano.model._meta.db_table
+    grupo = []
+    if agregacao:
+        grupo = [campo for campo in campos if campo != agregacao[1]]
+    usados = [[campo, operador] for (campo, operador), _ in filtros]
+    if plano.periodo:
+        inicio, fim = periodo_relatorio(dados)
+        if inicio:
+            usados.append([f"{base}__{plano.periodo}", ">="])
+        if fim:
+            usados.append([f"{base}__{plano.periodo}", "<"])
+    return {
+        "base": base,
+        "filtros": usados,
+        "ordem": [order_field] if order_field else [],
+        "grupo": grupo,
+        "busca": modo_busca,
+    }
+
+
+def registrar_consulta(dados, duracao):
+    """
+    Acrescenta uma linha (JSON) ao log de carga de trabalho do builder: a
+    definição do relatório, os campos usados e a latência em ms. É a entrada
+    do comando sugerir_indices. Só enfileira: a escrita fica com a thread do
+    log, fora do request.
+    """
+    caminho = caminho_log()
+    if caminho is None:
+        return
+    uso = uso_relatorio(dados)
+    if uso is None:
+        return
+
+    linha = json.dumps({
+        "ts": time.time(),
+        "spec": normalizar_dados(dados),
+        "uso": uso,
+        "duracao_ms": round(duracao * 1000, 3),
+    }, ensure_ascii=False, default=str)
+    try:
+        _configurar_log(caminho)
+    except OSError:
+        # O log é só para análise: não derruba o relatório
+        return
+    logger.info(linha)
+
+
+def ler_consultas(caminho=None):
+    """
+    Linhas do log, das mais antigas às mais novas, incluindo os arquivos já
+    rotacionados (log.3, log.2, log.1, log).
+    """
+    caminho = Path(caminho) if caminho else caminho_log()
+    if caminho is None:
+        return
+    rotacionados = sorted(
+        (p for p in caminho.parent.glob(f"{caminho.name}.*") if p.suffix[1:].isdigit()),
+        key=lambda p: int(p.suffix[1:]),
+        reverse=True,
+    )
+    for arquivo_log in [*rotacionados, caminho]:
+        if not arquivo_log.exists():
+            continue
+        with open(arquivo_log, encoding="utf-8") as arquivo:
+            for linha in arquivo:
+                try:
+                    yield json.loads(linha)
+                except ValueError:
+                    # Linha truncada (processo interrompido no meio da escrita)
+                    continue
+
+
+def coluna_do_campo(campo, base):
+    """
+    Tabela e coluna física de um campo "tabela__campo", e a coluna de join
+    na tabela base quando o campo vem de outra tabela (ex.: streams.user_id).
+    """
+    tabela, _, nome = campo.partition("__")
+    caminho = catalogo().caminhos(base).get(tabela)
+    join = None
+    if caminho:
+        join = (base, caminho.rstrip("_") + "_id")
+    return tabela, nome, join
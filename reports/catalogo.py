@@ -0,0 +1,201 @@
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from .models import MODELOS_POR_TABELA
+
+# Nomes das tabelas na tela
+ROTULOS_TABELAS = {
+    'users': 'Streamers',
+    'streams': 'Transmissões',
+    'games': 'Jogos',
+    'videos': 'Vídeos',
+    'clips': 'Clipes',
+}
+
+# Campos que o builder expõe, por tabela, com o nome na tela
+ROTULOS_CAMPOS = {
+    'users': {
+        'display_name': 'Nome do Streamer',
+        'broadcaster_type': 'Tipo de Transmissor',
+        'id': 'ID do Usuário',
+        'description': 'Descrição',
+        'created_at': 'Data de Criação',
+    },
+    'streams': {
+        'viewer_count': 'Visualizações',
+        'language': 'Idioma',
+        'started_at': 'Início da Transmissão',
+        'title': 'Título da Live',
+        'tags': 'Tags',
+    },
+    'games': {
+        'name': 'Nome do Jogo',
+    },
+    'videos': {
+        'title': 'Título do Vídeo',
+        'url': 'Link do Vídeo',
+        'view_count': 'Visualizações',
+        'duration': 'Duração',
+        'created_at': 'Data de Criação',
+        'language': 'Idioma',
+    },
+    'clips': {
+        'title': 'Título do Clipe',
+        'url': 'Link do Clipe',
+        'view_count': 'Visualizações',
+        'duration': 'Duração',
+        'created_at': 'Data de Criação',
+    },
+}
+
+TIPOS_NUMERICOS = {'IntegerField', 'BigIntegerField', 'SmallIntegerField', 'FloatField'}
+TIPOS_DATA = {'DateTimeField', 'DateField'}
+
+# Operadores de filtro aceitos por tipo de campo (chaves de OPERATOR_CHOICES)
+OPERADORES_COMPARACAO = ('=', '!=', '<', '<=', '>', '>=')
+OPERADORES_TEXTO = OPERADORES_COMPARACAO + ('LIKE',)
+OPERADORES_LISTA = ('LIKE',)
+
+
+@dataclass(frozen=True)
+class CampoCatalogo:
+    tabela: str
+    nome: str
+    coluna: str
+    chave: str
+    rotulo: str
+    tipo: str
+    operadores: tuple
+    chave_primaria: bool = False
+
+    @property
+    def numerico(self):
+        return self.tipo in TIPOS_NUMERICOS
+
+
+@dataclass(frozen=True)
+class TabelaCatalogo:
+    nome: str
+    rotulo: str
+    model: type
+    campos: tuple
+    # Prefixo do join (ORM) a partir desta tabela como base, por tabela
+    # alcançável (ex.: streams -> {'users': 'user__'})
+    caminhos: MappingProxyType
+    # Todos os atributos do model, expostos ou não (busca global)
+    atributos: frozenset
+
+
+@dataclass(frozen=True)
+class Catalogo:
+    """
+    Esquema do builder, montado uma vez na inicialização do app (apps.py) a
+    partir dos models: tabelas, campos expostos com rótulo, tipo e operadores
+    permitidos, e caminhos de join. Imutável, compartilhado entre requests e
+    lido pelo form, pelas views e pelo query_builder.
+    """
+    tabelas: MappingProxyType
+    campos: MappingProxyType
+    rotulos: MappingProxyType
+    choices_tabelas: tuple
+
+    def tabela(self, nome):
+        return self.tabelas.get(nome)
+
+    def campo(self, chave):
+        return self.campos.get(chave)
+
+    def caminhos(self, base):
+        tabela = self.tabelas.get(base)
+        return tabela.caminhos if tabela else MappingProxyType({})
+
+    def choices_campos(self, tabelas=None):
+        """
+        (chave, rótulo) dos campos das tabelas informadas (todas se None)
+        """
+        return tuple(
+            (campo.chave, campo.rotulo)
+            for tabela in self.tabelas.values()
+            if tabelas is None or tabela.nome in tabelas
+            for campo in tabela.campos
+        )
+
+    def operador_permitido(self, chave, operador):
+        campo = self.campos.get(chave)
+        return campo is not None and operador in campo.operadores
+
+
+def _operadores(tipo):
+    if tipo in TIPOS_NUMERICOS or tipo in TIPOS_DATA:
+        return OPERADORES_COMPARACAO
+    if tipo == 'JSONField':
+        return OPERADORES_LISTA
+    return OPERADORES_TEXTO
+
+
+def construir_catalogo():
+    tabelas = {}
+    campos = {}
+    for nome_tabela, model in MODELOS_POR_TABELA.items():
+        rotulo_tabela = ROTULOS_TABELAS.get(nome_tabela, model._meta.object_name)
+        permitidos = ROTULOS_CAMPOS.get(nome_tabela, {})
+
+        campos_tabela = []
+        caminhos = {nome_tabela: ''}
+        for field in model._meta.fields:
+            if field.is_relation:
+                # Joins de um nível, pelas FKs para outras tabelas do builder
+                destino = field.related_model._meta.db_table
+                if destino in MODELOS_POR_TABELA:
+                    caminhos.setdefault(destino, f'{field.name}__')
+                continue
+
+            nome_campo = field.get_attname_column()[1]
+            if nome_campo not in permitidos:
+                continue
+            tipo = field.get_internal_type()
+            campo = CampoCatalogo(
+                tabela=nome_tabela,
+                nome=field.name,
+                coluna=field.column,
+                chave=f'{nome_tabela}__{nome_campo}',
+                rotulo=f'{rotulo_tabela}: {permitidos[nome_campo]}',
+                tipo=tipo,
+                operadores=_operadores(tipo),
+                chave_primaria=field.primary_key,
+            )
+            campos_tabela.append(campo)
+            campos[campo.chave] = campo
+
+        tabelas[nome_tabela] = TabelaCatalogo(
+            nome=nome_tabela,
+            rotulo=rotulo_tabela,
+            model=model,
+            campos=tuple(campos_tabela),
+            caminhos=MappingProxyType(caminhos),
+            atributos=frozenset(f.name for f in model._meta.get_fields()),
+        )
+
+    return Catalogo(
+        tabelas=MappingProxyType(tabelas),
+        campos=MappingProxyType(campos),
+        rotulos=MappingProxyType({chave: campo.rotulo for chave, campo in campos.items()}),
+        choices_tabelas=tuple((t.nome, t.rotulo) for t in tabelas.values()),
+    )
+
+
+_catalogo = None
+
+
+def carregar():
+    global _catalogo
+    _catalogo = construir_catalogo()
+    return _catalogo
+
+
+def catalogo():
+    """
+    Catálogo do builder. Montado no ReportsConfig.ready(); scripts que usam
+    os models sem passar por ele montam na primeira chamada.
+    """
+    return _catalogo or carregar()
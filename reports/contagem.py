@@ -0,0 +1,72 @@
+import json
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+
+def plano_explain(qs):
+    """
+    Plano do EXPLAIN (FORMAT JSON) de um queryset, já como dict. Não usa
+    QuerySet.explain(), que no Django 4.2 devolve o repr do JSON no Postgres.
+    """
+    conexao = connections[qs.db]
+    sql, params = qs.query.get_compiler(using=qs.db).as_sql()
+    with conexao.cursor() as cursor:
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plano = cursor.fetchone()[0]
+    if isinstance(plano, str):
+        plano = json.loads(plano)
+    return plano[0]["Plan"]
+
+
+def estimar_tabela(tabela, using="default"):
+    """
+    Linhas estimadas pelo pg_class.reltuples (atualizado pelo ANALYZE). Numa
+    tabela particionada, soma as partições. None se nunca foi analisada.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT SUM(GREATEST(c.reltuples, 0)), bool_or(c.reltuples >= 0)
+            FROM pg_class c
+            WHERE c.oid = to_regclass(%s)
+               OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s))
+            """,
+            [tabela, tabela],
+        )
+        total, analisada = cursor.fetchone()
+    return int(total) if analisada else None
+
+
+def _sem_filtro(qs):
+    query = qs.query
+    return (
+        not query.where
+        and not query.group_by
+        and not query.distinct
+        and query.combinator is None
+        and query.low_mark == 0
+        and query.high_mark is None
+    )
+
+
+def contar(qs):
+    """
+    (total, exata). Com REPORTS_ESTIMATED_COUNT, usa o reltuples da tabela
+    quando não há filtro e a estimativa do planner (EXPLAIN) quando há. Se a
+    estimativa fica abaixo de REPORTS_EXACT_COUNT_THRESHOLD, o COUNT(*) é
+    barato e roda de verdade.
+    """
+    if not getattr(settings, "REPORTS_ESTIMATED_COUNT", True) or connections[qs.db].vendor != "postgresql":
+        return qs.count(), True
+
+    try:
+        estimativa = estimar_tabela(qs.model._meta.db_table, qs.db) if _sem_filtro(qs) else None
+        if estimativa is None:
+            estimativa = int(plano_explain(qs)["Plan Rows"])
+    except DatabaseError:
+        estimativa = None
+
+    if estimativa is None or estimativa < getattr(settings, "REPORTS_EXACT_COUNT_THRESHOLD", 100_000):
+        return qs.count(), True
+    return estimativa, False
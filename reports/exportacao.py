@@ -0,0 +1,227 @@
+import csv
+import datetime
+import io
+import json
+
+import xlsxwriter
+from django.core.serializers.json import DjangoJSONEncoder
+
+from reports.catalogo import catalogo
+from reports.query_builder import separar_agregado
+
+# Linhas lidas do banco por vez (cursor do lado do servidor)
+TAMANHO_LOTE = 2000
+
+# Limite de linhas de uma planilha do Excel (incluindo o cabeçalho)
+LIMITE_LINHAS_EXCEL = 1048576
+
+
+def iterar_linhas(resultado, tamanho_lote=TAMANHO_LOTE):
+    if hasattr(resultado, "iterar"):
+        return resultado.iterar(tamanho_lote)
+    return iter(resultado)
+
+
+def gerar_csv(resultado, fieldnames, tamanho_lote=TAMANHO_LOTE):
+    """
+    Gera o CSV em blocos de texto para um StreamingHttpResponse: o cabeçalho
+    sai imediatamente e cada lote do cursor vira um bloco, com memória constante.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames, restval="", extrasaction="ignore")
+
+    def esvaziar():
+        bloco = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return bloco
+
+    writer.writeheader()
+    yield esvaziar()
+    for i, linha in enumerate(iterar_linhas(resultado, tamanho_lote), 1):
+        writer.writerow(linha)
+        if i % tamanho_lote == 0:
+            yield esvaziar()
+    yield esvaziar()
+
+
+def _linhas_json(resultado, fieldnames, tamanho_lote):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for linha in iterar_linhas(resultado, tamanho_lote):
+        yield encoder.encode({campo: linha.get(campo, "") for campo in fieldnames})
+
+
+def gerar_ndjson(resultado, fieldnames, tamanho_lote=TAMANHO_LOTE):
+    """
+    Um objeto JSON por linha (NDJSON), serializado lote a lote.
+    """
+    bloco = []
+    for linha in _linhas_json(resultado, fieldnames, tamanho_lote):
+        bloco.append(linha)
+        if len(bloco) >= tamanho_lote:
+            yield "\n".join(bloco) + "\n"
+            bloco = []
+    if bloco:
+        yield "\n".join(bloco) + "\n"
+
+
+def gerar_json(resultado, fieldnames, tamanho_lote=TAMANHO_LOTE):
+    """
+    Array JSON montado de forma incremental: abre o "[", emite as linhas em
+    lotes separados por vírgula e fecha no final, sem montar a lista inteira.
+    """
+    yield "["
+    separador = "\n"
+    bloco = []
+    for linha in _linhas_json(resultado, fieldnames, tamanho_lote):
+        bloco.append(linha)
+        if len(bloco) >= tamanho_lote:
+            yield separador + ",\n".join(bloco)
+            separador = ",\n"
+            bloco = []
+    if bloco:
+        yield separador + ",\n".join(bloco)
+    yield "\n]\n"
+
+
+def _valor_excel(valor):
+    # O xlsxwriter não escreve listas/dicts (ex.: tags)
+    if isinstance(valor, (list, tuple, dict)):
+        return json.dumps(valor, ensure_ascii=False, cls=DjangoJSONEncoder)
+    return valor
+
+
+def escrever_excel(resultado, fieldnames, arquivo, tamanho_lote=TAMANHO_LOTE):
+    """
+    Escreve o relatório em .xlsx no modo constant_memory do xlsxwriter: cada
+    linha vai direto para o disco assim que é escrita. Ao chegar no limite de
+    linhas do Excel, continua em uma nova planilha.
+    """
+    workbook = xlsxwriter.Workbook(arquivo, {
+        "constant_memory": True,
+        "remove_timezone": True,
+        "strings_to_urls": False,
+        "default_date_format": "dd/mm/yyyy hh:mm",
+    })
+    negrito = workbook.add_format({"bold": True})
+
+    def nova_planilha(numero):
+        nome = "Relatório" if numero == 1 else f"Relatório ({numero})"
+        planilha = workbook.add_worksheet(nome)
+        planilha.write_row(0, 0, fieldnames, negrito)
+        return planilha
+
+    numero = 1
+    planilha = nova_planilha(numero)
+    linha_atual = 1
+    for linha in iterar_linhas(resultado, tamanho_lote):
+        if linha_atual >= LIMITE_LINHAS_EXCEL:
+            numero += 1
+            planilha = nova_planilha(numero)
+            linha_atual = 1
+        planilha.write_row(linha_atual, 0, [_valor_excel(linha.get(campo, "")) for campo in fieldnames])
+        linha_atual += 1
+
+    workbook.close()
+
+
+# ======================
+# FORMATOS COLUNARES (Parquet / Arrow IPC)
+# ======================
+def _tipo_arrow(pa, campo):
+    # Tipo da coluna a partir do catálogo (definição do campo em reports.models)
+    funcao, campo = separar_agregado(campo)
+    if funcao == "COUNT":
+        return pa.int64(), _inteiro
+    if funcao == "AVG":
+        return pa.float64(), _decimal
+    definicao = catalogo().campo(campo)
+    tipo = definicao.tipo if definicao else None
+
+    if tipo in ("IntegerField", "BigIntegerField", "SmallIntegerField"):
+        # int64 também para as somas dos filtros rápidos
+        return pa.int64(), _inteiro
+    if tipo == "FloatField":
+        return pa.float64(), _decimal
+    if tipo == "DateTimeField":
+        return pa.timestamp("us", tz="UTC"), _data_hora
+    if tipo == "DateField":
+        return pa.date32(), _data
+    if tipo == "JSONField":
+        return pa.list_(pa.string()), _lista
+    return pa.string(), _texto
+
+
+def _inteiro(valor):
+    return None if valor in (None, "") else int(valor)
+
+
+def _decimal(valor):
+    return None if valor in (None, "") else float(valor)
+
+
+def _data(valor):
+    if valor in (None, ""):
+        return None
+    if isinstance(valor, str):
+        return datetime.date.fromisoformat(valor[:10])
+    if isinstance(valor, datetime.datetime):
+        return valor.date()
+    return valor
+
+
+def _data_hora(valor):
+    if valor in (None, ""):
+        return None
+    if isinstance(valor, str):
+        valor = datetime.datetime.fromisoformat(valor)
+    elif not isinstance(valor, datetime.datetime):
+        # Colunas DATE no banco chegam como date
+        valor = datetime.datetime.combine(valor, datetime.time())
+    if valor.tzinfo is None:
+        valor = valor.replace(tzinfo=datetime.timezone.utc)
+    return valor
+
+
+def _lista(valor):
+    if valor in (None, ""):
+        return None
+    return [str(item) for item in valor]
+
+
+def _texto(valor):
+    return None if valor is None else str(valor)
+
+
+def escrever_colunar(resultado, fieldnames, arquivo, formato, tamanho_lote=TAMANHO_LOTE):
+    """
+    Escreve o relatório em Parquet ou Arrow IPC (formato "arrow"), um record
+    batch por lote do cursor, com o schema tirado dos campos dos models.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tipos = [_tipo_arrow(pa, campo) for campo in fieldnames]
+    schema = pa.schema([pa.field(campo, tipo) for campo, (tipo, _) in zip(fieldnames, tipos)])
+    if formato == "parquet":
+        writer = pq.ParquetWriter(arquivo, schema, compression="zstd")
+        escrever = writer.write_batch
+    else:
+        writer = pa.ipc.new_file(arquivo, schema)
+        escrever = writer.write_batch
+
+    def gravar(colunas):
+        arrays = [pa.array(valores, type=tipo) for valores, (tipo, _) in zip(colunas, tipos)]
+        escrever(pa.record_batch(arrays, schema=schema))
+
+    colunas = [[] for _ in fieldnames]
+    for linha in iterar_linhas(resultado, tamanho_lote):
+        for valores, campo, (_, converter) in zip(colunas, fieldnames, tipos):
+            valores.append(converter(linha.get(campo)))
+        if len(colunas[0]) >= tamanho_lote:
+            gravar(colunas)
+            colunas = [[] for _ in fieldnames]
+    if colunas[0]:
+        gravar(colunas)
+
+    writer.close()
@@ -1,58 +1,7 @@
 from django import forms
-from django.apps import apps
-
-# Traduções para nomes de tabelas
-traducoes_modelos = {
-    'users': 'Streamers',
-    'streams': 'Transmissões',
-    'games': 'Jogos',
-    'videos': 'Vídeos',
-    'clips': 'Clipes'
-}
-
-# Campos permitidos por tabela
-campos_permitidos = {
-    'users': ['display_name', 'broadcaster_type', 'id', 'description', 'created_at'],
-    'streams': ['viewer_count', 'language', 'started_at', 'title', 'tag_ids'],
-    'games': ['name'],
-    'videos': ['title', 'url', 'view_count', 'duration', 'created_at'],
-    'clips': ['title', 'url', 'view_count', 'duration', 'created_at'],
-}
-
-# Traduções dos campos
-traducoes_campos = {
-    'users': {
-        'display_name': 'Nome do Streamer',
-        'broadcaster_type': 'Tipo de Transmissor',
-        'id': 'ID do Usuário',
-        'description': 'Descrição',
-        'created_at': 'Data de Criação',
-    },
-    'streams': {
-        'viewer_count': 'Visualizações',
-        'language': 'Idioma',
-        'started_at': 'Início da Transmissão',
-        'title': 'Título da Live',
-        'tag_ids': 'Tags',
-    },
-    'games': {
-        'name': 'Nome do Jogo',
-    },
-    'videos': {
-        'title': 'Título do Vídeo',
-        'url': 'Link do Vídeo',
-        'view_count': 'Visualizações',
-        'duration': 'Duração',
-        'created_at': 'Data de Criação',
-    },
-    'clips': {
-        'title': 'Título do Clipe',
-        'url': 'Link do Clipe',
-        'view_count': 'Visualizações',
-        'duration': 'Duração',
-        'created_at': 'Data de Criação',
-    }
-}
+
+from .catalogo import catalogo, ROTULOS_TABELAS
+from .query_builder import escolher_base
 
 LOGICAL_CHOICES = [
     ('AND', 'E (AND)'),
@@ -71,7 +20,6 @@ OPERATOR_CHOICES = [
 
 # NOVO: opções de agregação
 AGGREGATION_CHOICES = [
-    ('', '---'),
     ('COUNT', 'Contagem (COUNT)'),
     ('SUM', 'Soma (SUM)'),
     ('AVG', 'Média (AVG)'),
@@ -79,6 +27,16 @@ AGGREGATION_CHOICES = [
     ('MIN', 'Mínimo (MIN)'),
 ]
 
+MODO_BUSCA_CHOICES = [
+    ('palavras', 'Início das palavras'),
+    ('trecho', 'Trecho em qualquer parte'),
+]
+
+PAGINACAO_CHOICES = [
+    ('offset', 'Numerada'),
+    ('keyset', 'Por cursor (tabelas grandes)'),
+]
+
 class ReportForm(forms.Form):
     # Busca e seleção
     busca_global = forms.CharField(
@@ -86,6 +44,14 @@ class ReportForm(forms.Form):
         label="Busca Global",
         widget=forms.TextInput(attrs={'placeholder': 'Buscar streamers, jogos, idiomas...', 'class': 'input-text'})
     )
+    modo_busca = forms.ChoiceField(
+        choices=MODO_BUSCA_CHOICES,
+        initial='palavras',
+        required=False,
+        label="Modo da Busca",
+        help_text="Início das palavras é rápida (índice de busca textual): \"mine\" acha \"Minecraft\", "
+                  "mas \"craft\" não. Trecho acha qualquer parte do texto, mais devagar em tabelas grandes."
+    )
     tables = forms.MultipleChoiceField(
         choices=[],
         widget=forms.CheckboxSelectMultiple,
@@ -113,9 +79,10 @@ class ReportForm(forms.Form):
     filter_operator2 = forms.ChoiceField(label='Operador 2', required=False, choices=OPERATOR_CHOICES)
     filter_value2 = forms.CharField(label='Valor 2', required=False)
 
-    # agregação
-    aggregation_function = forms.ChoiceField(
+    # agregação (várias funções de uma vez, agrupando pelos demais campos)
+    aggregation_function = forms.MultipleChoiceField(
         choices=AGGREGATION_CHOICES,
+        widget=forms.CheckboxSelectMultiple,
         required=False,
         label='Agregação'
     )
@@ -135,32 +102,24 @@ class ReportForm(forms.Form):
         required=False,
         label="Tipo de Ordenação"
     )
+    paginacao = forms.ChoiceField(
+        choices=PAGINACAO_CHOICES,
+        initial='offset',
+        required=False,
+        label="Paginação"
+    )
 
     def __init__(self, *args, campos_choices=None, **kwargs):
         super().__init__(*args, **kwargs)
 
-        models = apps.get_app_config('reports').get_models()
-        tabela_choices = []
-        campo_choices = []
-
-        for model in models:
-            nome_tabela = model._meta.db_table
-            nome_modelo = model._meta.object_name
-            nome_traduzido = traducoes_modelos.get(nome_tabela, nome_modelo)
-            tabela_choices.append((nome_tabela, nome_traduzido))
-            for field in model._meta.fields:
-                nome_campo = field.get_attname_column()[1]
-                if nome_campo not in campos_permitidos.get(nome_tabela, []):
-                    continue
-                chave = f"{nome_tabela}__{nome_campo}"
-                traducao = traducoes_campos.get(nome_tabela, {}).get(nome_campo, nome_campo.title())
-                label = f"{nome_traduzido}: {traducao}"
-                campo_choices.append((chave, label))
+        # Choices do catálogo (montado uma vez na inicialização do app)
+        tabela_choices = catalogo().choices_tabelas
+        campo_choices = catalogo().choices_campos()
 
         self.fields['tables'].choices = tabela_choices
         self.fields['fields'].choices = campo_choices
-        self.fields['filter_field'].choices = [('', '---')] + campo_choices
-        self.fields['order_field'].choices = [('', '---')] + campo_choices
+        self.fields['filter_field'].choices = [('', '---'), *campo_choices]
+        self.fields['order_field'].choices = [('', '---'), *campo_choices]
 
         # Campos de filtros avançados (podem receber choices externos)
         if campos_choices is not None:
@@ -175,4 +134,16 @@ class ReportForm(forms.Form):
         self.fields['logical_operator'].choices = LOGICAL_CHOICES
 
         # Agregação
-        self.fields['aggregation_field'].choices = [('', '---')] + campo_choices
+        self.fields['aggregation_field'].choices = [('', '---'), *campo_choices]
+
+    def clean(self):
+        dados = super().clean()
+        campos = dados.get('fields') or []
+        usadas = {campo.split('__', 1)[0] for campo in campos}
+        if usadas and escolher_base(usadas, dados.get('tables') or []) is None:
+            nomes = ', '.join(sorted(ROTULOS_TABELAS.get(t, t) for t in usadas))
+            raise forms.ValidationError(
+                f'Os campos de {nomes} não se ligam diretamente. Marque também a '
+                'tabela que os relaciona (ex.: Transmissões liga Streamers e Jogos).'
+            )
+        return dados
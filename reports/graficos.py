@@ -0,0 +1,102 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as TempoEsgotado
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+
+class FilaGraficosCheia(Exception):
+    pass
+
+
+def desenhar_barras(x, y, rotulo_x, rotulo_y, titulo):
+    """
+    Desenha o gráfico de barras e devolve o PNG. Roda nos processos do pool:
+    usa só a API orientada a objetos (Figure + canvas Agg), sem o estado
+    global do pyplot.
+    """
+    fig = Figure(figsize=(9, 4))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.bar(x, y)
+    ax.set_xlabel(rotulo_x)
+    ax.set_ylabel(rotulo_y)
+    ax.set_title(titulo)
+    ax.tick_params(axis="x", labelrotation=45)
+    fig.tight_layout()
+
+    buf = BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+_lock = threading.Lock()
+_executor = None
+_vagas = None
+
+
+def _configuracao():
+    from django.conf import settings
+
+    workers = getattr(settings, "REPORTS_CHART_WORKERS", None) or min(4, os.cpu_count() or 1)
+    fila = getattr(settings, "REPORTS_CHART_QUEUE", None) or workers * 4
+    timeout = getattr(settings, "REPORTS_CHART_TIMEOUT", 10)
+    return workers, fila, timeout
+
+
+def _obter_executor():
+    global _executor, _vagas
+    with _lock:
+        if _executor is None:
+            workers, fila, _ = _configuracao()
+            # spawn: os filhos não herdam threads nem conexões do servidor web
+            _executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _vagas = threading.BoundedSemaphore(fila)
+        return _executor, _vagas
+
+
+def _descartar_executor(executor):
+    global _executor
+    with _lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def renderizar_barras(serie, rotulo_x, rotulo_y, titulo="Gráfico Dinâmico do Relatório"):
+    """
+    Renderiza a série [(x, y)] no pool de processos. A fila de gráficos
+    pendentes é limitada (FilaGraficosCheia) e a espera tem timeout
+    (TempoEsgotado), para não prender o worker web.
+    """
+    x = [str(valor) if valor is not None else "N/A" for valor, _ in serie]
+    y = [float(valor) if valor not in (None, "") else 0 for _, valor in serie]
+
+    executor, vagas = _obter_executor()
+    if not vagas.acquire(blocking=False):
+        raise FilaGraficosCheia()
+    try:
+        futuro = executor.submit(desenhar_barras, x, y, rotulo_x, rotulo_y, titulo)
+    except BaseException:
+        vagas.release()
+        raise
+    # A vaga só é liberada quando o desenho termina de fato, mesmo após timeout
+    futuro.add_done_callback(lambda _: vagas.release())
+
+    _, _, timeout = _configuracao()
+    try:
+        return futuro.result(timeout=timeout)
+    except TempoEsgotado:
+        futuro.cancel()
+        raise
+    except BrokenProcessPool:
+        _descartar_executor(executor)
+        raise
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.http import FileResponse
+
+from reports.spec import hash_spec, normalizar_dados
+
+logger = logging.getLogger("reports.instrumentacao")
+
+# Últimos relatórios medidos, para o endpoint de depuração
+_recentes = deque(maxlen=getattr(settings, "REPORTS_INSTRUMENTATION_BUFFER", 200))
+_lock = threading.Lock()
+
+# Medição do request em andamento nas views assíncronas; o sync_to_async
+# copia o contexto para as threads que consultam o banco
+medicao_atual = ContextVar("medicao_atual", default=None)
+
+# SQL guardado por relatório (o resto só entra nos totais)
+MAX_CONSULTAS = 50
+MAX_TAMANHO_SQL = 2000
+
+
+class MedicaoRelatorio:
+    """
+    Medição de uma requisição de relatório. É instalada como execute_wrapper
+    da conexão: cada SQL executado entra com seu tempo e linhas. O tempo de
+    Python é o total menos o tempo de banco e o de renderização do template.
+    """
+
+    def __init__(self, tipo, dados):
+        self.tipo = tipo
+        self.spec = normalizar_dados(dados)
+        self.consultas = []
+        self.total_consultas = 0
+        self.tempo_banco = 0.0
+        self.linhas_sql = 0
+        self.linhas = None
+        self.tempo_render = 0.0
+        self._banco_render = 0.0
+        self._inicio = time.perf_counter()
+        # Na view assíncrona várias threads consultam ao mesmo tempo
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duracao = time.perf_counter() - inicio
+            # rowcount é -1 em cursores do lado do servidor (iterator())
+            linhas = max(getattr(context["cursor"], "rowcount", -1), 0)
+            with self._lock:
+                self.tempo_banco += duracao
+                self.total_consultas += 1
+                self.linhas_sql += linhas
+                if len(self.consultas) < MAX_CONSULTAS:
+                    self.consultas.append({
+                        "sql": sql[:MAX_TAMANHO_SQL],
+                        "duracao_ms": round(duracao * 1000, 3),
+                        "linhas": linhas,
+                    })
+
+    @contextmanager
+    def renderizando(self):
+        inicio = time.perf_counter()
+        banco = self.tempo_banco
+        try:
+            yield
+        finally:
+            self.tempo_render = time.perf_counter() - inicio
+            self._banco_render = self.tempo_banco - banco
+
+    def contar_linhas(self, linhas):
+        with self._lock:
+            self.linhas = (self.linhas or 0) + linhas
+
+    def finalizar(self):
+        total = time.perf_counter() - self._inicio
+        # Consultas disparadas durante o render contam como banco, não render.
+        # Na view assíncrona o banco soma consultas paralelas e pode passar
+        # do total
+        render = self.tempo_render - self._banco_render
+        registro = {
+            "tipo": self.tipo,
+            "spec_hash": hash_spec(self.spec)[:16],
+            "spec": self.spec,
+            "inicio": time.time() - total,
+            "total_ms": round(total * 1000, 3),
+            "banco_ms": round(self.tempo_banco * 1000, 3),
+            "python_ms": round(max(total - self.tempo_banco - render, 0.0) * 1000, 3),
+            "render_ms": round(render * 1000, 3),
+            "consultas": self.total_consultas,
+            "linhas_sql": self.linhas_sql,
+            "linhas": self.linhas,
+            "sql": self.consultas,
+        }
+        with _lock:
+            _recentes.append(registro)
+        logger.info(json.dumps(registro, ensure_ascii=False, default=str))
+        return registro
+
+
+def _em_todas_conexoes(medicao):
+    # Primário e réplica: as leituras dos relatórios podem ir para qualquer um
+    pilha = ExitStack()
+    if medicao is not None:
+        for conexao in connections.all():
+            pilha.enter_context(conexao.execute_wrapper(medicao))
+    return pilha
+
+
+@contextmanager
+def medindo(medicao):
+    """
+    Instala a medição nas conexões durante o bloco e registra ao sair.
+    """
+    try:
+        with _em_todas_conexoes(medicao):
+            yield medicao
+    finally:
+        medicao.finalizar()
+
+
+def medindo_conexao():
+    """
+    Instala a medição do request assíncrono em andamento (se houver) na
+    conexão da thread atual.
+    """
+    return _em_todas_conexoes(medicao_atual.get())
+
+
+def medir_relatorio(tipo, dados):
+    return medindo(MedicaoRelatorio(tipo, dados))
+
+
+def medir_streaming(medicao, blocos):
+    """
+    Versão para StreamingHttpResponse: as consultas rodam enquanto a resposta
+    é enviada, então a medição acompanha o gerador até o fim.
+    """
+    with medindo(medicao):
+        yield from blocos
+
+
+def medir_view(tipo):
+    """
+    Decorator das views de relatório: mede a requisição inteira e deixa a
+    medição em request.medicao (para render e contagem de linhas). Em
+    respostas em streaming, a medição termina junto com o envio. Em views
+    assíncronas a medição vai por medicao_atual para as threads do banco.
+    """
+    def decorador(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper_async(request, *args, **kwargs):
+                medicao = MedicaoRelatorio(tipo, request.GET)
+                request.medicao = medicao
+                token = medicao_atual.set(medicao)
+                try:
+                    response = await view(request, *args, **kwargs)
+                finally:
+                    medicao_atual.reset(token)
+                medicao.finalizar()
+                return response
+            return wrapper_async
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            medicao = MedicaoRelatorio(tipo, request.GET)
+            request.medicao = medicao
+            with _em_todas_conexoes(medicao):
+                response = view(request, *args, **kwargs)
+            if response.streaming and not isinstance(response, FileResponse):
+                response.streaming_content = medir_streaming(medicao, response.streaming_content)
+            else:
+                medicao.finalizar()
+            return response
+        return wrapper
+    return decorador
+
+
+class LinhasMedidas:
+    """
+    Envolve um resultado para contar as linhas entregues à exportação.
+    """
+
+    def __init__(self, resultado, medicao):
+        self.resultado = resultado
+        self.medicao = medicao
+
+    def iterar(self, tamanho_lote):
+        iteravel = self.resultado.iterar(tamanho_lote) if hasattr(self.resultado, "iterar") else self.resultado
+        for linha in iteravel:
+            self.medicao.contar_linhas(1)
+            yield linha
+
+
+def relatorios_lentos(limite=20):
+    with _lock:
+        recentes = list(_recentes)
+    return sorted(recentes, key=lambda r: r["total_ms"], reverse=True)[:limite]
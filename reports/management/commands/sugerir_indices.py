@@ -0,0 +1,285 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from reports.carga_trabalho import coluna_do_campo, ler_consultas
+from reports.contagem import plano_explain
+from reports.catalogo import catalogo
+from reports.query_builder import compilar, forma_relatorio, montar_queryset
+from reports.replica import usando_primario
+from reports.spec import hash_spec
+
+OPERADORES_INTERVALO = {"<", "<=", ">", ">="}
+
+
+class Command(BaseCommand):
+    help = (
+        "Lê o log de carga de trabalho do builder e sugere índices (B-tree, BRIN "
+        "em datas, GIN em tags) para os campos mais usados nos relatórios mais "
+        "lentos. O ganho vem do EXPLAIN com índices hipotéticos (hypopg) ou, sem "
+        "ele, das estatísticas do planner (pg_stats) e da latência no log; nada é "
+        "construído. Com --indice-real, mede criando cada índice numa transação "
+        "desfeita. Com --criar, cria os índices."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--log", help="Arquivo do log (padrão: REPORTS_WORKLOAD_LOG)")
+        parser.add_argument("--limite", type=int, default=10, help="Quantidade máxima de sugestões")
+        parser.add_argument("--amostras", type=int, default=3,
+                            help="Relatórios mais lentos usados no EXPLAIN de cada sugestão")
+        parser.add_argument("--indice-real", action="store_true",
+                            help="Sem hypopg (ou em tabela particionada/GIN), mede o ganho criando o índice "
+                                 "de verdade numa transação desfeita. Bloqueia escritas na tabela enquanto "
+                                 "o índice é construído")
+        parser.add_argument("--criar", action="store_true",
+                            help="Cria (CONCURRENTLY) os índices sugeridos com ganho estimado")
+
+    def handle(self, *args, **opcoes):
+        # Índices hipotéticos e o EXPLAIN precisam estar na mesma conexão (a
+        # do primário): os relatórios amostrados não podem ir para a réplica
+        with usando_primario():
+            self.sugerir(opcoes)
+
+    def sugerir(self, opcoes):
+        candidatos = self.coletar(ler_consultas(opcoes["log"]))
+        if not candidatos:
+            self.stdout.write("Nenhuma consulta registrada no log.")
+            return
+
+        existentes = self.indices_existentes()
+        hypopg = self.tem_hypopg()
+        if opcoes["indice_real"]:
+            self.stdout.write(self.style.WARNING(
+                "--indice-real: onde o hypopg não serve, cada índice é criado numa transação "
+                "desfeita (rollback) só para o EXPLAIN. A tabela fica com as escritas bloqueadas "
+                "(lock SHARE) enquanto o índice é construído."
+            ))
+
+        sugestoes = []
+        for (tabela, coluna, metodo), dados in candidatos.items():
+            if self.ja_indexada(existentes, tabela, coluna, metodo):
+                continue
+            # O hypopg não simula GIN nem índice em tabela particionada
+            if hypopg and metodo != "gin" and not self.particionada(tabela):
+                modo = "hypopg"
+            elif opcoes["indice_real"]:
+                modo = "real"
+            else:
+                modo = None
+
+            if modo:
+                ganho, custo_antes, custo_depois = self.estimar(
+                    tabela, coluna, metodo, dados["specs"], opcoes["amostras"], modo
+                )
+            else:
+                ganho = self.estimar_por_estatisticas(tabela, coluna, metodo, dados["latencia"])
+                custo_antes = custo_depois = None
+            sugestoes.append({
+                "tabela": tabela,
+                "coluna": coluna,
+                "metodo": metodo,
+                "usos": dados["usos"],
+                "latencia_media": dados["latencia"] / dados["usos"],
+                "custo_antes": custo_antes,
+                "custo_depois": custo_depois,
+                "ganho_ms": ganho,
+            })
+
+        sugestoes.sort(key=lambda s: s["ganho_ms"], reverse=True)
+        sugestoes = sugestoes[:opcoes["limite"]]
+        if not sugestoes:
+            self.stdout.write("Os campos usados já estão indexados.")
+            return
+
+        for s in sugestoes:
+            if s["custo_antes"] is None:
+                custo = "pelas estatísticas (pg_stats)"
+            else:
+                custo = f"custo {s['custo_antes']:.0f} -> {s['custo_depois']:.0f}"
+            self.stdout.write(
+                f"{s['tabela']}.{s['coluna']} ({s['metodo']}): {s['usos']} usos, "
+                f"{s['latencia_media']:.1f} ms em média, {custo}, ganho estimado {s['ganho_ms']:.0f} ms"
+            )
+            self.stdout.write(f"    {self.ddl(s['tabela'], s['coluna'], s['metodo'])};")
+
+        if opcoes["criar"]:
+            for s in sugestoes:
+                if s["ganho_ms"] <= 0:
+                    continue
+                # CONCURRENTLY não existe em tabela particionada (streams, videos, clips)
+                ddl = self.ddl(s["tabela"], s["coluna"], s["metodo"], concorrente=not self.particionada(s["tabela"]))
+                with connection.cursor() as cursor:
+                    cursor.execute(ddl)
+                self.stdout.write(self.style.SUCCESS(f"Criado: {ddl}"))
+
+    # ======================
+    # CANDIDATOS
+    # ======================
+    def coletar(self, consultas):
+        candidatos = defaultdict(lambda: {"usos": 0, "latencia": 0.0, "specs": {}})
+        for consulta in consultas:
+            uso = consulta.get("uso") or {}
+            base = uso.get("base")
+            papeis = [(campo, operador) for campo, operador in uso.get("filtros", [])]
+            papeis += [(campo, "ORDER") for campo in uso.get("ordem", [])]
+            papeis += [(campo, "GROUP") for campo in uso.get("grupo", [])]
+
+            vistos = set()
+            for campo, operador in papeis:
+                vistos.update(self.candidatos_do_campo(campo, operador, base))
+            for chave in vistos:
+                item = candidatos[chave]
+                item["usos"] += 1
+                item["latencia"] += consulta.get("duracao_ms", 0)
+                spec = consulta.get("spec") or {}
+                amostra = item["specs"].setdefault(hash_spec(spec), {"spec": spec, "usos": 0, "latencia": 0.0})
+                amostra["usos"] += 1
+                amostra["latencia"] += consulta.get("duracao_ms", 0)
+        return candidatos
+
+    def candidatos_do_campo(self, campo, operador, base):
+        tabela, _, join = coluna_do_campo(campo, base)
+        definicao = catalogo().campo(campo)
+        if definicao is None:
+            return []
+
+        candidatos = []
+        tipo = definicao.tipo
+        if definicao.chave_primaria:
+            pass
+        elif operador == "LIKE":
+            # Servido pelos índices de trigrama de ETL/load/create_tables.py
+            pass
+        elif tipo == "JSONField":
+            candidatos.append((tabela, definicao.coluna, "gin"))
+        elif tipo in ("DateTimeField", "DateField") and operador in OPERADORES_INTERVALO:
+            # Datas crescem com a carga: BRIN é pequeno e serve intervalos
+            candidatos.append((tabela, definicao.coluna, "brin"))
+        else:
+            candidatos.append((tabela, definicao.coluna, "btree"))
+
+        # Campo de outra tabela: o join parte da coluna de FK na base
+        if join:
+            candidatos.append((join[0], join[1], "btree"))
+        return candidatos
+
+    # ======================
+    # ÍNDICES EXISTENTES
+    # ======================
+    def indices_existentes(self):
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT t.relname, a.attname, am.amname
+                FROM pg_index i
+                JOIN pg_class t ON t.oid = i.indrelid
+                JOIN pg_class ix ON ix.oid = i.indexrelid
+                JOIN pg_am am ON am.oid = ix.relam
+                JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = i.indkey[0]
+                JOIN pg_namespace n ON n.oid = t.relnamespace
+                WHERE n.nspname = current_schema()
+            """)
+            return set(cursor.fetchall())
+
+    def ja_indexada(self, existentes, tabela, coluna, metodo):
+        if metodo == "gin":
+            return (tabela, coluna, "gin") in existentes
+        # Um B-tree que começa pela coluna já atende B-tree e BRIN
+        return any((tabela, coluna, m) in existentes for m in ("btree", metodo))
+
+    def tem_hypopg(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'hypopg'")
+            return cursor.fetchone() is not None
+
+    def particionada(self, tabela):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", [tabela])
+            linha = cursor.fetchone()
+            return bool(linha and linha[0])
+
+    # ======================
+    # ESTIMATIVA (EXPLAIN)
+    # ======================
+    def ddl(self, tabela, coluna, metodo, concorrente=False):
+        nome = connection.ops.quote_name(f"idx_{tabela}_{coluna}_{metodo}")
+        return "CREATE INDEX {}{} ON {} USING {} ({})".format(
+            "CONCURRENTLY IF NOT EXISTS " if concorrente else "",
+            nome,
+            connection.ops.quote_name(tabela),
+            metodo,
+            connection.ops.quote_name(coluna),
+        )
+
+    def custo(self, spec):
+        # Custo da primeira página do relatório, como o builder a busca
+        forma = forma_relatorio(spec)
+        plano = compilar(forma)
+        if plano is None or plano.agregacao:
+            return None
+        resultado = montar_queryset(spec)
+        return plano_explain(resultado.qs[:10])["Total Cost"]
+
+    def estimar(self, tabela, coluna, metodo, specs, amostras, modo):
+        """
+        Ganho estimado em ms: para os relatórios mais lentos que usam o campo,
+        a fração do custo do EXPLAIN que o índice economiza, vezes o tempo
+        total que esses relatórios gastaram no log. O índice é hipotético
+        (modo "hypopg") ou real, numa transação desfeita (modo "real").
+        """
+        lentos = sorted(specs.values(), key=lambda a: a["latencia"], reverse=True)[:amostras]
+        antes = [(a, self.custo(a["spec"])) for a in lentos]
+        antes = [(a, c) for a, c in antes if c]
+        if not antes:
+            return 0.0, 0.0, 0.0
+
+        ddl = self.ddl(tabela, coluna, metodo)
+        depois = []
+        with connection.cursor() as cursor:
+            if modo == "hypopg":
+                cursor.execute("SELECT * FROM hypopg_create_index(%s)", [ddl])
+                try:
+                    depois = [self.custo(a["spec"]) for a, _ in antes]
+                finally:
+                    cursor.execute("SELECT hypopg_reset()")
+            else:
+                with transaction.atomic():
+                    cursor.execute(ddl)
+                    depois = [self.custo(a["spec"]) for a, _ in antes]
+                    transaction.set_rollback(True)
+
+        ganho = 0.0
+        for (amostra, custo_antes), custo_depois in zip(antes, depois):
+            economia = max(0.0, 1 - custo_depois / custo_antes)
+            ganho += economia * amostra["latencia"]
+        return ganho, sum(c for _, c in antes), sum(depois)
+
+    def estimar_por_estatisticas(self, tabela, coluna, metodo, latencia):
+        """
+        Ganho estimado em ms sem construir nada: a latência acumulada dos
+        relatórios que usam o campo vezes a fração das linhas que o índice
+        deixa de ler, tirada do pg_stats (seletividade média pelo n_distinct;
+        no BRIN, a correlação entre o valor e a posição física).
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT s.n_distinct, s.correlation, c.reltuples
+                FROM pg_stats s
+                JOIN pg_class c ON c.oid = to_regclass(s.tablename::text)
+                WHERE s.schemaname = current_schema() AND s.tablename = %s AND s.attname = %s
+                ORDER BY s.inherited DESC
+                LIMIT 1
+            """, [tabela, coluna])
+            linha = cursor.fetchone()
+        if linha is None:
+            # Tabela sem ANALYZE: sem base para estimar, fica no meio
+            return latencia * 0.5
+
+        n_distinct, correlacao, linhas = linha
+        if metodo == "brin":
+            economia = abs(correlacao) if correlacao is not None else 0.5
+        else:
+            # n_distinct negativo é fração das linhas (-1 = todos distintos)
+            distintos = n_distinct if n_distinct > 0 else -n_distinct * max(linhas, 1)
+            economia = 1 - 1 / distintos if distintos >= 1 else 0.0
+        return latencia * economia
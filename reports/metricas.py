@@ -0,0 +1,102 @@
+import asyncio
+
+from django.core.cache import cache
+from django.db import connections
+
+from reports.assincrono import em_paralelo
+from reports.contagem import contar
+from reports.models import User
+from reports.replica import alias_leitura
+from reports.versao_dados import versao_dados
+
+# Métricas do topo da página, uma subconsulta escalar independente por
+# métrica. O builder síncrono junta todas numa única ida ao banco; o
+# assíncrono roda cada uma numa conexão própria, ao mesmo tempo
+CONSULTAS_METRICAS = {
+    "total_views": "SELECT COALESCE(SUM(viewer_count), 0) FROM streams",
+    "jogo_mais_popular": """
+        SELECT g.name
+        FROM (
+            SELECT game_id, SUM(viewer_count) AS total
+            FROM streams
+            GROUP BY game_id
+            ORDER BY total DESC NULLS LAST
+            LIMIT 1
+        ) j
+        JOIN games g ON g.id = j.game_id
+    """,
+    "idioma_mais_falado": """
+        SELECT language
+        FROM streams
+        GROUP BY language
+        ORDER BY COUNT(language) DESC
+        LIMIT 1
+    """,
+    "ultima_atualizacao": "SELECT MAX(started_at) FROM streams",
+}
+
+SQL_METRICAS = "SELECT " + ", ".join(f"({consulta})" for consulta in CONSULTAS_METRICAS.values())
+
+
+def _montar_metricas(valores, total_streamers, streamers_exato):
+    ultima = valores["ultima_atualizacao"]
+    if ultima and hasattr(ultima, "strftime"):
+        ultima_str = ultima.strftime("%d/%m/%Y %H:%M")
+    else:
+        ultima_str = ultima or "--"
+
+    return {
+        "total_streamers": total_streamers,
+        "total_streamers_aproximado": not streamers_exato,
+        "total_views": valores["total_views"] or 0,
+        "jogo_mais_popular": valores["jogo_mais_popular"] or "N/A",
+        "idioma_mais_falado": valores["idioma_mais_falado"] or "N/A",
+        "ultima_atualizacao": ultima_str,
+    }
+
+
+def calcular_metricas():
+    with connections[alias_leitura()].cursor() as cursor:
+        cursor.execute(SQL_METRICAS)
+        valores = dict(zip(CONSULTAS_METRICAS, cursor.fetchone()))
+    # Estimado pelo reltuples em tabelas grandes, sem COUNT(*)
+    total_streamers, streamers_exato = contar(User.objects.all())
+    return _montar_metricas(valores, total_streamers, streamers_exato)
+
+
+def _metrica(nome):
+    with connections[alias_leitura()].cursor() as cursor:
+        cursor.execute(CONSULTAS_METRICAS[nome])
+        linha = cursor.fetchone()
+    return linha[0] if linha else None
+
+
+async def calcular_metricas_async():
+    nomes = list(CONSULTAS_METRICAS)
+    *valores, (total_streamers, streamers_exato) = await asyncio.gather(
+        *(em_paralelo(_metrica, nome) for nome in nomes),
+        em_paralelo(contar, User.objects.all()),
+    )
+    return _montar_metricas(dict(zip(nomes, valores)), total_streamers, streamers_exato)
+
+
+def metricas_dashboard():
+    """
+    Métricas do painel, cacheadas pela versão dos dados do ETL: só são
+    recalculadas depois que uma nova carga termina.
+    """
+    chave = f"reports:metricas:{versao_dados()}"
+    return cache.get_or_set(chave, calcular_metricas, timeout=None)
+
+
+async def metricas_dashboard_async():
+    """
+    Versão assíncrona do metricas_dashboard, com o mesmo cache: numa falta,
+    as métricas são calculadas em paralelo.
+    """
+    chave = f"reports:metricas:{await em_paralelo(versao_dados)}"
+    metricas = await cache.aget(chave)
+    if metricas is None:
+        metricas = await calcular_metricas_async()
+        await cache.aset(chave, metricas, timeout=None)
+    return metricas
@@ -1,3 +1,4 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 
 class User(models.Model):
@@ -6,7 +7,7 @@ class User(models.Model):
     broadcaster_type = models.CharField(max_length=50, blank=True)
     description = models.TextField(blank=True)
     profile_image_url = models.URLField(max_length=500, blank=True)
-    created_at = models.DateTimeField()
+    created_at = models.DateField()
 
     class Meta:
         managed = False
@@ -21,6 +22,15 @@ class Game(models.Model):
         managed = False
         db_table = 'games'
 
+# Streams, videos e clips são particionadas por mês (ETL/load/particoes.py):
+# no banco a chave primária é (id, data) e as FKs game_stream.stream_id e
+# clips.video_id não existem mais. "id" continua único porque a carga
+# garante (DataLoader.com_id_unico), e é nisso que o primary_key abaixo e o
+# desempate da paginação keyset se apoiam. Sem a FK, um clip pode apontar
+# para um vídeo de uma partição já removida: o join o trata como ausente.
+# Os tipos seguem o banco: created_at é DATE (DateField) e started_at é
+# TIMESTAMP sem fuso, gravado em UTC.
+
 class Stream(models.Model):
     id = models.CharField(primary_key=True, max_length=100)
     user = models.ForeignKey('User', on_delete=models.DO_NOTHING, db_column='user_id')
@@ -31,6 +41,8 @@ class Stream(models.Model):
     language = models.CharField(max_length=10)
     thumbnail_url = models.URLField(max_length=500)
     tags = models.JSONField(default=list, blank=True)
+    # Preenchida por trigger no banco (ETL/load/create_tables.py)
+    busca = SearchVectorField(null=True, editable=False)
 
     class Meta:
         managed = False
@@ -41,7 +53,7 @@ class Video(models.Model):
     stream = models.ForeignKey('Stream', on_delete=models.DO_NOTHING, db_column='stream_id', blank=True, null=True)
     user = models.ForeignKey('User', on_delete=models.DO_NOTHING, db_column='user_id')
     title = models.CharField(max_length=500)
-    created_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateField(null=True, blank=True)
     url = models.URLField(max_length=500)
     view_count = models.BigIntegerField(default=0)
     language = models.CharField(max_length=10)
@@ -60,9 +72,59 @@ class Clip(models.Model):
     language = models.CharField(max_length=10)
     title = models.CharField(max_length=255)
     view_count = models.BigIntegerField(default=0)
-    created_at = models.DateTimeField()
+    created_at = models.DateField()
     duration = models.FloatField()
 
     class Meta:
         managed = False
-        db_table = 'clips'
\ No newline at end of file
+        db_table = 'clips'
+
+# ======================
+# VIEWS MATERIALIZADAS (filtros rápidos)
+# ======================
+# Criadas em ETL/load/create_tables.py e atualizadas no fim da carga.
+# "posicao" é a ordem por total_views (1 = mais visto).
+
+class TopStreamer(models.Model):
+    id = models.CharField(primary_key=True, max_length=100)
+    posicao = models.BigIntegerField()
+    display_name = models.CharField(max_length=100)
+    broadcaster_type = models.CharField(max_length=50, blank=True)
+    total_views = models.BigIntegerField(null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'mv_top_streamers'
+
+class JogoPopular(models.Model):
+    id = models.CharField(primary_key=True, max_length=100)
+    posicao = models.BigIntegerField()
+    name = models.CharField(max_length=200)
+    total_views = models.BigIntegerField(null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'mv_jogos_populares'
+
+class StreamerBrPt(models.Model):
+    # id = user_id + ':' + language
+    id = models.CharField(primary_key=True, max_length=120)
+    posicao = models.BigIntegerField()
+    user_id = models.CharField(max_length=100)
+    display_name = models.CharField(max_length=100)
+    broadcaster_type = models.CharField(max_length=50, blank=True)
+    language = models.CharField(max_length=10)
+    total_views = models.BigIntegerField(null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'mv_brpt'
+
+# Model de cada tabela, pelo nome usado no builder
+MODELOS_POR_TABELA = {
+    'users': User,
+    'streams': Stream,
+    'games': Game,
+    'videos': Video,
+    'clips': Clip,
+}
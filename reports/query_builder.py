@@ -1,61 +1,498 @@
-from django.db.models import Q, Count, Sum, Avg, Max, Min
-from .models import User, Game, Stream, Video, Clip
-
-class DynamicQueryBuilder:
-    AVAILABLE_TABLES = {
-        'users': User,
-        'games': Game,
-        'streams': Stream,
-        'videos': Video,
-        'clips': Clip,
-    }
-    AGG_FUNCS = {
-        'count': Count, 'sum': Sum, 'avg': Avg, 'max': Max, 'min': Min
-    }
-
-    def __init__(self):
-        self.tables = []
-        self.fields = []
-        self.filters = []
-        self.aggs = []
-
-    def add_table(self, name): self.tables.append(name)
-    def add_field(self, table, field, alias=None):
-        key = f"{table}__{field}" if "__" not in field else field
-        self.fields.append((key, alias or f"{table}_{field}"))
-    def add_filter(self, field, op, value, logical="AND"):
-        self.filters.append((field, op, value, logical))
-    def add_agg(self, field, func, alias=None):
-        self.aggs.append((field, func, alias or f"{func}_{field}"))
-
-    def build_query(self):
-        if not self.tables:
-            raise ValueError("Nenhuma tabela selecionada")
-        main = self.tables[0]
-        qs = self.AVAILABLE_TABLES[main].objects.all()
-        # joins
-        if len(self.tables) > 1:
-            # Exemplo básico: se streams e games, faz select_related
-            if 'streams' in self.tables and 'games' in self.tables:
-                qs = qs.select_related('game')
-        # filtros
-        q_obj = Q()
-        for i,(fld,op,val,log) in enumerate(self.filters):
-            lookup = {
-                'equals': fld,
-                'contains': f"{fld}__icontains",
-                'gt': f"{fld}__gt",
-                'lt': f"{fld}__lt",
-                'gte': f"{fld}__gte",
-                'lte': f"{fld}__lte"
-            }.get(op)
-            cond = Q(**{lookup: val})
-            q_obj = cond if i==0 else (q_obj & cond if log=="AND" else q_obj | cond)
-        qs = qs.filter(q_obj) if self.filters else qs
-        # agregações
-        if self.aggs:
-            ann = {alias: self.AGG_FUNCS[func](field) for field,func,alias in self.aggs}
-            qs = qs.values(*[f for f,_ in self.fields]).annotate(**ann)
-        elif self.fields:
-            qs = qs.values(*[f for f,_ in self.fields])
-        return qs
+import datetime
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import DateTimeField, F, Q, Value, Count, Sum, Avg, Max, Min
+from django.utils import timezone
+
+from .catalogo import catalogo
+from .models import TopStreamer, JogoPopular, StreamerBrPt
+from .resultados import ResultadoRelatorio
+
+# Tabela base (FROM) preferida quando o relatório envolve mais de uma tabela
+PRIORIDADE_BASE = ['streams', 'clips', 'videos', 'users', 'games']
+
+# Caminhos de join, campos, tipos e operadores vêm do catálogo
+# (reports/catalogo.py), montado a partir dos models na inicialização
+
+# Coluna do período (data_inicio/data_fim) em cada tabela base. São as chaves
+# do particionamento mensal (ETL/load/create_tables.py): o intervalo deixa o
+# Postgres ler só as partições dos meses pedidos
+CAMPOS_PERIODO = {
+    'streams': 'started_at',
+    'videos': 'created_at',
+    'clips': 'created_at',
+}
+
+# Configuração da busca textual (a mesma do trigger que preenche streams.busca)
+CONFIG_BUSCA = 'simple'
+
+# Modos da busca global: "palavras" usa o tsvector de streams (prefixo das
+# palavras, indexado); "trecho" faz icontains e acha qualquer parte do texto
+MODOS_BUSCA = ('palavras', 'trecho')
+
+# Campos de texto usados pela busca global no modo "trecho" ou quando a base
+# não é streams (None = a própria tabela base)
+CAMPOS_BUSCA = [
+    ('users', 'display_name'),
+    ('games', 'name'),
+    (None, 'language'),
+    (None, 'title'),
+]
+
+OPERADORES = {
+    '=': '',
+    '!=': '',
+    '<': '__lt',
+    '<=': '__lte',
+    '>': '__gt',
+    '>=': '__gte',
+    'LIKE': '__icontains',
+}
+
+FUNCOES_AGREGACAO = {
+    'COUNT': Count,
+    'SUM': Sum,
+    'AVG': Avg,
+    'MAX': Max,
+    'MIN': Min,
+}
+
+# Funções que só fazem sentido sobre campos numéricos
+FUNCOES_NUMERICAS = {'SUM', 'AVG'}
+
+# Filtros rápidos: leem as views materializadas (agregadas no fim da carga
+# do ETL), na ordem de "posicao" e só até REPORTS_QUICK_FILTER_LIMIT
+FILTROS_RAPIDOS = {
+    'top_streamers': {
+        'model': TopStreamer,
+        'colunas': {
+            'users__id': 'id',
+            'users__display_name': 'display_name',
+            'users__broadcaster_type': 'broadcaster_type',
+            'streams__viewer_count': 'total_views',
+        },
+    },
+    'jogos_populares': {
+        'model': JogoPopular,
+        'colunas': {
+            'games__id': 'id',
+            'games__name': 'name',
+            'streams__viewer_count': 'total_views',
+        },
+    },
+    'brpt': {
+        'model': StreamerBrPt,
+        'colunas': {
+            'users__id': 'user_id',
+            'users__display_name': 'display_name',
+            'users__broadcaster_type': 'broadcaster_type',
+            'streams__language': 'language',
+            'streams__viewer_count': 'total_views',
+        },
+    },
+}
+
+
+def _lista(dados, chave):
+    # QueryDict.get() devolve só o último valor de um parâmetro repetido
+    if hasattr(dados, 'getlist'):
+        return dados.getlist(chave)
+    valor = dados.get(chave)
+    if valor is None:
+        return []
+    if isinstance(valor, str):
+        return [valor]
+    return list(valor)
+
+
+def separar_agregado(campo):
+    """
+    "sum__streams__viewer_count" -> ("SUM", "streams__viewer_count"). Campos
+    que não são colunas agregadas voltam como (None, campo).
+    """
+    funcao, _, resto = campo.partition('__')
+    if resto and funcao.islower() and funcao.upper() in FUNCOES_AGREGACAO:
+        return funcao.upper(), resto
+    return None, campo
+
+
+def _data(valor):
+    # date do cleaned_data ou "AAAA-MM-DD" do GET/spec; inválida = sem limite
+    if isinstance(valor, datetime.datetime):
+        return valor.date()
+    if isinstance(valor, datetime.date):
+        return valor
+    try:
+        return datetime.date.fromisoformat(str(valor)) if valor else None
+    except ValueError:
+        return None
+
+
+def _inicio_do_dia(data):
+    momento = datetime.datetime.combine(data, datetime.time.min)
+    return timezone.make_aware(momento) if settings.USE_TZ else momento
+
+
+def _limite_periodo(campo, data):
+    # TIMESTAMP (streams.started_at): meia-noite no fuso do projeto. DATE
+    # (videos, clips): a própria data; com um datetime o Postgres compararia
+    # a coluna como meia-noite UTC e o intervalo andaria um dia
+    return _inicio_do_dia(data) if isinstance(campo, DateTimeField) else data
+
+
+def periodo_relatorio(dados):
+    """
+    (início, fim) do período do relatório como datas, ou None em cada ponta
+    sem limite. O fim é inclusivo (o dia inteiro).
+    """
+    return _data(dados.get('data_inicio')), _data(dados.get('data_fim'))
+
+
+def _separar(campo, tabela_padrao):
+    if '__' in campo:
+        return tuple(campo.split('__', 1))
+    return tabela_padrao, campo
+
+
+def consulta_busca(texto):
+    """
+    SearchQuery com prefixo em cada palavra ("user stream" -> "user:* &
+    stream:*"), para a busca responder enquanto o usuário digita.
+    """
+    termos = re.findall(r'\w+', texto)
+    if not termos:
+        return None
+    return SearchQuery(' & '.join(f'{termo}:*' for termo in termos), search_type='raw', config=CONFIG_BUSCA)
+
+
+def escolher_base(tabelas_usadas, tabelas_marcadas=()):
+    """
+    Tabela base que alcança, por joins, todas as tabelas usadas, na ordem de
+    PRIORIDADE_BASE. Só vale uma tabela usada ou marcada pelo usuário: uma
+    tabela de ligação implícita (ex.: streams para campos só de users e
+    games) devolveria uma linha por transmissão, com os pares repetidos.
+    Sem base, o relatório fica vazio e o form mostra o erro.
+    """
+    permitidas = set(tabelas_usadas) | set(tabelas_marcadas)
+    for base in PRIORIDADE_BASE:
+        if base in permitidas and all(t in catalogo().caminhos(base) for t in tabelas_usadas):
+            return base
+    return None
+
+
+class PlanoConsulta:
+    """
+    Plano compilado de um relatório: model base, campos do values(), mapa de
+    colunas, ordem, filtros e agregação, tudo já resolvido para o ORM. É
+    compilado uma vez por forma do relatório; cada chamada só liga os valores
+    (valores dos filtros e texto da busca) em executar().
+    """
+
+    def __init__(self, model, colunas, ordem=(), filtros=(), logico=None,
+                 busca=(), busca_textual=False, ranquear=False,
+                 agregacao=None, grupo=None, filtro_fixo=None, periodo=None):
+        self.model = model
+        self.colunas = dict(colunas)
+        self.ordem = list(ordem)
+        # [(chave do filtro no ORM, negado, nome do parâmetro do valor)]
+        self.filtros = list(filtros)
+        self.logico = logico
+        self.busca = list(busca)
+        # Busca pelo índice GIN de streams.busca no lugar dos icontains;
+        # com ranquear, anota "rank_busca" (SearchRank) para a ordenação
+        self.busca_textual = busca_textual
+        self.ranquear = ranquear
+        # [(função, lookup, rótulo)] da agregação sem agrupamento
+        self.agregacao = agregacao
+        # {alias: expressão} anotado sobre o values() (GROUP BY no banco)
+        self.grupo = grupo
+        self.filtro_fixo = filtro_fixo
+        # Coluna de data da base que recebe data_inicio/data_fim
+        self.periodo = periodo
+
+        self.values_fields = list(dict.fromkeys(
+            chave for chave in self.colunas.values() if not grupo or chave not in grupo
+        ))
+        if not grupo:
+            self.values_fields += [c for c, _ in self.ordem if c not in self.values_fields]
+
+    def _filtro(self, dados):
+        termos = []
+        for chave, negado, parametro in self.filtros:
+            termo = Q(**{chave: dados.get(parametro)})
+            termos.append(~termo if negado else termo)
+
+        filtro = Q()
+        if len(termos) == 2:
+            filtro = termos[0] & termos[1] if self.logico == 'AND' else termos[0] | termos[1]
+        elif termos:
+            filtro = termos[0]
+
+        if self.periodo:
+            # Intervalo meio-aberto [início, fim + 1 dia): pega o último dia
+            # inteiro e é o formato que o particionamento por mês poda
+            inicio, fim = periodo_relatorio(dados)
+            campo = self.model._meta.get_field(self.periodo)
+            if inicio:
+                filtro &= Q(**{f'{self.periodo}__gte': _limite_periodo(campo, inicio)})
+            if fim:
+                filtro &= Q(**{f'{self.periodo}__lt': _limite_periodo(campo, fim + datetime.timedelta(days=1))})
+
+        texto = (dados.get('busca_global') or '').strip()
+        if self.busca and texto:
+            filtro_busca = Q()
+            for lookup in self.busca:
+                filtro_busca |= Q(**{f'{lookup}__icontains': texto})
+            filtro &= filtro_busca
+        return filtro
+
+    def executar(self, dados):
+        qs = self.model.objects.all()
+        if self.filtro_fixo:
+            qs = qs.filter(**self.filtro_fixo)
+        filtro = self._filtro(dados)
+        if filtro:
+            qs = qs.filter(filtro)
+
+        texto = (dados.get('busca_global') or '').strip()
+        consulta = None
+        if self.busca_textual and texto:
+            consulta = consulta_busca(texto)
+            qs = qs.filter(busca=consulta) if consulta is not None else qs.none()
+
+        if self.agregacao:
+            # Todas as funções numa única consulta; uma linha por função
+            resultado = qs.aggregate(**{
+                f'resultado_{i}': funcao(lookup)
+                for i, (funcao, lookup, _) in enumerate(self.agregacao)
+            })
+            return [
+                {'Agregação': rotulo, 'Resultado': resultado[f'resultado_{i}']}
+                for i, (_, _, rotulo) in enumerate(self.agregacao)
+            ]
+
+        qs_contagem = qs
+        if self.ranquear:
+            # Só na consulta das linhas: a contagem não precisa do ts_rank
+            qs = qs.annotate(rank_busca=SearchRank(F('busca'), consulta) if consulta is not None else Value(0.0))
+        qs = qs.values(*self.values_fields)
+        if self.grupo:
+            qs = qs.annotate(**self.grupo)
+        return ResultadoRelatorio(qs, self.colunas, contagem=qs_contagem if not self.grupo else None,
+                                  ordem=self.ordem)
+
+
+def _modo_busca(dados):
+    if not (dados.get('busca_global') or '').strip():
+        return None
+    modo = dados.get('modo_busca')
+    return modo if modo in MODOS_BUSCA else MODOS_BUSCA[0]
+
+
+def forma_relatorio(dados):
+    """
+    Parte do relatório que define o plano (tudo menos os valores dos filtros
+    e o texto da busca), em forma hashable para o cache de planos.
+    """
+    filtro_rapido = dados.get('filter')
+    if filtro_rapido in FILTROS_RAPIDOS:
+        return ('rapido', filtro_rapido)
+
+    # Só campos e operadores do catálogo: o resto (ex.: GET editado à mão)
+    # é ignorado em vez de virar erro do ORM
+    def filtro(n):
+        campo = dados.get(f'filter_field{n}')
+        operador = dados.get(f'filter_operator{n}')
+        ativo = bool(campo and operador and dados.get(f'filter_value{n}'))
+        return (campo, operador) if ativo and catalogo().operador_permitido(campo, operador) else None
+
+    filtro1, filtro2 = filtro(1), filtro(2)
+    logico = dados.get('logical_operator')
+    if dados.get('filter_field1') and dados.get('filter_field2') and logico in ('AND', 'OR'):
+        filtros = tuple(f for f in (filtro1, filtro2) if f)
+        if len(filtros) < 2:
+            logico = None
+    elif dados.get('filter_field1'):
+        filtros, logico = ((filtro1,) if filtro1 else ()), None
+    elif dados.get('filter_field2'):
+        filtros, logico = ((filtro2,) if filtro2 else ()), None
+    else:
+        filtros, logico = (), None
+    parametros = tuple(
+        f'filter_value{n}' for n, f in ((1, filtro1), (2, filtro2)) if f and f in filtros
+    )
+
+    agregacao = None
+    campo_agregado = catalogo().campo(dados.get('aggregation_field') or '')
+    funcoes = [str(f).upper() for f in _lista(dados, 'aggregation_function') if f]
+    funcoes = tuple(dict.fromkeys(
+        f for f in funcoes
+        if f in FUNCOES_AGREGACAO and (f not in FUNCOES_NUMERICAS or (campo_agregado and campo_agregado.numerico))
+    ))
+    if funcoes and campo_agregado:
+        agregacao = (funcoes, campo_agregado.chave)
+
+    order_field = dados.get('order_field') or None
+    if order_field and not catalogo().campo(order_field):
+        order_field = None
+
+    return (
+        'relatorio',
+        tuple(_lista(dados, 'tables')),
+        tuple(campo for campo in _lista(dados, 'fields') if catalogo().campo(campo)),
+        tuple(zip(filtros, parametros)),
+        logico,
+        order_field,
+        str(dados.get('order_type') or 'ASC').upper(),
+        agregacao,
+        _modo_busca(dados),
+    )
+
+
+@lru_cache(maxsize=512)
+def compilar(forma):
+    """
+    Compila a forma do relatório num PlanoConsulta (ou None se não há o que
+    consultar). Cacheado: o mapeamento de campos e joins roda uma vez por forma.
+    """
+    if forma[0] == 'rapido':
+        definicao = FILTROS_RAPIDOS[forma[1]]
+        # O limite vira "posicao <= N" (índice em posicao): contagem, páginas,
+        # cursores e exportação enxergam o mesmo top N
+        limite = getattr(settings, 'REPORTS_QUICK_FILTER_LIMIT', 100)
+        return PlanoConsulta(
+            definicao['model'],
+            definicao['colunas'],
+            ordem=[('posicao', False)],
+            filtro_fixo={'posicao__lte': limite},
+        )
+
+    _, tabelas, campos, filtros, logico, order_field, order_type, agregacao, modo_busca = forma
+    if not campos:
+        return None
+    tabela_padrao = tabelas[0] if tabelas else None
+
+    usados = [_separar(c, tabela_padrao) for c in campos]
+    usados += [_separar(campo, tabela_padrao) for (campo, _), _ in filtros]
+    if order_field:
+        usados.append(_separar(order_field, tabela_padrao))
+    if agregacao:
+        usados.append(_separar(agregacao[1], tabela_padrao))
+    tabelas_usadas = {tabela for tabela, _ in usados}
+
+    base = escolher_base(tabelas_usadas, tabelas)
+    if base is None:
+        return None
+    model = catalogo().tabela(base).model
+    caminhos = catalogo().caminhos(base)
+
+    def lookup(campo):
+        tabela, atributo = _separar(campo, tabela_padrao)
+        return f'{caminhos[tabela]}{atributo}'
+
+    colunas = {campo: lookup(campo) for campo in campos}
+
+    chaves_filtro = []
+    for (campo, operador), parametro in filtros:
+        chaves_filtro.append((lookup(campo) + OPERADORES.get(operador, ''), operador == '!=', parametro))
+
+    periodo = CAMPOS_PERIODO.get(base)
+
+    busca = []
+    busca_textual = modo_busca == 'palavras' and base == 'streams'
+    if modo_busca and not busca_textual:
+        for tabela, atributo in CAMPOS_BUSCA:
+            tabela = tabela or base
+            if tabela not in caminhos:
+                continue
+            # users e games não têm título nem idioma
+            if atributo in catalogo().tabela(tabela).atributos:
+                busca.append(f'{caminhos[tabela]}{atributo}')
+
+    if agregacao:
+        funcoes, campo_agregado = agregacao
+        lookup_agregado = lookup(campo_agregado)
+        grupo = [c for c in campos if c != campo_agregado]
+
+        if not grupo:
+            # Nenhum campo para agrupar: aggregate() sobre o relatório inteiro
+            nome = campo_agregado.split('__', 1)[-1]
+            return PlanoConsulta(
+                model,
+                {},
+                filtros=chaves_filtro,
+                logico=logico,
+                busca=busca,
+                busca_textual=busca_textual,
+                periodo=periodo,
+                agregacao=[(FUNCOES_AGREGACAO[f], lookup_agregado, f'{f}({nome})') for f in funcoes],
+            )
+
+        # GROUP BY nos campos não agregados, uma coluna por função:
+        # values(grupo).annotate(...) e só as linhas agrupadas saem do banco
+        colunas = {campo: lookup(campo) for campo in grupo}
+        anotacoes = {}
+        for i, funcao in enumerate(funcoes):
+            alias = f'agregado_{i}'
+            colunas[f'{funcao.lower()}__{campo_agregado}'] = alias
+            anotacoes[alias] = FUNCOES_AGREGACAO[funcao](lookup_agregado)
+
+        # O conjunto das chaves do agrupamento é único: serve de desempate
+        desc = order_type != 'ASC'
+        chaves_grupo = list(dict.fromkeys(colunas[c] for c in grupo))
+        ordem = []
+        if order_field == campo_agregado:
+            ordem.append(('agregado_0', desc))
+        elif order_field in grupo:
+            ordem.append((colunas[order_field], desc))
+        ordem += [(chave, desc) for chave in chaves_grupo if (chave, desc) not in ordem]
+
+        return PlanoConsulta(
+            model,
+            colunas,
+            ordem=ordem,
+            filtros=chaves_filtro,
+            logico=logico,
+            busca=busca,
+            busca_textual=busca_textual,
+            grupo=anotacoes,
+            periodo=periodo,
+        )
+
+    # Ordem do relatório com a pk como desempate: deixa as páginas estáveis
+    # e dá ao modo keyset uma chave única para o cursor. Sem ordem escolhida,
+    # a busca textual ordena pela relevância
+    ranquear = busca_textual and not order_field
+    if order_field:
+        desc = order_type != 'ASC'
+        ordem = [(lookup(order_field), desc), ('pk', desc)]
+    elif ranquear:
+        ordem = [('rank_busca', True), ('pk', False)]
+    else:
+        ordem = [('pk', False)]
+
+    return PlanoConsulta(
+        model,
+        colunas,
+        ordem=ordem,
+        filtros=chaves_filtro,
+        logico=logico,
+        busca=busca,
+        busca_textual=busca_textual,
+        ranquear=ranquear,
+        periodo=periodo,
+    )
+
+
+def montar_queryset(dados):
+    """
+    Monta o resultado de um relatório a partir dos dados do builder (GET,
+    cleaned_data do form ou spec normalizada).
+    """
+    plano = compilar(forma_relatorio(dados))
+    if plano is None:
+        return []
+    return plano.executar(dados)
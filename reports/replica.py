@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DatabaseError, OperationalError, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from reports.versao_dados import versao_dados
+
+logger = logging.getLogger("reports.replica")
+
+ALIAS_REPLICA = "replica"
+
+# Atraso da réplica em segundos: zero se já aplicou todo o WAL recebido (o
+# primário pode só estar sem escritas), senão a idade da última transação
+# aplicada. Junto, a versão dos dados do ETL que a réplica enxerga
+SQL_ESTADO = """
+    SELECT
+        CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END,
+        (SELECT versao FROM etl_versao WHERE id = 1)
+"""
+
+_estado = {"alias": None, "verificado_em": 0.0}
+_lock = threading.Lock()
+
+# Forçado pelo usando_primario() (ex.: sugerir_indices, que cria índices)
+_forcar_primario = ContextVar("forcar_primario", default=False)
+
+
+def replica_configurada():
+    return ALIAS_REPLICA in settings.DATABASES
+
+
+def _verificar_replica():
+    """
+    A réplica serve leituras se responde, está com atraso até
+    REPORTS_REPLICA_MAX_LAG e já tem a versão dos dados do primário (que é a
+    chave dos caches: resultado da réplica velha não entra no cache novo).
+    """
+    try:
+        conexao = connections[ALIAS_REPLICA]
+        with conexao.cursor() as cursor:
+            if conexao.vendor == "postgresql":
+                cursor.execute(SQL_ESTADO)
+                atraso, versao = cursor.fetchone()
+            else:
+                cursor.execute("SELECT versao FROM etl_versao WHERE id = 1")
+                linha = cursor.fetchone()
+                atraso, versao = 0, linha[0] if linha else None
+    except DatabaseError as erro:
+        logger.warning("Réplica indisponível, leituras no primário: %s", erro)
+        return False
+
+    limite = getattr(settings, "REPORTS_REPLICA_MAX_LAG", 30)
+    if float(atraso) > limite:
+        logger.warning("Réplica atrasada %.1fs (limite %ss), leituras no primário", atraso, limite)
+        return False
+    # Sem linha no etl_versao é a versão "0", como no versao_dados()
+    versao = "0" if versao is None else str(versao)
+    if versao != versao_dados():
+        logger.info("Réplica na versão %s dos dados, primário na %s: leituras no primário", versao, versao_dados())
+        return False
+    return True
+
+
+def alias_leitura():
+    """
+    Alias para as leituras dos relatórios: a réplica quando configurada e
+    saudável, senão o primário ("default"). O estado é reavaliado a cada
+    REPORTS_REPLICA_CHECK_INTERVAL segundos.
+    """
+    if not replica_configurada() or _forcar_primario.get():
+        return "default"
+
+    intervalo = getattr(settings, "REPORTS_REPLICA_CHECK_INTERVAL", 5)
+    agora = time.monotonic()
+    with _lock:
+        if _estado["alias"] is not None and agora - _estado["verificado_em"] < intervalo:
+            return _estado["alias"]
+
+    alias = ALIAS_REPLICA if _verificar_replica() else "default"
+    with _lock:
+        _estado["alias"] = alias
+        _estado["verificado_em"] = time.monotonic()
+    return alias
+
+
+def marcar_replica_indisponivel():
+    # Até a próxima verificação as leituras vão para o primário
+    with _lock:
+        _estado["alias"] = "default"
+        _estado["verificado_em"] = time.monotonic()
+
+
+@contextmanager
+def usando_primario():
+    token = _forcar_primario.set(True)
+    try:
+        yield
+    finally:
+        _forcar_primario.reset(token)
+
+
+def _vigiar_replica(execute, sql, params, many, context):
+    try:
+        return execute(sql, params, many, context)
+    except OperationalError:
+        # Conexão caiu no meio: o próximo relatório já vai para o primário
+        marcar_replica_indisponivel()
+        raise
+
+
+@receiver(connection_created)
+def _instalar_vigia(sender, connection, **kwargs):
+    if connection.alias == ALIAS_REPLICA and _vigiar_replica not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_vigiar_replica)
+
+
+class RoteadorReplica:
+    """
+    Router do Django: leituras dos models do app reports (tabelas do ETL e
+    views materializadas) vão para alias_leitura(); escritas e migrações
+    ficam no primário. Exportações longas na réplica podem ser canceladas por
+    conflito de recovery (max_standby_streaming_delay no Postgres).
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == "reports":
+            return alias_leitura()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != ALIAS_REPLICA
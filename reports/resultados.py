@@ -0,0 +1,217 @@
+import base64
+import datetime
+import json
+
+from django.db.models import Count, F, Q, Sum
+
+from reports.contagem import contar
+
+
+def _valor_cursor(valor):
+    # streams.started_at é TIMESTAMP sem fuso: o psycopg2 devolve datetime
+    # ingênuo, em UTC (fuso da sessão do Django com USE_TZ). No cursor vai com
+    # o fuso explícito; sem ele o filtro o leria no TIME_ZONE do projeto
+    if isinstance(valor, datetime.datetime):
+        if valor.tzinfo is None:
+            valor = valor.replace(tzinfo=datetime.timezone.utc)
+        return valor.isoformat()
+    if isinstance(valor, datetime.date):
+        return valor.isoformat()
+    return str(valor)
+
+
+def codificar_cursor(valores):
+    dados = json.dumps(valores, default=_valor_cursor, separators=(",", ":"))
+    return base64.urlsafe_b64encode(dados.encode("utf-8")).decode("ascii")
+
+
+def decodificar_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, UnicodeError):
+        return None
+
+
+class ResultadoRelatorio:
+    """
+    Resultado preguiçoso de um relatório.
+
+    Envolve um queryset de values() e só vai ao banco quando é fatiado
+    (LIMIT/OFFSET), iterado ou contado. Cada linha é devolvida como um dict
+    com as chaves no formato "tabela__campo" usado pelo builder.
+    """
+
+    def __init__(self, qs, colunas, contagem=None, ordem=None):
+        # colunas: {"tabela__campo": chave da linha no values()}
+        # ordem: [(chave no values(), decrescente)], sempre terminando numa
+        # chave única (pk ou chave do agrupamento) para o modo keyset
+        self.colunas = colunas
+        self.ordem = list(ordem or [])
+        # Queryset usado só para contar (sem os joins do values())
+        self.qs_contagem = contagem if contagem is not None else qs
+        self.qs = qs.order_by(*self._expressoes_ordem()) if self.ordem else qs
+        self._total = None
+        # False quando count() devolveu uma estimativa (tabelas grandes)
+        self.contagem_exata = True
+
+    @property
+    def ordered(self):
+        return self.qs.ordered
+
+    def _expressoes_ordem(self, inverter=False):
+        # NULLs no fim em ASC e no começo em DESC (padrão do Postgres), explícito
+        # para que a ordem invertida da página anterior seja exatamente o reverso
+        expressoes = []
+        for chave, desc in self.ordem:
+            if desc != inverter:
+                expressoes.append(F(chave).desc(nulls_first=True))
+            else:
+                expressoes.append(F(chave).asc(nulls_last=True))
+        return expressoes
+
+    def _mapear(self, row):
+        return {campo: row.get(chave, "") for campo, chave in self.colunas.items()}
+
+    def count(self):
+        if self._total is None:
+            self._total, self.contagem_exata = contar(self.qs_contagem.order_by())
+        return self._total
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            # Vira LIMIT/OFFSET no SQL
+            return [self._mapear(row) for row in self.qs[item]]
+        return self._mapear(self.qs[item])
+
+    def __iter__(self):
+        return self.iterar()
+
+    def iterar(self, tamanho_lote=2000):
+        # No Postgres o iterator() usa um cursor do lado do servidor: as linhas
+        # chegam em lotes, sem carregar o resultado inteiro na memória
+        for row in self.qs.iterator(chunk_size=tamanho_lote):
+            yield self._mapear(row)
+
+    # ======================
+    # SÉRIES PARA GRÁFICOS
+    # ======================
+    @property
+    def agrupado(self):
+        return self.qs.query.group_by is not None
+
+    def agrupar(self, campo_x, campo_y=None, funcao=Sum, limite=30):
+        """
+        Série [(x, y)] calculada no banco com GROUP BY em campo_x, cobrindo o
+        relatório inteiro e não só a página exibida.
+        """
+        if self.agrupado:
+            # Já é um GROUP BY (filtros rápidos): as primeiras linhas são a série
+            return [
+                (linha.get(campo_x), linha.get(campo_y) if campo_y else None)
+                for linha in self[:limite]
+            ]
+
+        chave_x = self.colunas[campo_x]
+        if campo_y and campo_y in self.colunas:
+            valor = funcao(self.colunas[campo_y])
+        else:
+            valor = Count("pk")
+        qs = (
+            self.qs.order_by()
+            .values(chave_x)
+            .annotate(valor_grafico=valor)
+            .order_by(F("valor_grafico").desc(nulls_last=True))
+        )
+        return [(row[chave_x], row["valor_grafico"]) for row in qs[:limite]]
+
+    # ======================
+    # PAGINAÇÃO KEYSET
+    # ======================
+    def _filtro_apos(self, valores, inverter=False):
+        # (c1, c2, ...) > (v1, v2, ...) na ordem do relatório, tratando NULLs
+        termos = []
+        iguais = Q()
+        for (chave, desc), valor in zip(self.ordem, valores):
+            desc = desc != inverter
+            if valor is None:
+                depois = Q(**{f"{chave}__isnull": False}) if desc else None
+                igual = Q(**{f"{chave}__isnull": True})
+            else:
+                lookup = "lt" if desc else "gt"
+                depois = Q(**{f"{chave}__{lookup}": valor})
+                if not desc:
+                    depois |= Q(**{f"{chave}__isnull": True})
+                igual = Q(**{chave: valor})
+            if depois is not None:
+                termos.append(iguais & depois)
+            iguais &= igual
+        if not termos:
+            return Q(pk__in=[])
+        filtro = termos[0]
+        for termo in termos[1:]:
+            filtro |= termo
+        return filtro
+
+    def pagina_keyset(self, apos=None, antes=None, tamanho=10):
+        """
+        Busca uma página a partir de um cursor opaco, sem OFFSET: o custo é o
+        mesmo para a primeira página e para a página 5.000.
+        """
+        cursor = antes or apos
+        valores = decodificar_cursor(cursor) if cursor else None
+        if not isinstance(valores, list) or len(valores) != len(self.ordem):
+            valores = None
+        voltando = bool(antes) and valores is not None
+
+        qs = self.qs
+        if voltando:
+            qs = qs.order_by(*self._expressoes_ordem(inverter=True))
+        if valores is not None:
+            qs = qs.filter(self._filtro_apos(valores, inverter=voltando))
+
+        linhas = list(qs[:tamanho + 1])
+        tem_mais = len(linhas) > tamanho
+        linhas = linhas[:tamanho]
+        if voltando:
+            linhas.reverse()
+
+        def cursor_da(row):
+            return codificar_cursor([row.get(chave) for chave, _ in self.ordem])
+
+        pagina = PaginaKeyset([self._mapear(row) for row in linhas])
+        if linhas:
+            if voltando:
+                pagina.has_previous = tem_mais
+                pagina.has_next = True
+            else:
+                pagina.has_previous = valores is not None
+                pagina.has_next = tem_mais
+            if pagina.has_previous:
+                pagina.cursor_anterior = cursor_da(linhas[0])
+            if pagina.has_next:
+                pagina.cursor_proximo = cursor_da(linhas[-1])
+        return pagina
+
+
+class PaginaKeyset:
+    def __init__(self, object_list):
+        self.object_list = object_list
+        self.has_next = False
+        self.has_previous = False
+        self.cursor_proximo = None
+        self.cursor_anterior = None
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
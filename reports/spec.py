@@ -0,0 +1,57 @@
+import datetime
+import hashlib
+import json
+
+# Parâmetros da requisição que não fazem parte da definição do relatório
+PARAMETROS_IGNORADOS = {"csrfmiddlewaretoken", "page", "after", "before"}
+
+
+def _texto(valor):
+    if isinstance(valor, (datetime.date, datetime.datetime)):
+        return valor.isoformat()
+    return str(valor)
+
+
+def normalizar_dados(dados):
+    """
+    Converte os dados de um relatório (QueryDict do GET, cleaned_data do form
+    ou dict vindo de JSON) num dict simples, serializável, no formato que o
+    montar_queryset entende: valores únicos como str e múltiplos como lista.
+    """
+    normalizado = {}
+    chaves = dados.keys()
+    for chave in chaves:
+        if chave in PARAMETROS_IGNORADOS:
+            continue
+        if hasattr(dados, "getlist"):
+            valores = dados.getlist(chave)
+        else:
+            valores = dados[chave]
+            if not isinstance(valores, (list, tuple)):
+                valores = [valores]
+        valores = [_texto(v) for v in valores if v not in (None, "")]
+        if not valores:
+            continue
+        normalizado[chave] = valores if len(valores) > 1 else valores[0]
+    return normalizado
+
+
+def _canonico(valor):
+    if isinstance(valor, dict):
+        canonico = {chave: _canonico(v) for chave, v in valor.items()}
+        # A ordem das tabelas marcadas não muda o relatório
+        if isinstance(canonico.get("tables"), list):
+            canonico["tables"] = sorted(canonico["tables"])
+        return canonico
+    if isinstance(valor, (list, tuple)):
+        return [_canonico(v) for v in valor]
+    return valor
+
+
+def hash_spec(spec, *extras):
+    """
+    Hash canônico de uma definição (chaves ordenadas, tabelas sem ordem),
+    mais extras como a versão dos dados. Usado como chave de cache.
+    """
+    conteudo = json.dumps(_canonico([spec, *extras]), sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
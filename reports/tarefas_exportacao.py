@@ -0,0 +1,361 @@
+import fcntl
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from reports.exportacao import escrever_colunar, escrever_excel, gerar_csv, gerar_json, gerar_ndjson, iterar_linhas
+from reports.instrumentacao import LinhasMedidas, MedicaoRelatorio, medindo
+from reports.query_builder import montar_queryset
+from reports.resultados import ResultadoRelatorio
+from reports.spec import hash_spec
+from reports.versao_dados import versao_dados
+
+logger = logging.getLogger("reports.tarefas_exportacao")
+
+# Formato -> (extensão, content type)
+FORMATOS = {
+    "csv": ("csv", "text/csv"),
+    "json": ("json", "application/json"),
+    "ndjson": ("ndjson", "application/x-ndjson"),
+    "excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+    "arrow": ("arrow", "application/vnd.apache.arrow.file"),
+}
+
+GERADORES_TEXTO = {"csv": gerar_csv, "json": gerar_json, "ndjson": gerar_ndjson}
+
+ID_VALIDO = re.compile(r"^[0-9a-f]{32}$")
+
+# Intervalo mínimo entre duas varreduras de arquivos expirados (s)
+INTERVALO_LIMPEZA = 60
+
+
+class FilaExportacoesCheia(Exception):
+    pass
+
+
+def _configuracao():
+    workers = getattr(settings, "REPORTS_EXPORT_JOB_WORKERS", None) or 2
+    fila = getattr(settings, "REPORTS_EXPORT_JOB_QUEUE", None) or workers * 4
+    ttl = getattr(settings, "REPORTS_EXPORT_JOB_TTL", 6 * 3600)
+    return workers, fila, ttl
+
+
+def _diretorio():
+    return Path(getattr(settings, "REPORTS_EXPORT_JOBS_DIR", Path(tempfile.gettempdir()) / "reports_exportacoes"))
+
+
+_lock = threading.Lock()
+_executor = None
+_vagas = None
+_ultima_limpeza = 0.0
+
+
+def _obter_executor():
+    global _executor, _vagas
+    with _lock:
+        if _executor is None:
+            workers, fila, _ = _configuracao()
+            # Threads, não processos: o trabalho é esperar o banco e escrever
+            # no disco, e cada thread usa a sua conexão do Django
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="exportacao")
+            _vagas = threading.BoundedSemaphore(fila)
+        return _executor, _vagas
+
+
+# ======================
+# ESTADO (um JSON por tarefa, ao lado do arquivo exportado)
+# ======================
+def _caminho_estado(tarefa_id):
+    return _diretorio() / f"{tarefa_id}.json"
+
+
+def _caminho_arquivo(tarefa_id, formato):
+    return _diretorio() / f"{tarefa_id}.{FORMATOS[formato][0]}"
+
+
+def ler_estado(tarefa_id):
+    if not ID_VALIDO.match(tarefa_id or ""):
+        return None
+    try:
+        return json.loads(_caminho_estado(tarefa_id).read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _gravar_estado(estado):
+    diretorio = _diretorio()
+    diretorio.mkdir(parents=True, exist_ok=True)
+    # Escrita atômica: o polling (de qualquer processo) nunca lê JSON pela metade
+    fd, temporario = tempfile.mkstemp(dir=diretorio, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as arquivo:
+        json.dump(estado, arquivo)
+    os.replace(temporario, _caminho_estado(estado["id"]))
+
+
+@contextmanager
+def _submissao_exclusiva():
+    """
+    Trava entre processos (workers do gunicorn) para decidir se uma tarefa
+    já existe e gravar o estado novo: sem ela, dois processos podiam ver a
+    tarefa ausente e exportar o mesmo arquivo. O flock é solto pelo sistema
+    se o processo morrer. Dentro do processo, o _lock serializa as threads.
+    """
+    diretorio = _diretorio()
+    diretorio.mkdir(parents=True, exist_ok=True)
+    with _lock, open(diretorio / ".submissao.lock", "a") as trava:
+        fcntl.flock(trava, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(trava, fcntl.LOCK_UN)
+
+
+def _processo_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def _expirada(estado, agora):
+    _, _, ttl = _configuracao()
+    if estado["status"] in ("concluida", "erro"):
+        return agora - estado["atualizado_em"] > ttl
+    # Na fila ou executando num processo que morreu (deploy, OOM): abandonada
+    return not _processo_vivo(estado["pid"])
+
+
+def _remover(estado):
+    tarefa_id, formato = estado["id"], estado["formato"]
+    _caminho_arquivo(tarefa_id, formato).unlink(missing_ok=True)
+    # Temporários de exportações interrompidas (um por execução)
+    for parcial in _diretorio().glob(f"{tarefa_id}.*.parcial"):
+        parcial.unlink(missing_ok=True)
+    _caminho_estado(tarefa_id).unlink(missing_ok=True)
+
+
+def limpar_expiradas(forcar=False):
+    """
+    Remove arquivos e estados de tarefas com mais de REPORTS_EXPORT_JOB_TTL
+    segundos e de tarefas abandonadas. Roda no máximo a cada
+    INTERVALO_LIMPEZA segundos por processo.
+    """
+    global _ultima_limpeza
+    agora = time.time()
+    with _lock:
+        if not forcar and agora - _ultima_limpeza < INTERVALO_LIMPEZA:
+            return 0
+        _ultima_limpeza = agora
+
+    removidas = 0
+    for caminho in _diretorio().glob("*.json"):
+        estado = ler_estado(caminho.stem)
+        if estado is None or not _expirada(estado, agora):
+            continue
+        # Relido sob a trava: outro processo pode ter acabado de submeter de novo
+        with _submissao_exclusiva():
+            estado = ler_estado(caminho.stem)
+            if estado is not None and _expirada(estado, agora):
+                _remover(estado)
+                removidas += 1
+    return removidas
+
+
+# ======================
+# SUBMISSÃO E EXECUÇÃO
+# ======================
+def id_tarefa(dados, formato):
+    # Mesma definição, formato e versão dos dados do ETL = mesmo arquivo
+    return hash_spec(dados, formato, versao_dados())[:32]
+
+
+def submeter(dados, formato):
+    """
+    Enfileira a exportação do relatório e devolve o estado da tarefa. Se a
+    mesma exportação já está na fila, executando ou pronta (e não expirou),
+    em qualquer processo, devolve a existente sem exportar de novo. Com a
+    fila cheia levanta FilaExportacoesCheia.
+    """
+    limpar_expiradas()
+    tarefa_id = id_tarefa(dados, formato)
+    executor, vagas = _obter_executor()
+
+    with _submissao_exclusiva():
+        existente = ler_estado(tarefa_id)
+        if existente is not None and existente["status"] != "erro" and not _expirada(existente, time.time()):
+            return existente
+        if not vagas.acquire(blocking=False):
+            raise FilaExportacoesCheia()
+
+        agora = time.time()
+        estado = {
+            "id": tarefa_id,
+            "formato": formato,
+            "status": "na_fila",
+            "pid": os.getpid(),
+            "linhas": 0,
+            "total": None,
+            "total_exato": True,
+            "criada_em": agora,
+            "iniciada_em": None,
+            "atualizado_em": agora,
+            "erro": None,
+        }
+        _gravar_estado(estado)
+
+    # Cópia: a thread da exportação continua alterando o estado
+    publico = dict(estado)
+    try:
+        futuro = executor.submit(_executar, estado, dados)
+    except BaseException:
+        vagas.release()
+        raise
+    futuro.add_done_callback(lambda _: vagas.release())
+    return publico
+
+
+class _Progresso:
+    """
+    Repassa as linhas para o exportador e grava o progresso no estado a
+    cada lote.
+    """
+
+    def __init__(self, resultado, estado):
+        self.resultado = resultado
+        self.estado = estado
+
+    def iterar(self, tamanho_lote):
+        for i, linha in enumerate(iterar_linhas(self.resultado, tamanho_lote), 1):
+            yield linha
+            if i % tamanho_lote == 0:
+                self.estado["linhas"] = i
+                self.estado["atualizado_em"] = time.time()
+                _gravar_estado(self.estado)
+
+
+def _exportar(estado, dados, medicao):
+    formato = estado["formato"]
+    fieldnames = dados.get("fields", [])
+    if isinstance(fieldnames, str):
+        fieldnames = [fieldnames]
+
+    resultado = montar_queryset(dados)
+    if isinstance(resultado, ResultadoRelatorio):
+        fieldnames = list(resultado.colunas)
+        # Estimada em tabelas grandes: só para a barra de progresso e o ETA
+        estado["total"] = resultado.count()
+        estado["total_exato"] = resultado.contagem_exata
+    else:
+        if resultado:
+            fieldnames = list(resultado[0])
+        estado["total"] = len(resultado)
+
+    agora = time.time()
+    estado.update(status="executando", iniciada_em=agora, atualizado_em=agora)
+    _gravar_estado(estado)
+
+    progresso = _Progresso(LinhasMedidas(resultado, medicao), estado)
+    final = _caminho_arquivo(estado["id"], formato)
+    # Temporário próprio desta execução, no mesmo diretório (o os.replace
+    # precisa do mesmo sistema de arquivos)
+    fd, parcial = tempfile.mkstemp(dir=final.parent, prefix=f"{estado['id']}.", suffix=".parcial")
+    try:
+        if formato in GERADORES_TEXTO:
+            with os.fdopen(fd, "w", encoding="utf-8", newline="") as arquivo:
+                for bloco in GERADORES_TEXTO[formato](progresso, fieldnames):
+                    arquivo.write(bloco)
+        elif formato == "excel":
+            with os.fdopen(fd, "wb") as arquivo:
+                escrever_excel(progresso, fieldnames, arquivo)
+        else:
+            with os.fdopen(fd, "wb") as arquivo:
+                escrever_colunar(progresso, fieldnames, arquivo, formato)
+        # O download só enxerga o arquivo completo
+        os.replace(parcial, final)
+    except BaseException:
+        Path(parcial).unlink(missing_ok=True)
+        raise
+
+    estado.update(
+        status="concluida",
+        linhas=medicao.linhas or 0,
+        tamanho=final.stat().st_size,
+        atualizado_em=time.time(),
+    )
+    _gravar_estado(estado)
+
+
+def _executar(estado, dados):
+    # Fora de um request: a thread abre e fecha a própria conexão
+    close_old_connections()
+    medicao = MedicaoRelatorio(f"export_tarefa_{estado['formato']}", dados)
+    try:
+        with medindo(medicao):
+            _exportar(estado, dados, medicao)
+    except Exception as erro:
+        logger.exception("Erro na exportação %s", estado["id"])
+        estado.update(status="erro", erro=str(erro), atualizado_em=time.time())
+        _gravar_estado(estado)
+    finally:
+        close_old_connections()
+
+
+# ======================
+# CONSULTA
+# ======================
+def progresso(estado):
+    """
+    Estado público da tarefa para o polling: linhas escritas, percentual e
+    tempo restante estimado pela taxa de linhas até agora.
+    """
+    total = estado["total"]
+    linhas = estado["linhas"]
+    percentual = restante = None
+    if estado["status"] == "concluida":
+        percentual, restante = 100.0, 0
+    elif estado["status"] == "executando" and total:
+        percentual = round(min(linhas / total, 1.0) * 100, 1)
+        decorrido = time.time() - estado["iniciada_em"]
+        if linhas and linhas < total:
+            restante = round(decorrido / linhas * (total - linhas))
+    return {
+        "id": estado["id"],
+        "formato": estado["formato"],
+        "status": estado["status"],
+        "linhas": linhas,
+        "total": total,
+        "total_exato": estado["total_exato"],
+        "percentual": percentual,
+        "segundos_restantes": restante,
+        "tamanho": estado.get("tamanho"),
+        "erro": estado["erro"],
+    }
+
+
+def arquivo_concluido(tarefa_id):
+    """
+    (caminho, nome para download, content type) da tarefa concluída e ainda
+    não expirada, ou None
+    """
+    estado = ler_estado(tarefa_id)
+    if estado is None or estado["status"] != "concluida" or _expirada(estado, time.time()):
+        return None
+    caminho = _caminho_arquivo(tarefa_id, estado["formato"])
+    if not caminho.exists():
+        return None
+    extensao, content_type = FORMATOS[estado["formato"]]
+    return caminho, f"relatorio.{extensao}", content_type
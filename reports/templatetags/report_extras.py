@@ -1,4 +1,5 @@
 from django import template
+from django.utils import formats
 
 register = template.Library()
 
@@ -12,3 +13,15 @@ def get_model_fields(model):
 @register.filter
 def col_label(value, labels_dict):
     return labels_dict.get(value, value)
+
+@register.filter
+def numero_compacto(value):
+    """1234567 -> "1,2M" (contagens estimadas, sem falsa precisão)"""
+    try:
+        numero = float(value)
+    except (TypeError, ValueError):
+        return value
+    for limite, sufixo in ((1e9, "B"), (1e6, "M"), (1e3, "K")):
+        if abs(numero) >= limite:
+            return f"{formats.number_format(numero / limite, 1)}{sufixo}"
+    return formats.number_format(numero, 0)
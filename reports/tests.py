@@ -1,3 +1,637 @@
-from django.test import TestCase
+import datetime
+import fcntl
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from unittest import mock
 
-# Create your tests here.
+import psycopg2
+from django.db import DatabaseError, connection
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INERROR, TRANSACTION_STATUS_INTRANS
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from ad_hoc_django.pool_postgres import pool as pool_postgres
+from ad_hoc_django.pool_postgres.pool import PoolConexoes, obter_pool
+from reports.cache_resultados import CacheLRU, cache_resultados
+from reports.carga_trabalho import _ArquivoRotativoCompartilhado, ler_consultas
+from reports.forms import ReportForm
+from reports.models import Game, Stream, User, Video
+from reports import replica, tarefas_exportacao
+from reports.query_builder import compilar, forma_relatorio, montar_queryset
+from reports.resultados import ResultadoRelatorio, codificar_cursor, decodificar_cursor
+
+
+class TabelasRelatorioMixin:
+    """
+    Os models são unmanaged (tabelas criadas pelo ETL): o banco de teste
+    ganha as tabelas pelo schema_editor, fora da transação do TestCase.
+    """
+    modelos = (User, Game, Stream, Video)
+
+    @classmethod
+    def setUpClass(cls):
+        with connection.schema_editor() as editor:
+            for modelo in cls.modelos:
+                editor.create_model(modelo)
+        try:
+            super().setUpClass()
+        except Exception:
+            # Sem o tearDownClass, as tabelas ficariam para a próxima classe
+            cls._remover_tabelas()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._remover_tabelas()
+
+    @classmethod
+    def _remover_tabelas(cls):
+        with connection.schema_editor() as editor:
+            for modelo in reversed(cls.modelos):
+                editor.delete_model(modelo)
+
+
+class PaginacaoKeysetTests(TabelasRelatorioMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        inicio = datetime.date(2024, 1, 1)
+        User.objects.create(id="u1", display_name="Streamer", created_at=inicio)
+        # Datas repetidas (desempate pela pk) e NULLs no meio
+        for i in range(8):
+            Video.objects.create(
+                id=f"v{i}", user_id="u1", title=f"Vídeo {i}", url="https://x", language="pt", duration="1h",
+                created_at=None if i % 3 == 0 else inicio + datetime.timedelta(days=i % 4),
+            )
+
+    def resultado(self, ordem):
+        return montar_queryset({
+            "tables": ["videos"],
+            "fields": ["videos__title", "videos__created_at"],
+            "order_field": "videos__created_at",
+            "order_type": ordem,
+        })
+
+    def avancar(self, resultado):
+        titulos, cursor, pagina = [], None, None
+        while pagina is None or pagina.has_next:
+            pagina = resultado.pagina_keyset(apos=cursor, tamanho=3)
+            titulos += [linha["videos__title"] for linha in pagina]
+            cursor = pagina.cursor_proximo
+        return titulos, pagina
+
+    def test_cursor_ida_e_volta(self):
+        valores = [None, "2024-01-02T00:00:00+00:00", 42, "v1"]
+        self.assertEqual(decodificar_cursor(codificar_cursor(valores)), valores)
+        self.assertIsNone(decodificar_cursor("não é um cursor"))
+
+    def test_paginas_seguem_a_ordem_completa(self):
+        for ordem in ("ASC", "DESC"):
+            with self.subTest(ordem=ordem):
+                resultado = self.resultado(ordem)
+                completo = [linha["videos__title"] for linha in resultado.iterar()]
+                titulos, _ = self.avancar(resultado)
+                self.assertEqual(titulos, completo)
+                self.assertEqual(len(titulos), 8)
+
+    def test_nulls_no_fim_em_asc_e_no_comeco_em_desc(self):
+        nulos = {"Vídeo 0", "Vídeo 3", "Vídeo 6"}
+        asc, _ = self.avancar(self.resultado("ASC"))
+        desc, _ = self.avancar(self.resultado("DESC"))
+        self.assertEqual(set(asc[-3:]), nulos)
+        self.assertEqual(set(desc[:3]), nulos)
+
+    def test_pagina_anterior_volta_pelo_mesmo_caminho(self):
+        resultado = self.resultado("ASC")
+        completo, ultima = self.avancar(resultado)
+        titulos = [linha["videos__title"] for linha in ultima]
+        pagina = ultima
+        while pagina.has_previous:
+            pagina = resultado.pagina_keyset(antes=pagina.cursor_anterior, tamanho=3)
+            titulos = [linha["videos__title"] for linha in pagina] + titulos
+        self.assertEqual(titulos, completo)
+
+    def test_datetime_sem_fuso_vai_para_o_cursor_em_utc(self):
+        # TIMESTAMP sem fuso (streams.started_at) chega ingênuo do psycopg2
+        cursor = codificar_cursor([datetime.datetime(2024, 1, 1, 10), datetime.date(2024, 1, 2), "s1"])
+        self.assertEqual(decodificar_cursor(cursor), ["2024-01-01T10:00:00+00:00", "2024-01-02", "s1"])
+
+        resultado = montar_queryset({
+            "tables": ["streams"], "fields": ["streams__title"], "order_field": "streams__started_at",
+        })
+        filtro = resultado._filtro_apos(decodificar_cursor(codificar_cursor([datetime.datetime(2024, 1, 1, 10), "s1"])))
+        _, params = Stream.objects.filter(filtro).query.sql_with_params()
+        # 10:00 UTC, e não 10:00 em America/Sao_Paulo (13:00 UTC)
+        self.assertIn("2024-01-01 10:00:00", params)
+        self.assertNotIn("2024-01-01 13:00:00", params)
+
+    def test_coluna_date_com_muitas_linhas_no_mesmo_dia(self):
+        for i in range(8, 33):
+            Video.objects.create(
+                id=f"v{i:02d}", user_id="u1", title=f"Vídeo {i}", url="https://x", language="pt", duration="1h",
+                created_at=datetime.date(2024, 1, 2),
+            )
+        for ordem in ("ASC", "DESC"):
+            with self.subTest(ordem=ordem):
+                resultado = self.resultado(ordem)
+                completo = [linha["videos__title"] for linha in resultado.iterar()]
+                titulos, _ = self.avancar(resultado)
+                self.assertEqual(titulos, completo)
+                self.assertEqual(len(set(titulos)), 33)
+
+        # DATE comparado com date: sem meia-noite de fuso nenhum no parâmetro
+        resultado = self.resultado("ASC")
+        filtro = resultado._filtro_apos(decodificar_cursor(codificar_cursor([datetime.date(2024, 1, 2), "v10"])))
+        _, params = Video.objects.filter(filtro).query.sql_with_params()
+        self.assertIn("2024-01-02", params)
+
+    def test_cursor_invalido_volta_para_a_primeira_pagina(self):
+        resultado = self.resultado("ASC")
+        primeira = resultado.pagina_keyset(tamanho=3)
+        pagina = resultado.pagina_keyset(apos=codificar_cursor(["só um valor"]), tamanho=3)
+        self.assertEqual(list(pagina), list(primeira))
+        self.assertFalse(pagina.has_previous)
+
+
+class GraficoCorpoInvalidoTests(SimpleTestCase):
+    def test_corpo_invalido_responde_400(self):
+        url = reverse("grafico_dinamico_relatorio")
+        for corpo in (b"{nao e json", b"\xff\xfe", b"[1, 2]", b'{"spec": "texto"}'):
+            with self.subTest(corpo=corpo):
+                response = self.client.post(url, corpo, content_type="application/json")
+                self.assertEqual(response.status_code, 400)
+
+    def test_y_e_agregacao_invalidos_respondem_400(self):
+        url = reverse("grafico_dinamico_relatorio")
+        relatorio = "tables=users&fields=users__display_name&fields=users__broadcaster_type"
+        for extra in (
+            "y=users__display_name",
+            "y=users__display_name&agregacao=MAX",
+            "y=videos__title&agregacao=COUNT",
+            "agregacao=MEDIANA",
+        ):
+            with self.subTest(extra=extra):
+                self.assertEqual(self.client.get(f"{url}?{relatorio}&{extra}").status_code, 400)
+        corpo = {"spec": {"tables": ["users"], "fields": ["users__display_name"]}, "y": ["users__display_name"]}
+        self.assertEqual(self.client.post(url, corpo, content_type="application/json").status_code, 400)
+
+
+class CacheLRUTests(SimpleTestCase):
+    def test_peso_em_linhas_despeja_as_menos_usadas(self):
+        cache = CacheLRU(max_peso=10, ttl=60)
+        cache.guardar("a", ["linha"] * 4, peso=4)
+        cache.guardar("b", ["linha"] * 4, peso=4)
+        cache.obter("a")
+        # 4 + 4 + 3 passa de 10: sai "b", a menos usada recentemente
+        cache.guardar("c", ["linha"] * 3, peso=3)
+        self.assertIsNone(cache.obter("b"))
+        self.assertIsNotNone(cache.obter("a"))
+        self.assertIsNotNone(cache.obter("c"))
+        self.assertEqual(cache._peso, 7)
+
+    def test_entrada_maior_que_o_limite_nao_entra(self):
+        cache = CacheLRU(max_peso=10, ttl=60)
+        cache.guardar("a", "valor", peso=1)
+        cache.guardar("grande", "valor", peso=11)
+        self.assertIsNone(cache.obter("grande"))
+        self.assertEqual(cache.obter("a"), "valor")
+
+    def test_regravar_a_chave_nao_soma_o_peso(self):
+        cache = CacheLRU(max_peso=10, ttl=60)
+        cache.guardar("a", "v1", peso=6)
+        cache.guardar("a", "v2", peso=6)
+        self.assertEqual(cache.obter("a"), "v2")
+        self.assertEqual(cache._peso, 6)
+
+    def test_ttl_expira_e_devolve_o_peso(self):
+        cache = CacheLRU(max_peso=10, ttl=60)
+        with mock.patch("reports.cache_resultados.time.monotonic", return_value=1000.0):
+            cache.guardar("a", "valor", peso=5)
+        with mock.patch("reports.cache_resultados.time.monotonic", return_value=1059.0):
+            self.assertEqual(cache.obter("a"), "valor")
+        with mock.patch("reports.cache_resultados.time.monotonic", return_value=1061.0):
+            self.assertIsNone(cache.obter("a"))
+        self.assertEqual(cache._peso, 0)
+
+
+class TabelaDeLigacaoTests(SimpleTestCase):
+    dados = {"tables": ["users", "games"], "fields": ["users__display_name", "games__name"]}
+
+    def test_sem_tabela_de_ligacao_marcada_nao_junta_por_streams(self):
+        self.assertEqual(montar_queryset(self.dados), [])
+        form = ReportForm(self.dados)
+        self.assertFalse(form.is_valid())
+        self.assertIn("Transmissões", form.non_field_errors()[0])
+
+    def test_tabela_de_ligacao_marcada_pelo_usuario(self):
+        dados = {**self.dados, "tables": ["users", "games", "streams"]}
+        self.assertIsInstance(montar_queryset(dados), ResultadoRelatorio)
+        self.assertTrue(ReportForm(dados).is_valid())
+
+
+class ModoBuscaTests(SimpleTestCase):
+    dados = {"tables": ["streams"], "fields": ["streams__title"], "busca_global": "craft"}
+
+    def test_palavras_usa_o_tsvector_de_streams(self):
+        plano = compilar(forma_relatorio(self.dados))
+        self.assertTrue(plano.busca_textual)
+        self.assertEqual(plano.busca, [])
+
+    def test_trecho_mantem_o_icontains(self):
+        plano = compilar(forma_relatorio({**self.dados, "modo_busca": "trecho"}))
+        self.assertFalse(plano.busca_textual)
+        self.assertIn("title", plano.busca)
+        self.assertIn("user__display_name", plano.busca)
+
+
+class FormaRelatorioCatalogoTests(SimpleTestCase):
+    """Campos e operadores fora do catálogo somem da forma (e do plano)."""
+
+    base = {"tables": ["streams"], "fields": ["streams__title"]}
+
+    def forma(self, **dados):
+        return forma_relatorio({**self.base, **dados})
+
+    def test_campos_fora_do_catalogo_sao_ignorados(self):
+        forma = self.forma(fields=["streams__title", "streams__busca", "users__senha", "streams__title__length"])
+        self.assertEqual(forma[2], ("streams__title",))
+
+    def test_filtro_com_campo_ou_operador_invalido_e_ignorado(self):
+        forma = self.forma(
+            filter_field1="streams__viewer_count", filter_operator1="LIKE", filter_value1="10",
+            filter_field2="streams__inexistente", filter_operator2="=", filter_value2="x",
+            logical_operator="AND",
+        )
+        self.assertEqual(forma[3], ())
+        self.assertIsNone(forma[4])
+
+    def test_filtro_valido_e_mantido(self):
+        forma = self.forma(filter_field1="streams__viewer_count", filter_operator1=">", filter_value1="10")
+        self.assertEqual(forma[3], ((("streams__viewer_count", ">"), "filter_value1"),))
+
+    def test_ordenacao_fora_do_catalogo_e_ignorada(self):
+        self.assertIsNone(self.forma(order_field="streams__id; DROP TABLE users")[5])
+        self.assertEqual(self.forma(order_field="streams__viewer_count")[5], "streams__viewer_count")
+
+    def test_soma_e_media_so_em_campo_numerico(self):
+        forma = self.forma(aggregation_field="streams__title", aggregation_function=["SUM", "AVG", "COUNT"])
+        self.assertEqual(forma[7], (("COUNT",), "streams__title"))
+        forma = self.forma(aggregation_field="streams__viewer_count", aggregation_function=["sum", "AVG"])
+        self.assertEqual(forma[7], (("SUM", "AVG"), "streams__viewer_count"))
+
+    def test_agregacao_em_campo_fora_do_catalogo_e_ignorada(self):
+        self.assertIsNone(self.forma(aggregation_field="streams__inexistente", aggregation_function="COUNT")[7])
+
+
+class PeriodoRelatorioTests(SimpleTestCase):
+    periodo = {"data_inicio": "2024-01-01", "data_fim": "2024-01-02"}
+
+    def parametros(self, tabela):
+        resultado = montar_queryset({"tables": [tabela], "fields": [f"{tabela}__title"], **self.periodo})
+        return resultado.qs.query.sql_with_params()[1]
+
+    def test_coluna_date_recebe_datas(self):
+        # [01/01, 03/01) em datas: o dia inicial entra e o seguinte ao fim não
+        for tabela in ("videos", "clips"):
+            with self.subTest(tabela=tabela):
+                params = self.parametros(tabela)
+                self.assertIn("2024-01-01", params)
+                self.assertIn("2024-01-03", params)
+
+    def test_coluna_timestamp_recebe_meia_noite_local(self):
+        # Meia-noite em America/Sao_Paulo = 03:00 UTC
+        params = self.parametros("streams")
+        self.assertIn("2024-01-01 03:00:00", params)
+        self.assertIn("2024-01-03 03:00:00", params)
+
+
+class PaginacaoContagemEstimadaTests(TabelasRelatorioMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        inicio = datetime.date(2024, 1, 1)
+        User.objects.create(id="u1", display_name="Streamer", created_at=inicio)
+        for i in range(3):
+            Video.objects.create(
+                id=f"v{i}", user_id="u1", title=f"Vídeo {i}", url="https://x", language="pt", duration="1h",
+                created_at=inicio,
+            )
+
+    def setUp(self):
+        cache_resultados.limpar()
+        self.addCleanup(cache_resultados.limpar)
+
+    def _builder(self, contagem, **params):
+        with mock.patch("reports.resultados.contar", return_value=contagem):
+            return self.client.get(reverse("builder"), {"tables": "videos", "fields": "videos__title", **params})
+
+    def test_contagem_exata_usa_paginas_numeradas(self):
+        resposta = self._builder((3, True))
+        self.assertFalse(resposta.context["modo_keyset"])
+
+    def test_contagem_estimada_usa_keyset(self):
+        # Estimativa bem acima do real: com o Paginator a página 2 viria vazia
+        resposta = self._builder((5000, False), page="2")
+        self.assertTrue(resposta.context["modo_keyset"])
+        pagina = resposta.context["results"]
+        self.assertEqual(len(pagina), 3)
+        self.assertFalse(pagina.has_next)
+        self.assertEqual(resposta.context["total_resultados"], 5000)
+        self.assertFalse(resposta.context["contagem_exata"])
+
+
+class ConexaoFalsa:
+    """Só o que o pool usa de uma conexão psycopg2."""
+
+    def __init__(self, status=TRANSACTION_STATUS_IDLE, rollback_falha=False, select_falha=False):
+        self.closed = 0
+        self.info = mock.Mock(transaction_status=status)
+        self.rollback_falha = rollback_falha
+        self.select_falha = select_falha
+
+    def rollback(self):
+        if self.rollback_falha:
+            raise psycopg2.InterfaceError("conexão perdida")
+        self.info.transaction_status = TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+    def cursor(self):
+        cursor = mock.MagicMock()
+        if self.select_falha:
+            cursor.__enter__.return_value.execute.side_effect = psycopg2.OperationalError("servidor caiu")
+        return cursor
+
+
+class PoolConexoesTests(SimpleTestCase):
+    def test_pool_cheio_falha_depois_do_timeout(self):
+        pool = PoolConexoes(tamanho_max=1, timeout=0.05)
+        pool.obter(ConexaoFalsa)
+        with self.assertRaises(psycopg2.OperationalError):
+            pool.obter(ConexaoFalsa)
+        self.assertEqual(pool.metricas()["timeouts"], 1)
+        self.assertEqual(pool.metricas()["em_uso"], 1)
+
+    def test_espera_recebe_a_conexao_devolvida(self):
+        pool = PoolConexoes(tamanho_max=1, timeout=5)
+        conexao = pool.obter(ConexaoFalsa)
+        threading.Timer(0.05, pool.devolver, [conexao]).start()
+        self.assertIs(pool.obter(ConexaoFalsa), conexao)
+        self.assertEqual(pool.metricas()["esperas"], 1)
+        self.assertEqual(pool.metricas()["criadas"], 1)
+
+    def test_transacao_aberta_volta_limpa(self):
+        pool = PoolConexoes(tamanho_max=1)
+        conexao = pool.obter(lambda: ConexaoFalsa(status=TRANSACTION_STATUS_INTRANS))
+        pool.devolver(conexao)
+        self.assertEqual(conexao.info.transaction_status, TRANSACTION_STATUS_IDLE)
+        self.assertIs(pool.obter(ConexaoFalsa), conexao)
+
+    def test_conexao_suja_e_descartada(self):
+        pool = PoolConexoes(tamanho_max=1)
+        conexao = pool.obter(lambda: ConexaoFalsa(status=TRANSACTION_STATUS_INERROR, rollback_falha=True))
+        pool.devolver(conexao)
+        self.assertTrue(conexao.closed)
+        self.assertEqual(pool.metricas()["descartadas"], 1)
+        self.assertEqual(pool.metricas()["abertas"], 0)
+        # A vaga volta para o pool: a próxima retirada abre uma conexão nova
+        self.assertIsNot(pool.obter(ConexaoFalsa), conexao)
+
+    def test_conexao_fechada_e_descartada(self):
+        pool = PoolConexoes(tamanho_max=1)
+        conexao = pool.obter(ConexaoFalsa)
+        conexao.closed = 2
+        pool.devolver(conexao)
+        self.assertEqual(pool.metricas()["descartadas"], 1)
+
+    def test_ociosa_que_falha_no_select_e_trocada(self):
+        pool = PoolConexoes(tamanho_max=1, verificar_apos=0)
+        quebrada = pool.obter(lambda: ConexaoFalsa(select_falha=True))
+        pool.devolver(quebrada)
+        nova = pool.obter(ConexaoFalsa)
+        self.assertIsNot(nova, quebrada)
+        self.assertTrue(quebrada.closed)
+        self.assertEqual(pool.metricas()["descartadas"], 1)
+
+    def test_parametros_diferentes_nao_reaproveitam_conexao(self):
+        with mock.patch.dict(pool_postgres._pools, clear=True):
+            principal = {"dbname": "twitch_analytics", "host": "localhost"}
+            pool = obter_pool("default", {}, principal)
+            self.assertIs(obter_pool("default", {}, dict(principal)), pool)
+            ociosa, em_uso = pool.obter(ConexaoFalsa), pool.obter(ConexaoFalsa)
+            pool.devolver(ociosa)
+
+            # O test runner troca o NAME: outro pool, e o anterior é encerrado
+            teste = obter_pool("default", {}, {**principal, "dbname": "test_twitch_analytics"})
+            self.assertIsNot(teste, pool)
+            self.assertIsNot(teste.obter(ConexaoFalsa), ociosa)
+            self.assertTrue(ociosa.closed)
+            pool.devolver(em_uso)
+            self.assertTrue(em_uso.closed)
+            self.assertEqual(pool.metricas()["abertas"], 0)
+
+    def test_conexao_velha_nao_volta_para_o_pool(self):
+        pool = PoolConexoes(tamanho_max=1, vida_max=0.01)
+        conexao = pool.obter(ConexaoFalsa)
+        time.sleep(0.02)
+        pool.devolver(conexao)
+        self.assertTrue(conexao.closed)
+        self.assertEqual(pool.metricas()["ociosas"], 0)
+
+
+@override_settings(REPORTS_REPLICA_MAX_LAG=30, REPORTS_REPLICA_CHECK_INTERVAL=60)
+class ReplicaTests(SimpleTestCase):
+    def setUp(self):
+        self.estado = {"atraso": 0, "versao": "7"}
+        self.verificacoes = 0
+        conexao = mock.MagicMock(vendor="postgresql")
+        cursor = conexao.cursor.return_value.__enter__.return_value
+        cursor.fetchone.side_effect = self._linha_estado
+        for alvo, valor in (
+            ("connections", {replica.ALIAS_REPLICA: conexao}),
+            ("versao_dados", lambda: "7"),
+            ("replica_configurada", lambda: True),
+        ):
+            patcher = mock.patch.object(replica, alvo, valor)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # O estado é global do processo: cada teste começa sem verificação
+        patcher = mock.patch.dict(replica._estado, {"alias": None, "verificado_em": 0.0})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.conexao = conexao
+
+    def _linha_estado(self):
+        self.verificacoes += 1
+        return self.estado["atraso"], self.estado["versao"]
+
+    def test_replica_em_dia_serve_as_leituras(self):
+        self.assertEqual(replica.alias_leitura(), "replica")
+        self.assertEqual(replica.RoteadorReplica().db_for_read(Stream), "replica")
+
+    def test_atraso_acima_do_limite_usa_o_primario(self):
+        self.estado["atraso"] = 45.5
+        with self.assertLogs("reports.replica", "WARNING"):
+            self.assertEqual(replica.alias_leitura(), "default")
+
+    def test_versao_dos_dados_diferente_usa_o_primario(self):
+        self.estado["versao"] = 6
+        with self.assertLogs("reports.replica", "INFO"):
+            self.assertEqual(replica.alias_leitura(), "default")
+
+    def test_replica_sem_resposta_usa_o_primario(self):
+        self.conexao.cursor.side_effect = DatabaseError("recusada")
+        with self.assertLogs("reports.replica", "WARNING"):
+            self.assertEqual(replica.alias_leitura(), "default")
+
+    def test_estado_reaproveitado_ate_o_intervalo(self):
+        replica.alias_leitura()
+        self.estado["atraso"] = 120
+        self.assertEqual(replica.alias_leitura(), "replica")
+        self.assertEqual(self.verificacoes, 1)
+        replica._estado["verificado_em"] -= 61
+        with self.assertLogs("reports.replica", "WARNING"):
+            self.assertEqual(replica.alias_leitura(), "default")
+
+    def test_replica_marcada_indisponivel(self):
+        self.assertEqual(replica.alias_leitura(), "replica")
+        replica.marcar_replica_indisponivel()
+        self.assertEqual(replica.alias_leitura(), "default")
+
+    def test_usando_primario(self):
+        with replica.usando_primario():
+            self.assertEqual(replica.alias_leitura(), "default")
+        self.assertEqual(self.verificacoes, 0)
+        self.assertEqual(replica.alias_leitura(), "replica")
+
+
+class ExecutorImediato:
+    """Roda a tarefa na hora, na thread do teste."""
+
+    def submit(self, funcao, *args):
+        futuro = Future()
+        futuro.set_result(funcao(*args))
+        return futuro
+
+
+class TarefasExportacaoTests(SimpleTestCase):
+    dados = {"tables": ["streams"], "fields": ["streams__title"]}
+
+    def setUp(self):
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        self.diretorio = diretorio.name
+        configuracao = override_settings(REPORTS_EXPORT_JOBS_DIR=self.diretorio, REPORTS_EXPORT_JOB_TTL=3600)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        # A exportação em si não importa aqui: a tarefa fica "na_fila"
+        self.executadas = []
+        for alvo, valor in (
+            ("versao_dados", lambda: "7"),
+            ("_executar", lambda estado, dados: self.executadas.append(estado["id"])),
+            ("_obter_executor", lambda: (ExecutorImediato(), threading.BoundedSemaphore(4))),
+        ):
+            patcher = mock.patch.object(tarefas_exportacao, alvo, valor)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def submeter(self, formato="csv"):
+        return tarefas_exportacao.submeter(self.dados, formato)
+
+    def gravar(self, **mudancas):
+        estado = dict(tarefas_exportacao.ler_estado(self.submeter()["id"]), **mudancas)
+        tarefas_exportacao._gravar_estado(estado)
+        return estado
+
+    def test_mesma_exportacao_nao_roda_duas_vezes(self):
+        primeira = self.submeter()
+        segunda = self.submeter()
+        self.assertEqual(primeira["id"], segunda["id"])
+        self.assertEqual(self.executadas, [primeira["id"]])
+
+    def test_formato_ou_versao_dos_dados_diferente_e_outra_tarefa(self):
+        csv = self.submeter("csv")
+        excel = self.submeter("excel")
+        with mock.patch.object(tarefas_exportacao, "versao_dados", lambda: "8"):
+            nova_carga = self.submeter("csv")
+        self.assertEqual(len({csv["id"], excel["id"], nova_carga["id"]}), 3)
+        self.assertEqual(len(self.executadas), 3)
+
+    def test_tarefa_com_erro_e_refeita(self):
+        estado = self.gravar(status="erro", erro="falhou")
+        self.assertEqual(self.submeter()["status"], "na_fila")
+        self.assertEqual(self.executadas, [estado["id"], estado["id"]])
+
+    def test_tarefa_de_processo_morto_e_refeita(self):
+        estado = self.gravar(status="executando", pid=-1)
+        with mock.patch.object(tarefas_exportacao, "_processo_vivo", lambda pid: pid != -1):
+            self.submeter()
+        self.assertEqual(self.executadas, [estado["id"], estado["id"]])
+
+    def test_concluida_expira_depois_do_ttl(self):
+        estado = self.gravar(status="concluida", atualizado_em=0)
+        arquivo = tarefas_exportacao._caminho_arquivo(estado["id"], "csv")
+        arquivo.write_text("a\n")
+        parcial = arquivo.with_name(f"{estado['id']}.abc123.parcial")
+        parcial.write_text("")
+        self.assertIsNone(tarefas_exportacao.arquivo_concluido(estado["id"]))
+        self.assertEqual(tarefas_exportacao.limpar_expiradas(forcar=True), 1)
+        self.assertIsNone(tarefas_exportacao.ler_estado(estado["id"]))
+        self.assertFalse(arquivo.exists())
+        self.assertFalse(parcial.exists())
+
+    def test_concluida_no_prazo_e_reaproveitada(self):
+        estado = self.gravar(status="concluida")
+        tarefas_exportacao._caminho_arquivo(estado["id"], "csv").write_text("a\n")
+        self.assertEqual(self.submeter()["status"], "concluida")
+        self.assertEqual(tarefas_exportacao.limpar_expiradas(forcar=True), 0)
+        self.assertIsNotNone(tarefas_exportacao.arquivo_concluido(estado["id"]))
+        self.assertEqual(len(self.executadas), 1)
+
+    def test_fila_cheia(self):
+        vagas = threading.BoundedSemaphore(1)
+        vagas.acquire()
+        with mock.patch.object(tarefas_exportacao, "_obter_executor", lambda: (ExecutorImediato(), vagas)):
+            with self.assertRaises(tarefas_exportacao.FilaExportacoesCheia):
+                self.submeter()
+        self.assertEqual(self.executadas, [])
+
+    def test_submissao_travada_entre_processos(self):
+        # Outro processo abre o próprio arquivo de trava: o flock o bloqueia
+        with tarefas_exportacao._submissao_exclusiva():
+            with open(os.path.join(self.diretorio, ".submissao.lock")) as outra:
+                with self.assertRaises(BlockingIOError):
+                    fcntl.flock(outra, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+class LogCargaTrabalhoTests(SimpleTestCase):
+    def setUp(self):
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        self.caminho = os.path.join(diretorio.name, "carga.jsonl")
+
+    def handler(self):
+        # Um handler por "processo" (cada um com o próprio arquivo aberto)
+        handler = _ArquivoRotativoCompartilhado(self.caminho, maxBytes=200, backupCount=10, encoding="utf-8", delay=True)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self.addCleanup(handler.close)
+        return handler
+
+    def escrever(self, handler, numero):
+        handler.handle(logging.makeLogRecord({"msg": '{"n": %d, "texto": "%s"}' % (numero, "x" * 40)}))
+
+    def test_rotacao_de_outro_processo_e_respeitada(self):
+        primeiro, segundo = self.handler(), self.handler()
+        self.escrever(segundo, 0)
+        for numero in range(1, 10):
+            self.escrever(primeiro, numero)
+        self.assertTrue(os.path.exists(f"{self.caminho}.1"))
+        # O segundo reabre o arquivo novo em vez de escrever no renomeado
+        self.escrever(segundo, 10)
+        with open(self.caminho, encoding="utf-8") as arquivo:
+            self.assertIn('"n": 10', arquivo.read().splitlines()[-1])
+        self.assertEqual([linha["n"] for linha in ler_consultas(self.caminho)], list(range(11)))
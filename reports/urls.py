@@ -5,9 +5,15 @@ from .views import grafico_dinamico_relatorio
 
 urlpatterns = [
     path('builder/', views.builder, name='builder'),
+    path('builder/async/', views.builder_async, name='builder_async'),
     path('export/<str:format>/', views.export_data, name='export_data'),
+    path('export/tarefas/<str:format>/', views.exportacao_submeter, name='exportacao_submeter'),
+    path('export/tarefa/<str:tarefa_id>/', views.exportacao_status, name='exportacao_status'),
+    path('export/tarefa/<str:tarefa_id>/download/', views.exportacao_download, name='exportacao_download'),
 
     path('grafico_dinamico_relatorio/', grafico_dinamico_relatorio, name='grafico_dinamico_relatorio'),
+    path('debug/relatorios-lentos/', views.relatorios_lentos_debug, name='relatorios_lentos_debug'),
+    path('debug/pool/', views.pool_conexoes_debug, name='pool_conexoes_debug'),
 ]
 
 
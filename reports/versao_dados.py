@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+# Cache em processo da versão, para não consultar o banco a cada request
+_versao_cache = {"valor": None, "lido_em": 0.0}
+
+
+def versao_dados():
+    """
+    Versão atual dos dados carregados pelo ETL (tabela etl_versao).
+
+    O ETL/load/load_data.py incrementa essa versão ao final de cada carga;
+    tudo que é cacheado a partir dos dados usa ela na chave.
+    """
+    ttl = getattr(settings, "REPORTS_DATA_VERSION_TTL", 5)
+    agora = time.monotonic()
+    if _versao_cache["valor"] is not None and agora - _versao_cache["lido_em"] < ttl:
+        return _versao_cache["valor"]
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT versao FROM etl_versao WHERE id = 1")
+            row = cursor.fetchone()
+        versao = str(row[0]) if row else "0"
+    except DatabaseError:
+        # Banco criado antes da tabela de versão existir
+        versao = "0"
+
+    _versao_cache["valor"] = versao
+    _versao_cache["lido_em"] = agora
+    return versao
@@ -1,411 +1,41 @@
 from django.shortcuts import render
 from django.core.paginator import Paginator
-from .forms import ReportForm, traducoes_modelos
-from django.db.models import Count, Sum, Max, Q, Min, Count, Avg
-from reports.models import User, Stream, Game, Video, Clip
-import csv
+from .forms import ReportForm, AGGREGATION_CHOICES
+from reports.catalogo import catalogo
+from reports.resultados import ResultadoRelatorio
+from reports.cache_resultados import montar_queryset_cacheado
+from reports.query_builder import montar_queryset, separar_agregado, FUNCOES_AGREGACAO
+from reports.spec import normalizar_dados, hash_spec
+from reports.versao_dados import versao_dados
+from reports.cache_graficos import cache_graficos
+from reports.graficos import renderizar_barras, FilaGraficosCheia, TempoEsgotado
+from reports.metricas import metricas_dashboard, metricas_dashboard_async
+from reports.assincrono import em_paralelo
+from reports.carga_trabalho import registrar_consulta
+from reports.instrumentacao import medir_view, LinhasMedidas, relatorios_lentos
+from ad_hoc_django.pool_postgres.pool import metricas_pools
+from reports.exportacao import gerar_csv, gerar_json, gerar_ndjson, escrever_excel, escrever_colunar
+from reports import tarefas_exportacao
+from reports.tarefas_exportacao import FilaExportacoesCheia
+import asyncio
 import json
-import pandas as pd
-import io
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from io import BytesIO
+import tempfile
+import time
+from asgiref.sync import sync_to_async
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse, HttpResponse
-from django.db.models import Q
+from django.http import Http404, JsonResponse, HttpResponse, StreamingHttpResponse, FileResponse, HttpResponseBadRequest, HttpResponseNotModified
+from django.utils.http import parse_etags
+from django.conf import settings
+from django.urls import reverse
 from django import forms
 
-def get_tabelas_e_campos(selected_tables=None):
-    from django.apps import apps
-
-    campos = []
-    column_labels = {}
-    tabelas = []
-
-    campos_permitidos = {
-        'users': ['display_name', 'broadcaster_type', 'id', 'description', 'created_at'],
-        'streams': ['viewer_count', 'language', 'started_at', 'title', 'tags'],
-        'games': ['name'],
-        'videos': ['title', 'url', 'view_count', 'duration', 'created_at', 'language'],
-        'clips': ['title', 'url', 'view_count', 'duration', 'created_at'],
-    }
-    traducoes_campos = {
-        'users': {
-            'display_name': 'Nome do Streamer',
-            'broadcaster_type': 'Tipo de Transmissor',
-            'id': 'ID do Usuário',
-            'description': 'Descrição',
-            'created_at': 'Data de Criação',
-        },
-        'streams': {
-            'viewer_count': 'Visualizações',
-            'language': 'Idioma',
-            'started_at': 'Início da Transmissão',
-            'title': 'Título da Live',
-            'tags': 'Tags',
-        },
-        'games': {
-            'name': 'Nome do Jogo',
-        },
-        'videos': {
-            'title': 'Título do Vídeo',
-            'url': 'Link do Vídeo',
-            'view_count': 'Visualizações',
-            'duration': 'Duração',
-            'created_at': 'Data de Criação',
-            'language': 'Idioma',
-        },
-        'clips': {
-            'title': 'Título do Clipe',
-            'url': 'Link do Clipe',
-            'view_count': 'Visualizações',
-            'duration': 'Duração',
-            'created_at': 'Data de Criação',
-        }
-    }
-
-    models = apps.get_app_config('reports').get_models()
-    for model in models:
-        nome_tabela = model._meta.db_table
-        nome_modelo = model._meta.object_name
-        nome_traduzido = traducoes_modelos.get(nome_tabela, nome_modelo)
-        tabelas.append(nome_tabela)
-
-        if selected_tables is None or nome_tabela in selected_tables:
-            for field in model._meta.fields:
-                nome_campo = field.get_attname_column()[1]
-                if nome_campo not in campos_permitidos.get(nome_tabela, []):
-                    continue
-                chave = f"{nome_tabela}__{nome_campo}"
-                traducao = traducoes_campos.get(nome_tabela, {}).get(nome_campo, nome_campo.title())
-                label = f"{nome_traduzido}: {traducao}"
-                campos.append({"value": chave, "label": label})
-                column_labels[chave] = label
-
-    return tabelas, campos, traducoes_modelos, column_labels
-
-traducoes_modelos = {
-    'users': 'Streamers',
-    'streams': 'Transmissões',
-    'games': 'Jogos',
-    'videos': 'Vídeos',
-    'clips': 'Clipes'
-}
-
-
-
-def get_lookup(operator):
-    return {
-        '=': '',
-        '!=': '',
-        '<': '__lt',
-        '<=': '__lte',
-        '>': '__gt',
-        '>=': '__gte',
-        'LIKE': '__icontains'
-    }.get(operator, '')
-
-def montar_queryset(dados):
-    print("CHAVE FILTER NO INÍCIO:", dados.get("filter"))
-    print("DADOS RECEBIDOS:", dados)
-
-    # Função auxiliar para montar os nomes dos campos do queryset
-    def mapear_campo(f):
-        if f.startswith("users__"):
-            return f.replace("users__", "user__")
-        if f.startswith("streams__"):
-            return f.replace("streams__", "")
-        if f.startswith("games__"):
-            return f.replace("games__", "game__")
-        if f.startswith("clips__"):
-            return f.replace("clips__", "")
-        if f.startswith("videos__"):
-            return f.replace("videos__", "video__")
-        return f
-
-    def get_lookup(op):
-        return {
-            "=": "",
-            "!=": "",
-            "<": "__lt",
-            "<=": "__lte",
-            ">": "__gt",
-            ">=": "__gte",
-            "LIKE": "__icontains"
-        }.get(op, "")
-
-    tabelas = dados.get("tables", [])
-    campos = dados.get("fields", [])
-    order_field = dados.get("order_field")
-    order_type = dados.get("order_type", "ASC").upper()
-
-    # Garante que tabelas e campos são listas
-    if isinstance(tabelas, str):
-        tabelas = [tabelas]
-    if isinstance(campos, str):
-        campos = [campos]
-
-    filtro_rapido = dados.get("filter")
-
-    # ======================
-    # FILTROS RÁPIDOS
-    # ======================
-    if filtro_rapido == "top_streamers":
-        qs = Stream.objects.select_related('user').values(
-            'user__id', 'user__display_name', 'user__broadcaster_type'
-        ).annotate(total_views=Sum('viewer_count')).order_by('-total_views')
-        return [
-            {
-                'users__id': row['user__id'],
-                'users__display_name': row['user__display_name'],
-                'users__broadcaster_type': row['user__broadcaster_type'],
-                'streams__viewer_count': row['total_views'],
-            }
-            for row in qs
-        ]
-
-    if filtro_rapido == "jogos_populares":
-        qs = Stream.objects.select_related('game').values(
-            'game__id', 'game__name'
-        ).annotate(total_views=Sum('viewer_count')).order_by('-total_views')
-        return [
-            {
-                'games__id': row['game__id'],
-                'games__name': row['game__name'],
-                'streams__viewer_count': row['total_views'],
-            }
-            for row in qs
-        ]
-
-    if filtro_rapido == "brpt":
-        idiomas = ["pt", "pt-br", "br"]
-        qs = (
-            Stream.objects
-            .select_related('user')
-            .filter(language__in=idiomas)
-            .values('user__id', 'user__display_name', 'user__broadcaster_type', 'language')
-            .annotate(total_views=Sum('viewer_count'))
-            .order_by('-total_views')
-        )
-        return [
-            {
-                'users__id': row['user__id'],
-                'users__display_name': row['user__display_name'],
-                'users__broadcaster_type': row['user__broadcaster_type'],
-                'streams__language': row['language'],
-                'streams__viewer_count': row['total_views'],
-            }
-            for row in qs
-        ]
-
-    # Agrupa os campos por tabela
-    campos_por_tabela = {}
-    for campo in campos:
-        if "__" in campo:
-            tabela, atributo = campo.split("__", 1)
-        else:
-            tabela, atributo = tabelas[0], campo
-        campos_por_tabela.setdefault(tabela, []).append(atributo)
-
-    # ======================
-    # FILTROS AVANÇADOS
-    # ======================
-    filter_field1 = dados.get("filter_field1")
-    filter_operator1 = dados.get("filter_operator1")
-    filter_value1 = dados.get("filter_value1")
-    filter_field2 = dados.get("filter_field2")
-    filter_operator2 = dados.get("filter_operator2")
-    filter_value2 = dados.get("filter_value2")
-    logical_operator = dados.get("logical_operator")  # 'AND' ou 'OR'
-
-    filtros1 = Q()
-    filtros2 = Q()
-    if filter_field1 and filter_operator1 and filter_value1:
-        field1 = mapear_campo(filter_field1)
-        lookup1 = get_lookup(filter_operator1)
-        filtro_key1 = field1 + lookup1
-        if filter_operator1 == '!=':
-            filtros1 = ~Q(**{filtro_key1: filter_value1})
-        else:
-            filtros1 = Q(**{filtro_key1: filter_value1})
-
-    if filter_field2 and filter_operator2 and filter_value2:
-        field2 = mapear_campo(filter_field2)
-        lookup2 = get_lookup(filter_operator2)
-        filtro_key2 = field2 + lookup2
-        if filter_operator2 == '!=':
-            filtros2 = ~Q(**{filtro_key2: filter_value2})
-        else:
-            filtros2 = Q(**{filtro_key2: filter_value2})
-
-    filtros = Q()
-    if filter_field1 and filter_field2 and logical_operator in ["AND", "OR"]:
-        if logical_operator == "AND":
-            filtros = filtros1 & filtros2
-        else:
-            filtros = filtros1 | filtros2
-    elif filter_field1:
-        filtros = filtros1
-    elif filter_field2:
-        filtros = filtros2
-
-    # ======================
-    # BUSCA GLOBAL
-    # ======================
-    busca_global = dados.get("busca_global", "").strip()
-    filtro_busca_global = Q()
-    if busca_global:
-        filtro_busca_global |= Q(user__display_name__icontains=busca_global)
-        filtro_busca_global |= Q(game__name__icontains=busca_global)
-        filtro_busca_global |= Q(language__icontains=busca_global)
-        filtro_busca_global |= Q(title__icontains=busca_global)
-
-    # ======================
-    # JOIN Streams (users, games, etc)
-    # ======================
-    if "streams" in campos_por_tabela:
-        qs = Stream.objects.select_related('user', 'game')
-
-        # Junta filtros avançados e busca global
-        filtro_total = Q()
-        if filtros:
-            filtro_total &= filtros
-        if filtro_busca_global:
-            filtro_total &= filtro_busca_global
-        if filtro_total:
-            qs = qs.filter(filtro_total)
-
-        # Seleciona os campos para values()
-        values_fields = []
-        campo_to_rowkey = {}
-        for c in campos:
-            if c.startswith("users__"):
-                row_key = f"user__{c.split('__', 1)[1]}"
-            elif c.startswith("games__"):
-                row_key = f"game__{c.split('__', 1)[1]}"
-            elif c.startswith("streams__"):
-                row_key = c.split('__', 1)[1]
-            else:
-                row_key = c
-            values_fields.append(row_key)
-            campo_to_rowkey[c] = row_key
-        qs = qs.values(*values_fields)
-
-        # AGREGAÇÃO (COUNT, SUM, etc)
-        aggregation_function = dados.get("aggregation_function")
-        aggregation_field = dados.get("aggregation_field")
-        if aggregation_function and aggregation_field:
-            campo_agg = aggregation_field.split('__', 1)[-1] if '__' in aggregation_field else aggregation_field
-            func_map = {
-                "COUNT": Count,
-                "SUM": Sum,
-                "AVG": Avg,
-                "MAX": Max,
-                "MIN": Min,
-            }
-            func = func_map.get(aggregation_function.upper())
-            if func:
-                qs_agg = qs.aggregate(resultado=func(campo_agg))
-                return [{
-                    "Agregação": f"{aggregation_function.upper()}({campo_agg})",
-                    "Resultado": qs_agg["resultado"]
-                }]
-
-        # ORDENAÇÃO
-        if order_field:
-            if order_field.startswith("users__"):
-                qs = qs.order_by(
-                    f"user__{order_field.split('__', 1)[1]}"
-                    if order_type == "ASC" else
-                    f"-user__{order_field.split('__', 1)[1]}"
-                )
-            elif order_field.startswith("games__"):
-                qs = qs.order_by(
-                    f"game__{order_field.split('__', 1)[1]}"
-                    if order_type == "ASC" else
-                    f"-game__{order_field.split('__', 1)[1]}"
-                )
-            elif order_field.startswith("streams__"):
-                qs = qs.order_by(
-                    f"{order_field.split('__', 1)[1]}"
-                    if order_type == "ASC" else
-                    f"-{order_field.split('__', 1)[1]}"
-                )
-            else:
-                qs = qs.order_by(order_field if order_type == "ASC" else f"-{order_field}")
-
-        resultado_temp = [
-            {campo: row.get(campo_to_rowkey[campo], "") for campo in campos}
-            for row in qs
-        ]
-        print("LINHAS DO JOIN (debug):", resultado_temp[:5])
-        return resultado_temp
-
-    # ======================
-    # Relatórios de outras tabelas (exemplo para Clips)
-    # ======================
-    if "clips" in campos_por_tabela:
-        qs = Clip.objects.select_related('user', 'video', 'game')
-        filtro_total = Q()
-        if filtros:
-            filtro_total &= filtros
-        if filtro_busca_global:
-            filtro_total &= filtro_busca_global
-        if filtro_total:
-            qs = qs.filter(filtro_total)
-        values_fields = []
-        for c in campos:
-            if c.startswith("users__"):
-                values_fields.append(f"user__{c.split('__', 1)[1]}")
-            elif c.startswith("games__"):
-                values_fields.append(f"game__{c.split('__', 1)[1]}")
-            elif c.startswith("videos__"):
-                values_fields.append(f"video__{c.split('__', 1)[1]}")
-            elif c.startswith("clips__"):
-                values_fields.append(c.split('__', 1)[1])
-            else:
-                values_fields.append(c)
-        qs = qs.values(*values_fields)
-        return [
-            {f: row.get(mapear_campo(f), "") for f in campos}
-            for row in qs
-        ]
-
-    # ======================
-    # Fallback: só uma tabela (users, games, etc)
-    # ======================
-    if len(campos_por_tabela) == 1:
-        tabela = list(campos_por_tabela.keys())[0]
-        model = {
-            "users": User,
-            "streams": Stream,
-            "games": Game,
-            "videos": Video,
-            "clips": Clip
-        }[tabela]
-        qs = model.objects.all()
-        filtro_total = Q()
-        if filtros:
-            filtro_total &= filtros
-        if filtro_busca_global:
-            filtro_total &= filtro_busca_global
-        if filtro_total:
-            qs = qs.filter(filtro_total)
-        qs = qs.values(*[f.split("__", 1)[1] for f in campos])
-        if order_field and order_field.startswith(f"{tabela}__"):
-            field = order_field.split("__", 1)[1]
-            qs = qs.order_by(field if order_type == "ASC" else f"-{field}")
-        return [{f: row.get(f.split("__", 1)[1], "") for f in campos} for row in qs]
-
-    # Se nada se aplica, retorna lista vazia
-    return []
-
-
-
-def builder(request):
+def preparar_builder(request):
+    """
+    Parte do builder que não toca no banco, comum às versões síncrona e
+    assíncrona: aplica filtro rápido e busca global aos parâmetros e monta o
+    form. Devolve os dados do relatório e o contexto inicial do template.
+    """
     get_data = request.GET.copy()
-    print("GET_DATA RECEBIDO:", get_data)
     filtro_rapido = get_data.get("filter")
     busca_global = get_data.get("busca_global", "").strip()
 
@@ -457,13 +87,11 @@ def builder(request):
                 "games__name"
             ])
 
-    print("ANTES DO FORM, GET_DATA:", get_data)
-
     selected_tables = get_data.getlist("tables") if get_data else []
-    tabelas, campos, traducoes_modelos, column_labels = get_tabelas_e_campos(selected_tables)
+    column_labels = catalogo().rotulos
 
-    # Gera os choices para os campos de filtro dinâmico
-    campos_choices = [(f["value"].replace(".", "__"), f["label"]) for f in campos] if campos else []
+    # Choices dos campos das tabelas selecionadas (filtros dinâmicos)
+    campos_choices = catalogo().choices_campos(selected_tables)
 
     # Inicializa o form, agora aceitando os choices dinâmicos
     form = ReportForm(
@@ -488,76 +116,121 @@ def builder(request):
         form.fields["filter_field1"].choices = []
         form.fields["filter_field2"].choices = []
 
-    results = []
-    preview_query = ""
-    queryset = None
-
     # Coleta dados do form
     if form.is_valid() and not filtro_rapido:
         data = form.cleaned_data
     else:
         data = get_data
 
-    queryset = montar_queryset(data)
-    preview_query = '[Query baseada no ORM e nos joins automáticos]'
+    # Querystring sem os parâmetros de página, para os links de navegação
+    querystring_base = request.GET.copy()
+    for chave in ("page", "after", "before"):
+        querystring_base.pop(chave, None)
 
-    if isinstance(queryset, list):
-        results = queryset
-    else:
-        results = list(queryset)
-    print("RESULTS PARA TEMPLATE (final):", results[:3])
-
-    paginator = Paginator(results, 10)
-    page_number = request.GET.get("page")
-    results_paginated = paginator.get_page(page_number)
-
-    # Métricas rápidas
-    total_streamers = User.objects.count()
-    total_views = Stream.objects.aggregate(total=Sum("viewer_count"))["total"] or 0
-    popular_games = Stream.objects.values('game_id').annotate(total=Sum('viewer_count')).order_by('-total')
-    if popular_games:
-        game_id = popular_games[0]['game_id']
-        game_name = Game.objects.filter(id=game_id).first().name if game_id else 'N/A'
+    return data, {
+        "form": form,
+        "querystring_base": querystring_base.urlencode(),
+        "spec_relatorio": normalizar_dados(data),
+        "preview_query": '[Query baseada no ORM e nos joins automáticos]',
+        "selected_tables": selected_tables,
+        "column_labels": column_labels,
+    }
+
+
+def pagina_relatorio(request, data, column_labels):
+    """
+    Executa o relatório e busca a página pedida (offset ou keyset), com o
+    total de linhas e os rótulos das colunas agregadas.
+    """
+    # Resultado preguiçoso: o Paginator só busca a página pedida (LIMIT/OFFSET),
+    # e páginas já vistas do mesmo relatório vêm do cache de resultados
+    inicio = time.perf_counter()
+    results = montar_queryset_cacheado(data)
+
+    # Total de linhas: estimado em tabelas grandes ("~1,2M resultados")
+    if isinstance(results, list):
+        total_resultados, contagem_exata = len(results), True
     else:
-        game_name = 'N/A'
-    idioma_mais_falado = (
-        Stream.objects.values("language")
-        .annotate(total=Count("language"))
-        .order_by("-total")
-        .first()
+        total_resultados, contagem_exata = results.count(), results.contagem_exata
+
+    # Modo keyset: cursores "after"/"before" no lugar de ?page=N. Com o total
+    # estimado é obrigatório: o Paginator numeraria as páginas pela estimativa,
+    # com páginas finais vazias (acima do real) ou escondidas (abaixo)
+    modo_keyset = hasattr(results, "pagina_keyset") and (
+        request.GET.get("paginacao") == "keyset" or not contagem_exata
     )
-    ultima_atualizacao = Stream.objects.aggregate(ultima=Max("started_at"))["ultima"]
-    if ultima_atualizacao:
-        ultima_atualizacao_str = ultima_atualizacao.strftime("%d/%m/%Y %H:%M")
+    if modo_keyset:
+        results_paginated = results.pagina_keyset(
+            apos=request.GET.get("after"),
+            antes=request.GET.get("before"),
+            tamanho=10,
+        )
     else:
-        ultima_atualizacao_str = "--"
+        paginator = Paginator(results, 10)
+        page_number = request.GET.get("page")
+        results_paginated = paginator.get_page(page_number)
+
+    # Campos usados e latência (montagem + contagem + página) para o
+    # comando sugerir_indices
+    registrar_consulta(data, time.perf_counter() - inicio)
+    request.medicao.contar_linhas(len(results_paginated))
+
+    # Rótulos das colunas agregadas (ex.: "Soma (SUM): Transmissões: Visualizações")
+    column_labels = dict(column_labels)
+    rotulos_agregacao = dict(AGGREGATION_CHOICES)
+    for chave in getattr(results, "colunas", {}):
+        funcao, campo = separar_agregado(chave)
+        if funcao:
+            column_labels[chave] = f"{rotulos_agregacao[funcao]}: {column_labels.get(campo, campo)}"
 
-    print("RESULTS PARA TEMPLATE (final):", results[:3])
-    print("RESULTS NO RENDER:", results[0].keys() if results else [])
-    return render(request, "reports/builder.html", {
-        "form": form,
+    return {
         "results": results_paginated,
-        "preview_query": preview_query,
-        "selected_tables": selected_tables,
+        "modo_keyset": modo_keyset,
+        "total_resultados": total_resultados,
+        "contagem_exata": contagem_exata,
         "column_labels": column_labels,
-        "total_streamers": total_streamers,
-        "total_views": total_views,
-        "jogo_mais_popular": game_name,
-        "idioma_mais_falado": idioma_mais_falado["language"] if idioma_mais_falado else "N/A",
-        "ultima_atualizacao": ultima_atualizacao_str,
-    })
+    }
+
+
+@medir_view("builder")
+def builder(request):
+    data, contexto = preparar_builder(request)
+    contexto.update(pagina_relatorio(request, data, contexto["column_labels"]))
+
+    # Métricas rápidas (cacheadas até a próxima carga do ETL)
+    contexto.update(metricas_dashboard())
+
+    with request.medicao.renderizando():
+        return render(request, "reports/builder.html", contexto)
+
+
+@medir_view("builder_async")
+async def builder_async(request):
+    """
+    Builder assíncrono (servido pelo ad_hoc_django/asgi.py): o relatório e
+    cada métrica do painel rodam ao mesmo tempo, cada um numa conexão
+    própria. A página leva o tempo da consulta mais lenta, não a soma, e o
+    worker não fica preso esperando o Postgres.
+    """
+    data, contexto = preparar_builder(request)
+    pagina, metricas = await asyncio.gather(
+        em_paralelo(pagina_relatorio, request, data, contexto["column_labels"]),
+        metricas_dashboard_async(),
+    )
+    contexto.update(pagina)
+    contexto.update(metricas)
+
+    with request.medicao.renderizando():
+        return await sync_to_async(render)(request, "reports/builder.html", contexto)
+
 
+@medir_view("export")
 def export_data(request, format):
     get_data = request.GET.copy()
-    print("GET_DATA RECEBIDO NO EXPORT:", get_data)
+    request.medicao.tipo = f"export_{format}"
 
     # Sempre garanta que múltiplos campos vão como lista
-    data_dict = {}
-    for k in get_data.keys():
-        v = get_data.getlist(k)
-        data_dict[k] = v if len(v) > 1 else v[0]
-
-    print("DADOS DICT EXPORTAÇÃO:", data_dict)
+    data_dict = normalizar_dados(get_data)
 
     # Pegue os fields e tables do dict normalizado
     fieldnames = data_dict.get("fields", [])
@@ -566,84 +239,226 @@ def export_data(request, format):
     tables = data_dict.get("tables", [])
     if isinstance(tables, str):
         tables = [tables]
-    print("CAMPOS ENVIADOS PARA EXPORTAÇÃO:", fieldnames)
-    print("TABELAS ENVIADAS PARA EXPORTAÇÃO:", tables)
 
     if not fieldnames or not tables:
         return HttpResponse("Nenhum campo ou tabela selecionado.", status=400)
 
     queryset = montar_queryset(data_dict)
-    data = list(queryset)
-    print("DATA PARA EXPORTAR:", data[:3])
-
-    if not data:
-        data = [{}]
-
-    export_data = []
-    for row in data:
-        # Usa os nomes exatos que o usuário selecionou
-        linha = {campo: row.get(campo, "") for campo in fieldnames}
-        export_data.append(linha)
+    # Com agregação as colunas são as do resultado (grupo + uma por função)
+    if isinstance(queryset, ResultadoRelatorio):
+        fieldnames = list(queryset.colunas)
+    elif queryset:
+        fieldnames = list(queryset[0])
+    # Conta as linhas entregues para a instrumentação
+    queryset = LinhasMedidas(queryset, request.medicao)
 
     if format == "csv":
-        response = HttpResponse(content_type="text/csv")
+        # Streaming direto do cursor: memória constante e primeiros bytes imediatos
+        response = StreamingHttpResponse(gerar_csv(queryset, fieldnames), content_type="text/csv")
         response["Content-Disposition"] = "attachment; filename=relatorio.csv"
-        writer = csv.DictWriter(response, fieldnames=fieldnames)
-        writer.writeheader()
-        for row in export_data:
-            writer.writerow(row)
         return response
 
     elif format == "json":
-        response = HttpResponse(content_type="application/json")
+        response = StreamingHttpResponse(gerar_json(queryset, fieldnames), content_type="application/json")
         response["Content-Disposition"] = "attachment; filename=relatorio.json"
-        response.write(json.dumps(export_data, ensure_ascii=False, indent=2))
+        return response
+
+    elif format == "ndjson":
+        response = StreamingHttpResponse(gerar_ndjson(queryset, fieldnames), content_type="application/x-ndjson")
+        response["Content-Disposition"] = "attachment; filename=relatorio.ndjson"
         return response
 
     elif format == "excel":
-        output = io.BytesIO()
-        df = pd.DataFrame(export_data, columns=fieldnames)
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name="Relatório")
-        response = HttpResponse(
-            output.getvalue(),
+        # Escreve num arquivo temporário (apagado quando o FileResponse fecha)
+        # e devolve o arquivo em streaming
+        arquivo = tempfile.TemporaryFile()
+        escrever_excel(queryset, fieldnames, arquivo)
+        arquivo.seek(0)
+        return FileResponse(
+            arquivo,
+            as_attachment=True,
+            filename="relatorio.xlsx",
             content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
-        response["Content-Disposition"] = "attachment; filename=relatorio.xlsx"
-        return response
+
+    elif format in ("parquet", "arrow"):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return HttpResponse("Formato indisponível: instale o pyarrow.", status=501)
+        arquivo = tempfile.TemporaryFile()
+        escrever_colunar(queryset, fieldnames, arquivo, format)
+        arquivo.seek(0)
+        if format == "parquet":
+            return FileResponse(arquivo, as_attachment=True, filename="relatorio.parquet",
+                                content_type="application/vnd.apache.parquet")
+        return FileResponse(arquivo, as_attachment=True, filename="relatorio.arrow",
+                            content_type="application/vnd.apache.arrow.file")
 
     else:
         return HttpResponse("Formato não suportado.", status=400)
 
 
+def _estado_tarefa(estado):
+    dados = tarefas_exportacao.progresso(estado)
+    dados["url_status"] = reverse("exportacao_status", args=[estado["id"]])
+    if estado["status"] == "concluida":
+        dados["url_download"] = reverse("exportacao_download", args=[estado["id"]])
+    return dados
+
+
+def exportacao_submeter(request, format):
+    # Exportação em segundo plano: devolve o id da tarefa na hora e o
+    # arquivo é escrito por um worker local (reports.tarefas_exportacao)
+    if request.method != "POST":
+        return JsonResponse({"erro": "Só POST"}, status=405)
+    if format not in tarefas_exportacao.FORMATOS:
+        return JsonResponse({"erro": "Formato não suportado."}, status=400)
+    if format in ("parquet", "arrow"):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return JsonResponse({"erro": "Formato indisponível: instale o pyarrow."}, status=501)
+
+    dados = normalizar_dados(request.GET)
+    if not dados.get("fields") or not dados.get("tables"):
+        return JsonResponse({"erro": "Nenhum campo ou tabela selecionado."}, status=400)
+
+    try:
+        estado = tarefas_exportacao.submeter(dados, format)
+    except FilaExportacoesCheia:
+        response = JsonResponse({"erro": "Muitas exportações em andamento, tente novamente"}, status=503)
+        response["Retry-After"] = "30"
+        return response
+    return JsonResponse(_estado_tarefa(estado), status=202)
+
+
+def exportacao_status(request, tarefa_id):
+    estado = tarefas_exportacao.ler_estado(tarefa_id)
+    if estado is None:
+        raise Http404
+    return JsonResponse(_estado_tarefa(estado))
+
+
+def exportacao_download(request, tarefa_id):
+    arquivo = tarefas_exportacao.arquivo_concluido(tarefa_id)
+    if arquivo is None:
+        raise Http404
+    caminho, nome, content_type = arquivo
+    return FileResponse(open(caminho, "rb"), as_attachment=True, filename=nome, content_type=content_type)
+
+
+def campo_numerico(campo):
+    funcao, campo = separar_agregado(campo)
+    if funcao in ("COUNT", "AVG"):
+        return True
+    definicao = catalogo().campo(campo)
+    return definicao is not None and definicao.numerico
+
+
 @csrf_exempt
 def grafico_dinamico_relatorio(request):
+    # Recebe só a definição do relatório (JSON no POST ou querystring no GET);
+    # a série é agregada no banco
     if request.method == "POST":
-        dados = json.loads(request.body.decode('utf-8'))
-        colunas = dados["columns"]
-        linhas = dados["rows"]
-
-        x = [row[colunas[0]] for row in linhas]
-        y = []
-        for c in colunas:
-            if c != colunas[0]:
-                try:
-                    y = [float(row[c]) if row[c] else 0 for row in linhas]
-                    break
-                except Exception:
-                    continue
-
-        fig, ax = plt.subplots(figsize=(9, 4))
-        ax.bar(x, y)
-        ax.set_xlabel(colunas[0])
-        ax.set_ylabel(colunas[1] if len(colunas) > 1 else "Valor")
-        ax.set_title("Gráfico Dinâmico do Relatório")
-        plt.tight_layout()
-
-        buf = BytesIO()
-        plt.savefig(buf, format="png")
-        plt.close(fig)
-        buf.seek(0)
-        return HttpResponse(buf, content_type='image/png')
-
-    return JsonResponse({"erro": "Só POST"}, status=405)
+        try:
+            corpo = json.loads(request.body.decode('utf-8'))
+        except (ValueError, UnicodeDecodeError):
+            return HttpResponseBadRequest("Corpo precisa ser um JSON válido.")
+        spec = corpo.get("spec", {}) if isinstance(corpo, dict) else None
+        if not isinstance(spec, dict):
+            return HttpResponseBadRequest("O JSON precisa ser um objeto com \"spec\" também objeto.")
+    elif request.method == "GET":
+        corpo = request.GET
+        spec = request.GET.copy()
+        for chave in ("x", "y", "agregacao"):
+            spec.pop(chave, None)
+    else:
+        return JsonResponse({"erro": "Só GET ou POST"}, status=405)
+
+    dados = normalizar_dados(spec)
+    campos = dados.get("fields", [])
+    if isinstance(campos, str):
+        campos = [campos]
+
+    resultado = montar_queryset(dados)
+    if isinstance(resultado, ResultadoRelatorio):
+        campo_x = corpo.get("x") or (campos[0] if campos else None)
+        if not isinstance(campo_x, str) or campo_x not in resultado.colunas:
+            campo_x = next(iter(resultado.colunas), None)
+        agregacao = str(corpo.get("agregacao") or "SUM").upper()
+        if agregacao not in FUNCOES_AGREGACAO:
+            return HttpResponseBadRequest(f"\"agregacao\" precisa ser uma de: {', '.join(FUNCOES_AGREGACAO)}.")
+        campo_y = corpo.get("y") or next(
+            (c for c in resultado.colunas if c != campo_x and campo_numerico(c)), None
+        )
+        if campo_y is not None:
+            if not isinstance(campo_y, str) or campo_y not in resultado.colunas:
+                return HttpResponseBadRequest("\"y\" precisa ser uma coluna do relatório.")
+            # Só o COUNT aceita texto; num relatório já agrupado (filtros
+            # rápidos) os valores de y vão direto para o gráfico
+            if (agregacao != "COUNT" or resultado.agrupado) and not campo_numerico(campo_y):
+                return HttpResponseBadRequest(f"\"y\" precisa ser numérico para {agregacao}.")
+    else:
+        # Agregação simples: uma linha com rótulo e resultado
+        campo_x, campo_y, agregacao = "Agregação", "Resultado", None
+
+    # Chave pelo conteúdo: definição normalizada do gráfico + versão dos dados
+    chave = hash_spec(
+        {"spec": dados, "x": campo_x, "y": campo_y, "agregacao": agregacao},
+        versao_dados(),
+    )
+    etag = f'"{chave}"'
+    cabecalhos = {
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={settings.REPORTS_CHART_MAX_AGE}",
+    }
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = HttpResponseNotModified()
+        for nome, valor in cabecalhos.items():
+            response[nome] = valor
+        return response
+
+    png = cache_graficos.obter(chave)
+    if png is None:
+        if agregacao:
+            serie = resultado.agrupar(campo_x, campo_y, FUNCOES_AGREGACAO[agregacao]) if campo_x else []
+        else:
+            serie = [(row.get(campo_x), row.get(campo_y)) for row in resultado]
+        column_labels = catalogo().rotulos
+        try:
+            png = renderizar_barras(
+                serie,
+                column_labels.get(campo_x, campo_x or ""),
+                column_labels.get(campo_y, campo_y) if campo_y else "Quantidade",
+            )
+        except FilaGraficosCheia:
+            response = JsonResponse({"erro": "Muitos gráficos em geração, tente novamente"}, status=503)
+            response["Retry-After"] = "5"
+            return response
+        except TempoEsgotado:
+            return JsonResponse({"erro": "Tempo esgotado ao gerar o gráfico"}, status=504)
+        cache_graficos.guardar(chave, png)
+
+    response = HttpResponse(png, content_type='image/png')
+    for nome, valor in cabecalhos.items():
+        response[nome] = valor
+    return response
+
+
+def relatorios_lentos_debug(request):
+    # Só com DEBUG: expõe definições de relatório e SQL
+    if not settings.DEBUG:
+        raise Http404
+    try:
+        limite = int(request.GET.get("limite", 20))
+    except ValueError:
+        limite = 20
+    return JsonResponse({"relatorios": relatorios_lentos(limite)}, json_dumps_params={"ensure_ascii": False})
+
+
+def pool_conexoes_debug(request):
+    # Só em desenvolvimento: conexões em uso/ociosas e espera do pool
+    if not settings.DEBUG:
+        raise Http404
+    return JsonResponse({"pools": metricas_pools()})